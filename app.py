@@ -11,6 +11,10 @@ import random
 from werkzeug.utils import secure_filename
 import io
 import shutil
+import tempfile
+import atexit
+import threading
+import uuid
 from pathlib import Path
 
 # Import core modules
@@ -21,37 +25,61 @@ from main import (
     PerformanceComparer, 
     ConfigManager,
     DataVisualizer,
-    SampleDataGenerator
+    SampleDataGenerator,
+    WorkloadIngester,
+    WhatIfAnalyzer,
+    IndexAuditor,
+    WorkloadReplayer
 )
 
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = 'index_recommendation_secret_key'
 
-# Initialize configuration
-config_manager = ConfigManager()
-db_file = config_manager.get('DATABASE', 'db_file', 'index_recommendation.db')
-backup_dir = config_manager.get('DATABASE', 'backup_directory', 'backups')
-
-# Ensure backup directory exists
-os.makedirs(backup_dir, exist_ok=True)
-
-# Create database connection with thread-safe settings
-db_manager = DatabaseManager(db_file)
-db_manager.connect()  # Establish the connection immediately with check_same_thread=False
-db_manager.setup_tables()  # Setup tables with the established connection
+# Batch index comparisons run in the background; clients poll their progress
+# and finished jobs are forgotten after BATCH_JOB_TTL seconds
+BATCH_JOB_TTL = 3600
+batch_jobs = {}
+batch_jobs_lock = threading.Lock()
+
+# The batch comparison workers are spawned processes that re-import this
+# module as __mp_main__; they only need main.py, not the app's database setup
+if __name__ != '__mp_main__':
+    # Initialize configuration
+    config_manager = ConfigManager()
+    db_file = config_manager.get('DATABASE', 'db_file', 'index_recommendation.db')
+    backup_dir = config_manager.get('DATABASE', 'backup_directory', 'backups')
+
+    # Ensure backup directory exists
+    os.makedirs(backup_dir, exist_ok=True)
+
+    # Create database connection with thread-safe settings
+    db_manager = DatabaseManager(db_file)
+    db_manager.connect()  # Establish the connection immediately with check_same_thread=False
+    db_manager.setup_tables()  # Setup tables with the established connection
+
+    # Create other managers with the database connection
+    query_monitor = QueryMonitor(db_manager, config_manager)
+    index_recommender = IndexRecommender(db_manager, config_manager)
+    performance_comparer = PerformanceComparer(db_manager, config_manager)
+    data_visualizer = DataVisualizer(db_manager, config_manager)
+    workload_ingester = WorkloadIngester(db_manager)
+    what_if_analyzer = WhatIfAnalyzer(db_manager)
+    index_auditor = IndexAuditor(db_manager, index_recommender)
+    workload_replayer = WorkloadReplayer(db_manager, config_manager, performance_comparer)
+
+    # Optional - create sample data if tables are empty
+    tables = db_manager.get_tables()
+    if not tables or ('users' not in tables or 'products' not in tables or 'orders' not in tables):
+        sample_data_generator = SampleDataGenerator(db_manager)
+        sample_data_generator.generate_sample_data()
 
-# Create other managers with the database connection
-query_monitor = QueryMonitor(db_manager)
-index_recommender = IndexRecommender(db_manager)
-performance_comparer = PerformanceComparer(db_manager)
-data_visualizer = DataVisualizer(db_manager, config_manager)
+    # Fingerprint logged queries and move their plans into the plan store if they predate both
+    query_monitor.backfill_fingerprints()
+    query_monitor.backfill_execution_plans()
 
-# Optional - create sample data if tables are empty
-tables = db_manager.get_tables()
-if not tables or ('users' not in tables or 'products' not in tables or 'orders' not in tables or 'query_logs' not in tables):
-    sample_data_generator = SampleDataGenerator(db_manager)
-    sample_data_generator.generate_sample_data()
+    # Write out buffered query logs before the process exits
+    atexit.register(query_monitor.close)
 
 # Helper functions
 def get_current_database():
@@ -275,14 +303,14 @@ def run_query():
         return jsonify({'error': 'No query provided'})
     
     try:
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # For EXPLAIN queries, we handle them differently
         if query.strip().upper().startswith('EXPLAIN'):
             rows = db_manager.execute_and_fetch(query)
             execution_plan = "\n".join([str(dict(row)) for row in rows])
             
-            end_time = time.time()
+            end_time = time.perf_counter()
             execution_time = end_time - start_time
             
             return jsonify({
@@ -292,30 +320,28 @@ def run_query():
                 'columns': []
             })
         
-        # For normal queries, log them and return results
-        execution_time, execution_plan, query_id = query_monitor.capture_query(query)
+        # For normal queries, log them (subject to sampling) and return results
+        captured = query_monitor.capture(query)
         
-        if execution_time is None:
-            return jsonify({'error': execution_plan})  # execution_plan contains error message in this case
-        
-        # Fetch results
-        results = db_manager.cursor.fetchall()
+        if 'error' in captured:
+            return jsonify({'error': captured['error']})
         
         # Convert results to a list of dictionaries
         result_list = []
-        columns = []
+        columns = captured.get('columns', [])
         
-        if results:
-            columns = [column[0] for column in db_manager.cursor.description]
-            for row in results:
-                result_dict = {}
-                for i, column in enumerate(columns):
-                    result_dict[column] = row[i]
-                result_list.append(result_dict)
+        for row in captured.get('rows', []):
+            result_dict = {}
+            for i, column in enumerate(columns):
+                result_dict[column] = row[i]
+            result_list.append(result_dict)
         
         return jsonify({
-            'execution_time': execution_time,
-            'execution_plan': execution_plan,
+            'execution_time': captured['execution_time'],
+            'first_row_time': captured.get('first_row_time'),
+            'step_time': captured.get('step_time'),
+            'rows_returned': captured.get('rows_returned', 0),
+            'execution_plan': captured['execution_plan'],
             'results': result_list,
             'columns': columns
         })
@@ -326,8 +352,12 @@ def run_query():
 def index_recommendations():
     """Render the index recommendations page."""
     try:
-        # Get real recommendations
-        recommendations = index_recommender.analyze()
+        # Get real recommendations, optionally for the last few hours only
+        hours = request.args.get('hours', type=int)
+        start = None
+        if hours:
+            start = (datetime.utcnow() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+        recommendations = index_recommender.analyze(start=start)
         
         # If we don't have enough real data, add some mock data
         if len(recommendations) < 3:
@@ -365,14 +395,52 @@ def performance_metrics():
     """Render the performance metrics page."""
     stats = generate_mock_stats()
     performance_data = generate_performance_data()
+    latency_data = {}
+    for period in ('daily', 'weekly', 'monthly'):
+        # Use the real rollups once there is logged data for the period
+        data = data_visualizer.get_query_performance_data(period)
+        if data.get('labels'):
+            performance_data[period] = {'labels': data['labels'], 'avg_query_time': data['values']}
+        data = data_visualizer.get_latency_percentile_data(period)
+        latency_data[period] = data if 'error' not in data else {'labels': [], 'p50': [], 'p95': [], 'p99': []}
     
     return render_template(
         'performance_metrics.html',
         stats=stats,
         performance_data=performance_data,
+        latency_data=latency_data,
         current_database=get_current_database()
     )
 
+@app.route('/api/latency-percentiles')
+def latency_percentiles():
+    """API endpoint to get p50/p95/p99 latencies from the stored sketches."""
+    try:
+        fingerprint = request.args.get('fingerprint')
+        hours = request.args.get('hours', type=int)
+        start = None
+        if hours:
+            start = (datetime.utcnow() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+            
+        percentiles = query_monitor.get_latency_percentiles(fingerprint=fingerprint, start=start)
+        # Convert to milliseconds for display
+        result = {key: (round(value * 1000, 3) if value is not None else None)
+                  for key, value in percentiles.items() if key != 'count'}
+        result['count'] = percentiles.get('count', 0)
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)})
+
+@app.route('/api/performance-data/<period>')
+def performance_data(period):
+    """API endpoint to get average query time chart data for a period."""
+    return jsonify(data_visualizer.get_query_performance_data(period))
+
+@app.route('/api/latency-data/<period>')
+def latency_data(period):
+    """API endpoint to get latency percentile chart data for a period."""
+    return jsonify(data_visualizer.get_latency_percentile_data(period))
+
 @app.route('/settings')
 def settings():
     """Render the settings page."""
@@ -476,9 +544,9 @@ def apply_index():
 def refresh_analysis():
     """API endpoint to refresh the index analysis."""
     try:
-        # Here we would normally trigger a reanalysis of the database
-        # For this demo, we'll just return success
-        return jsonify({'success': True})
+        # Fold in the queries logged since the last analysis
+        processed = index_recommender.refresh()
+        return jsonify({'success': True, 'processed': processed})
     except Exception as e:
         return jsonify({'error': str(e)})
 
@@ -513,15 +581,33 @@ def clear_logs():
     """API endpoint to clear query logs."""
     try:
         retention_days = int(config_manager.get('ANALYSIS', 'log_retention_days', '30'))
-        cutoff_date = (datetime.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+        # Partitions and log timestamps are UTC
+        cutoff_date = (datetime.utcnow() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
         
-        db_manager.execute("DELETE FROM query_logs WHERE date(timestamp) < ?", (cutoff_date,))
-        db_manager.commit()
+        deleted = query_monitor.clear_logs(cutoff_date)
         
-        return jsonify({'success': True})
+        return jsonify({'success': True, 'deleted': deleted})
     except Exception as e:
         return jsonify({'error': str(e)})
 
+@app.route('/api/ingest-workload', methods=['POST'])
+def ingest_workload():
+    """API endpoint to load an uploaded workload trace (JSONL, JSON, CSV or SQL) into the query logs."""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': 'No workload file provided'})
+    
+    upload_dir = tempfile.mkdtemp(prefix='workload_')
+    try:
+        path = os.path.join(upload_dir, secure_filename(upload.filename) or 'workload')
+        upload.save(path)
+        stats = workload_ingester.ingest(path, request.form.get('format') or None)
+        return jsonify({'success': True, **stats})
+    except Exception as e:
+        return jsonify({'error': str(e)})
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
 @app.route('/api/export-report')
 def export_report():
     """API endpoint to export an index recommendation report."""
@@ -572,11 +658,119 @@ def test_index():
         return jsonify({'error': 'Both query and CREATE INDEX statement are required'})
     
     try:
-        result = performance_comparer.compare_with_index(query, create_statement)
+        result = performance_comparer.compare_with_index(
+            query, create_statement, request.json.get('iterations'), request.json.get('mode'),
+            bool(request.json.get('refresh'))
+        )
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False})
+
+def prune_batch_jobs():
+    """Forget batch comparison jobs that finished more than BATCH_JOB_TTL seconds ago (call with the lock held)."""
+    cutoff = time.time() - BATCH_JOB_TTL
+    for job_id in [job_id for job_id, job in batch_jobs.items() if job.get('finished', float('inf')) < cutoff]:
+        del batch_jobs[job_id]
+
+@app.route('/api/test-indexes', methods=['POST'])
+def test_indexes():
+    """API endpoint to start benchmarking candidate indexes against query shapes on a process pool."""
+    create_statements = request.json.get('create_statements') or []
+    fingerprints = request.json.get('fingerprints')
+    iterations = request.json.get('iterations')
+    workers = request.json.get('workers')
+    
+    if not create_statements:
+        return jsonify({'error': 'At least one CREATE INDEX statement is required'})
+    
+    job_id = uuid.uuid4().hex
+    job = {'status': 'running', 'done': 0, 'total': len(create_statements), 'started': time.time()}
+    with batch_jobs_lock:
+        prune_batch_jobs()
+        batch_jobs[job_id] = job
+    
+    def progress(done, total):
+        job.update(done=done, total=total)
+    
+    def run():
+        try:
+            result = performance_comparer.compare_batch(create_statements, fingerprints, iterations, workers, progress)
+            job.update(status='done', result=result)
+        except Exception as e:
+            job.update(status='failed', error=str(e))
+        job['finished'] = time.time()
+        job['seconds'] = round(job['finished'] - job['started'], 3)
+    
+    threading.Thread(target=run, daemon=True).start()
+    return jsonify({'success': True, 'job_id': job_id})
+
+@app.route('/api/test-indexes/<job_id>')
+def test_indexes_status(job_id):
+    """API endpoint to report the progress of a batch index comparison, with its results once done."""
+    with batch_jobs_lock:
+        prune_batch_jobs()
+        job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({'success': True, **{key: value for key, value in job.items() if key not in ('started', 'finished')}})
+
+@app.route('/api/replay-workload', methods=['POST'])
+def replay_workload():
+    """API endpoint to replay a workload sample, writes included, with and without an index set."""
+    create_statements = (request.json or {}).get('create_statements')
+    sample_size = (request.json or {}).get('sample_size')
+    
+    try:
+        if not create_statements:
+            # Default to the current recommendations
+            create_statements = [rec['create_statement'] for rec in index_recommender.analyze()]
+        if not create_statements:
+            return jsonify({'error': 'No indexes to replay the workload with'})
+        start_time = time.perf_counter()
+        result = workload_replayer.replay(create_statements, sample_size)
+        result['seconds'] = round(time.perf_counter() - start_time, 3)
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e), 'success': False})
 
+@app.route('/api/what-if', methods=['POST'])
+def what_if():
+    """API endpoint to evaluate hypothetical indexes on the schema-only shadow database."""
+    create_statements = request.json.get('create_statements') or []
+    if request.json.get('create_statement'):
+        create_statements.append(request.json.get('create_statement'))
+    queries = request.json.get('queries')
+    if request.json.get('query'):
+        queries = [request.json.get('query')]
+    
+    if not create_statements:
+        return jsonify({'error': 'At least one CREATE INDEX statement is required'})
+    
+    try:
+        start_time = time.perf_counter()
+        results = what_if_analyzer.evaluate_many(create_statements, queries)
+        return jsonify({
+            'results': results,
+            'seconds': round(time.perf_counter() - start_time, 3),
+            'success': True
+        })
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False})
+
+@app.route('/api/index-impact')
+def index_impact():
+    """API endpoint to list the latest stored index performance comparisons."""
+    return jsonify(data_visualizer.get_index_impact_data())
+
+@app.route('/api/index-audit')
+def index_audit():
+    """API endpoint to list unused, duplicate and redundant indexes with their DROP INDEX statements."""
+    try:
+        days = request.args.get('days', type=int) or int(config_manager.get('ANALYSIS', 'unused_index_days', '90'))
+        return jsonify({'success': True, 'days': days, **index_auditor.audit(days)})
+    except Exception as e:
+        return jsonify({'error': str(e), 'success': False})
+
 # Error handlers
 @app.errorhandler(404)
 def page_not_found(e):
@@ -7,10 +7,25 @@ import os
 import time
 import configparser
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
+from collections import OrderedDict
 import random
 import logging
 import re
+import hashlib
+import threading
+import queue
+import math
+import heapq
+import itertools
+import csv
+import bisect
+import tempfile
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
 
 # Configure logging
 logging.basicConfig(
@@ -23,9 +38,974 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+def utc_timestamp():
+    """Return the current UTC time in the format SQLite uses for CURRENT_TIMESTAMP."""
+    return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class QueryFingerprinter:
+    """Reduces SQL text to a normalized query shape with a stable fingerprint id.
+
+    Literals are replaced with '?', IN-lists are collapsed regardless of
+    their length and multi-row VALUES lists to their first row, comments
+    are removed and whitespace and case are normalized, so queries that
+    differ only in their parameters or the number of rows they insert share
+    the same fingerprint.
+    """
+
+    # One pass over the text; strings and quoted identifiers are matched first
+    # so that comment markers or digits inside them are left alone.
+    _TOKEN_PATTERN = re.compile(
+        r"(?P<string>'(?:[^']|'')*')"
+        r'|(?P<blob>[xX]\'[0-9a-fA-F]*\')'
+        r'|(?P<identifier>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])'
+        r'|(?P<line_comment>--[^\n]*)'
+        r'|(?P<block_comment>/\*.*?(?:\*/|$))'
+        r'|(?P<number>\b0[xX][0-9a-fA-F]+\b|(?<![\w.])(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\b)',
+        re.DOTALL
+    )
+    _NEGATIVE_PATTERN = re.compile(r'([=<>(,]|\b(?:and|or|between|then|else|when|select|values|limit|offset))\s*-\s*\?')
+    _IN_LIST_PATTERN = re.compile(r'\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)')
+    _VALUES_PATTERN = re.compile(r'\bvalues\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))*')
+    _OPERATOR_PATTERN = re.compile(r'\s*(<=|>=|<>|!=|==|=|<|>)\s*')
+    _WHITESPACE_PATTERN = re.compile(r'\s+')
+
+    def normalize(self, query):
+        """Return the normalized shape of a query."""
+        def replace(match):
+            kind = match.lastgroup
+            if kind in ('string', 'blob', 'number'):
+                return '?'
+            if kind in ('line_comment', 'block_comment'):
+                return ' '
+            return match.group(0)
+
+        text = self._TOKEN_PATTERN.sub(replace, query)
+        text = self._WHITESPACE_PATTERN.sub(' ', text).strip().rstrip(';').strip().lower()
+        text = self._OPERATOR_PATTERN.sub(r' \1 ', text)
+        text = self._NEGATIVE_PATTERN.sub(r'\1 ?', text)
+        text = self._IN_LIST_PATTERN.sub('in (?+)', text)
+        text = self._VALUES_PATTERN.sub(r'values \1', text)
+        text = re.sub(r'\(\s+', '(', text)
+        text = re.sub(r'\s+([),])', r'\1', text)
+        text = re.sub(r',(?=\S)', ', ', text)
+        return self._WHITESPACE_PATTERN.sub(' ', text).strip()
+
+    def fingerprint(self, query):
+        """Return a (fingerprint_id, normalized_query) tuple for a query."""
+        normalized = self.normalize(query)
+        fingerprint_id = hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+        return fingerprint_id, normalized
+
+
+class SQLParseError(Exception):
+    """Raised when a statement cannot be parsed."""
+
+
+class SQLParser:
+    """Tokenizes SQLite statements and parses them into a small AST.
+
+    analyze() walks the AST with alias scopes (CTEs, derived tables and
+    correlated subqueries included) and reports the base tables and the
+    column predicates an index could serve: equality, range, IN, LIKE
+    prefix and join predicates, plus the ORDER BY, GROUP BY and projected
+    columns. Unqualified columns are resolved when only one table is in
+    scope; otherwise the tables in scope are listed as candidates.
+    """
+    
+    _TOKEN_PATTERN = re.compile(
+        r"(?P<space>\s+)"
+        r"|(?P<comment>--[^\n]*|/\*.*?(?:\*/|$))"
+        r"|(?P<blob>[xX]'[0-9a-fA-F]*')"
+        r"|(?P<string>'(?:[^']|'')*')"
+        r'|(?P<identifier>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])'
+        r"|(?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+        r"|(?P<parameter>\?\d*|[:@$][A-Za-z_]\w*)"
+        r"|(?P<word>[A-Za-z_][\w$]*)"
+        r"|(?P<operator>->>|->|<=|>=|<>|!=|==|\|\||<<|>>|[-+*/%<>=~&|])"
+        r"|(?P<punct>[(),.;])",
+        re.DOTALL
+    )
+    # Keywords that end an expression or a table reference instead of naming a column or alias
+    RESERVED = {
+        'ALL', 'AND', 'AS', 'ASC', 'BETWEEN', 'BY', 'CASE', 'COLLATE', 'CROSS', 'DESC', 'DISTINCT', 'ELSE',
+        'END', 'ESCAPE', 'EXCEPT', 'EXISTS', 'FROM', 'FULL', 'GLOB', 'GROUP', 'HAVING', 'IN', 'INDEXED',
+        'INNER', 'INTERSECT', 'IS', 'ISNULL', 'JOIN', 'LEFT', 'LIKE', 'LIMIT', 'MATCH', 'NATURAL', 'NOT',
+        'NOTNULL', 'NULL', 'OFFSET', 'ON', 'OR', 'ORDER', 'OUTER', 'REGEXP', 'RETURNING', 'RIGHT', 'SELECT',
+        'SET', 'THEN', 'UNION', 'USING', 'VALUES', 'WHEN', 'WHERE', 'WINDOW', 'WITH'
+    }
+    COMPARISONS = {'=', '==', '!=', '<>', '<', '<=', '>', '>='}
+    RANGE_OPERATORS = {'<', '<=', '>', '>='}
+    FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+    
+    def tokenize(self, sql):
+        """Split SQL text into (kind, value) tokens, dropping whitespace and comments.
+
+        Quoted identifiers are returned unquoted with kind 'identifier', and
+        words keep their spelling; keyword matching is case-insensitive.
+        """
+        tokens = []
+        position = 0
+        length = len(sql)
+        while position < length:
+            match = self._TOKEN_PATTERN.match(sql, position)
+            if match is None:
+                raise SQLParseError(f"Unexpected character {sql[position]!r} at offset {position}")
+            position = match.end()
+            kind = match.lastgroup
+            if kind in ('space', 'comment'):
+                continue
+            value = match.group(0)
+            if kind == 'identifier':
+                quote = value[0]
+                value = value[1:-1]
+                if quote in ('"', '`'):
+                    value = value.replace(quote * 2, quote)
+            tokens.append((kind, value))
+        return tokens
+        
+    def parse(self, sql):
+        """Parse a single statement and return its AST."""
+        self._tokens = self.tokenize(sql)
+        self._position = 0
+        statement = self._statement()
+        while self._accept_punct(';'):
+            pass
+        if self._position < len(self._tokens):
+            raise SQLParseError(f"Unexpected token {self._peek()[1]!r}")
+        return statement
+        
+    # Token helpers
+    
+    def _peek(self, offset=0):
+        """Return the token at the given offset from the current position."""
+        index = self._position + offset
+        return self._tokens[index] if index < len(self._tokens) else ('eof', '')
+        
+    def _next(self):
+        """Consume and return the current token."""
+        token = self._peek()
+        if token[0] == 'eof':
+            raise SQLParseError("Unexpected end of statement")
+        self._position += 1
+        return token
+        
+    def _is_keyword(self, *words, offset=0):
+        """Return True if the token at offset is one of the keywords."""
+        kind, value = self._peek(offset)
+        return kind == 'word' and value.upper() in words
+        
+    def _accept_keyword(self, *words):
+        """Consume the current token if it is one of the keywords and return it uppercased."""
+        if self._is_keyword(*words):
+            return self._next()[1].upper()
+        return None
+        
+    def _expect_keyword(self, word):
+        """Consume a required keyword."""
+        if not self._accept_keyword(word):
+            raise SQLParseError(f"Expected {word}, found {self._peek()[1]!r}")
+            
+    def _accept_punct(self, value):
+        """Consume the current token if it is the given punctuation or operator."""
+        if self._peek()[0] in ('punct', 'operator') and self._peek()[1] == value:
+            self._position += 1
+            return True
+        return False
+        
+    def _expect_punct(self, value):
+        """Consume required punctuation."""
+        if not self._accept_punct(value):
+            raise SQLParseError(f"Expected {value!r}, found {self._peek()[1]!r}")
+            
+    def _is_name(self, offset=0):
+        """Return True if the token at offset can be used as a name."""
+        kind, value = self._peek(offset)
+        return kind == 'identifier' or (kind == 'word' and value.upper() not in self.RESERVED)
+        
+    def _name(self):
+        """Consume a name (identifier or non-reserved word)."""
+        if not self._is_name():
+            raise SQLParseError(f"Expected a name, found {self._peek()[1]!r}")
+        return self._next()[1]
+        
+    def _skip_parenthesized(self):
+        """Skip a balanced parenthesized token group starting at '('."""
+        self._expect_punct('(')
+        depth = 1
+        while depth:
+            kind, value = self._next()
+            if kind == 'punct' and value == '(':
+                depth += 1
+            elif kind == 'punct' and value == ')':
+                depth -= 1
+                
+    # Statements
+    
+    def _statement(self):
+        """Parse a SELECT, INSERT, UPDATE or DELETE statement with optional CTEs."""
+        ctes = self._with_clause()
+        if self._is_keyword('SELECT', 'VALUES') or (self._peek() == ('punct', '(')):
+            select = self._select(ctes)
+            return select
+        keyword = self._accept_keyword('INSERT', 'REPLACE', 'UPDATE', 'DELETE')
+        if keyword in ('INSERT', 'REPLACE'):
+            return self._insert(ctes)
+        if keyword == 'UPDATE':
+            return self._update(ctes)
+        if keyword == 'DELETE':
+            return self._delete(ctes)
+        raise SQLParseError(f"Unsupported statement starting with {self._peek()[1]!r}")
+        
+    def _with_clause(self):
+        """Parse an optional WITH clause into {name: select}."""
+        ctes = {}
+        if not self._accept_keyword('WITH'):
+            return ctes
+        self._accept_keyword('RECURSIVE')
+        while True:
+            name = self._name()
+            if self._peek() == ('punct', '('):
+                self._skip_parenthesized()
+            self._expect_keyword('AS')
+            if self._accept_keyword('NOT'):
+                self._expect_keyword('MATERIALIZED')
+            else:
+                self._accept_keyword('MATERIALIZED')
+            self._expect_punct('(')
+            ctes[name.lower()] = self._select({})
+            self._expect_punct(')')
+            if not self._accept_punct(','):
+                return ctes
+                
+    def _select(self, ctes):
+        """Parse a possibly compound SELECT with its ORDER BY and LIMIT."""
+        ctes = dict(ctes, **self._with_clause())
+        cores = [self._select_core()]
+        while True:
+            if self._accept_keyword('UNION'):
+                self._accept_keyword('ALL')
+            elif not self._accept_keyword('INTERSECT', 'EXCEPT'):
+                break
+            cores.append(self._select_core())
+        order_by = []
+        if self._accept_keyword('ORDER'):
+            self._expect_keyword('BY')
+            order_by = self._ordering_terms()
+        limit = None
+        if self._accept_keyword('LIMIT'):
+            limit = self._expression()
+            if self._accept_keyword('OFFSET') or self._accept_punct(','):
+                self._expression()
+        return {'type': 'select', 'ctes': ctes, 'cores': cores, 'order_by': order_by, 'limit': limit}
+        
+    def _select_core(self):
+        """Parse one SELECT ... or VALUES ... term of a compound select."""
+        core = {'columns': [], 'from': [], 'where': None, 'group_by': [], 'having': None}
+        if self._accept_punct('('):
+            nested = self._select({})
+            self._expect_punct(')')
+            core['from'] = [{'type': 'subquery', 'select': nested, 'alias': None}]
+            core['columns'] = [{'type': 'star', 'table': None, 'alias': None}]
+            return core
+        if self._accept_keyword('VALUES'):
+            while True:
+                self._expect_punct('(')
+                self._expression_list(')')
+                if not self._accept_punct(','):
+                    return core
+                    
+        self._expect_keyword('SELECT')
+        self._accept_keyword('DISTINCT', 'ALL')
+        while True:
+            core['columns'].append(self._result_column())
+            if not self._accept_punct(','):
+                break
+        if self._accept_keyword('FROM'):
+            core['from'] = self._join_clause()
+        if self._accept_keyword('WHERE'):
+            core['where'] = self._expression()
+        if self._accept_keyword('GROUP'):
+            self._expect_keyword('BY')
+            core['group_by'] = self._expression_list()
+            if self._accept_keyword('HAVING'):
+                core['having'] = self._expression()
+        if self._accept_keyword('WINDOW'):
+            while True:
+                self._name()
+                self._expect_keyword('AS')
+                self._skip_parenthesized()
+                if not self._accept_punct(','):
+                    break
+        return core
+        
+    def _result_column(self):
+        """Parse one result column: *, table.* or an expression with an optional alias."""
+        if self._accept_punct('*'):
+            return {'type': 'star', 'table': None, 'alias': None}
+        if self._is_name() and self._peek(1) == ('punct', '.') and self._peek(2) == ('operator', '*'):
+            table = self._name()
+            self._position += 2
+            return {'type': 'star', 'table': table, 'alias': None}
+        expression = self._expression()
+        alias = None
+        if self._accept_keyword('AS'):
+            alias = self._next()[1]
+        elif self._is_name() or self._peek()[0] == 'string':
+            alias = self._next()[1]
+        return {'type': 'expression', 'expression': expression, 'alias': alias}
+        
+    def _join_clause(self):
+        """Parse a FROM clause into a list of sources with their join constraints."""
+        sources = [self._table_or_subquery()]
+        while True:
+            natural = False
+            if self._accept_punct(','):
+                pass
+            elif self._is_keyword('NATURAL', 'LEFT', 'RIGHT', 'FULL', 'INNER', 'CROSS', 'JOIN'):
+                natural = bool(self._accept_keyword('NATURAL'))
+                if self._accept_keyword('LEFT', 'RIGHT', 'FULL'):
+                    self._accept_keyword('OUTER')
+                else:
+                    self._accept_keyword('INNER', 'CROSS')
+                self._expect_keyword('JOIN')
+            else:
+                return sources
+            source = self._table_or_subquery()
+            source['natural'] = natural
+            if self._accept_keyword('ON'):
+                source['on'] = self._expression()
+            elif self._accept_keyword('USING'):
+                self._expect_punct('(')
+                source['using'] = [self._name()]
+                while self._accept_punct(','):
+                    source['using'].append(self._name())
+                self._expect_punct(')')
+            sources.append(source)
+            
+    def _table_or_subquery(self):
+        """Parse a table name, table-valued function, subquery or parenthesized join."""
+        if self._accept_punct('('):
+            if self._is_keyword('SELECT', 'VALUES', 'WITH'):
+                source = {'type': 'subquery', 'select': self._select({})}
+            else:
+                source = {'type': 'join', 'sources': self._join_clause()}
+            self._expect_punct(')')
+        else:
+            name = self._name()
+            if self._accept_punct('.'):
+                name = self._name()
+            if self._peek() == ('punct', '('):
+                self._expect_punct('(')
+                source = {'type': 'function', 'name': name, 'args': self._expression_list(')')}
+            else:
+                source = {'type': 'table', 'name': name}
+        source['alias'] = None
+        if self._accept_keyword('AS'):
+            source['alias'] = self._name()
+        elif self._is_name():
+            source['alias'] = self._name()
+        if self._accept_keyword('INDEXED'):
+            self._expect_keyword('BY')
+            self._name()
+        elif self._is_keyword('NOT') and self._is_keyword('INDEXED', offset=1):
+            self._position += 2
+        return source
+        
+    def _ordering_terms(self):
+        """Parse ORDER BY terms into (expression, direction) entries."""
+        terms = []
+        while True:
+            expression = self._expression()
+            direction = self._accept_keyword('ASC', 'DESC') or 'ASC'
+            if self._accept_keyword('NULLS'):
+                self._accept_keyword('FIRST', 'LAST')
+            terms.append({'expression': expression, 'direction': direction})
+            if not self._accept_punct(','):
+                return terms
+                
+    def _insert(self, ctes):
+        """Parse INSERT/REPLACE INTO table [(columns)] VALUES ... | SELECT ... | DEFAULT VALUES."""
+        if self._accept_keyword('OR'):
+            self._next()
+        self._expect_keyword('INTO')
+        table = self._name()
+        if self._accept_punct('.'):
+            table = self._name()
+        alias = self._name() if self._accept_keyword('AS') else None
+        columns = []
+        if self._accept_punct('('):
+            columns = [self._name()]
+            while self._accept_punct(','):
+                columns.append(self._name())
+            self._expect_punct(')')
+        select = None
+        if self._accept_keyword('DEFAULT'):
+            self._expect_keyword('VALUES')
+        else:
+            select = self._select(ctes)
+        # Upsert clauses and RETURNING do not affect the access paths
+        self._position = len(self._tokens)
+        return {'type': 'insert', 'table': table, 'alias': alias, 'columns': columns, 'select': select, 'ctes': ctes}
+        
+    def _update(self, ctes):
+        """Parse UPDATE table SET ... [FROM ...] [WHERE ...]."""
+        if self._accept_keyword('OR'):
+            self._next()
+        table = self._name()
+        if self._accept_punct('.'):
+            table = self._name()
+        alias = self._name() if self._accept_keyword('AS') else None
+        self._expect_keyword('SET')
+        assignments = []
+        while True:
+            if self._accept_punct('('):
+                columns = [self._name()]
+                while self._accept_punct(','):
+                    columns.append(self._name())
+                self._expect_punct(')')
+            else:
+                columns = [self._name()]
+            self._expect_punct('=')
+            assignments.append({'columns': columns, 'expression': self._expression()})
+            if not self._accept_punct(','):
+                break
+        sources = self._join_clause() if self._accept_keyword('FROM') else []
+        where = self._expression() if self._accept_keyword('WHERE') else None
+        self._position = len(self._tokens)
+        return {'type': 'update', 'table': table, 'alias': alias, 'assignments': assignments,
+                'from': sources, 'where': where, 'ctes': ctes}
+        
+    def _delete(self, ctes):
+        """Parse DELETE FROM table [WHERE ...]."""
+        self._expect_keyword('FROM')
+        table = self._name()
+        if self._accept_punct('.'):
+            table = self._name()
+        alias = self._name() if self._accept_keyword('AS') else None
+        where = self._expression() if self._accept_keyword('WHERE') else None
+        self._position = len(self._tokens)
+        return {'type': 'delete', 'table': table, 'alias': alias, 'where': where, 'ctes': ctes}
+        
+    # Expressions
+    
+    def _expression_list(self, closing=None):
+        """Parse comma separated expressions, consuming the closing punctuation if given."""
+        expressions = []
+        if closing and self._accept_punct(closing):
+            return expressions
+        while True:
+            expressions.append(self._expression())
+            if not self._accept_punct(','):
+                break
+        if closing:
+            self._expect_punct(closing)
+        return expressions
+        
+    def _expression(self):
+        """Parse an expression (OR has the lowest precedence)."""
+        args = [self._and()]
+        while self._accept_keyword('OR'):
+            args.append(self._and())
+        return args[0] if len(args) == 1 else {'type': 'or', 'args': args}
+        
+    def _and(self):
+        """Parse AND terms."""
+        args = [self._not()]
+        while self._accept_keyword('AND'):
+            args.append(self._not())
+        return args[0] if len(args) == 1 else {'type': 'and', 'args': args}
+        
+    def _not(self):
+        """Parse a NOT prefix."""
+        if self._is_keyword('NOT') and not self._is_keyword('EXISTS', offset=1):
+            self._next()
+            return {'type': 'not', 'arg': self._not()}
+        return self._comparison()
+        
+    def _comparison(self):
+        """Parse comparison, IS, IN, LIKE, GLOB, BETWEEN and NULL tests."""
+        left = self._arithmetic()
+        while True:
+            kind, value = self._peek()
+            if kind == 'operator' and value in self.COMPARISONS:
+                self._next()
+                left = {'type': 'binary', 'op': '=' if value == '==' else value, 'left': left, 'right': self._arithmetic()}
+                continue
+            if self._accept_keyword('ISNULL'):
+                left = {'type': 'is', 'expr': left, 'right': {'type': 'literal', 'value': None}, 'negated': False}
+                continue
+            if self._accept_keyword('NOTNULL'):
+                left = {'type': 'is', 'expr': left, 'right': {'type': 'literal', 'value': None}, 'negated': True}
+                continue
+            if self._accept_keyword('IS'):
+                negated = bool(self._accept_keyword('NOT'))
+                if self._accept_keyword('DISTINCT'):
+                    self._expect_keyword('FROM')
+                    negated = not negated
+                left = {'type': 'is', 'expr': left, 'right': self._arithmetic(), 'negated': negated}
+                continue
+            negated = False
+            if self._is_keyword('NOT') and self._is_keyword('IN', 'LIKE', 'GLOB', 'REGEXP', 'MATCH', 'BETWEEN', 'NULL', offset=1):
+                self._next()
+                negated = True
+                if self._accept_keyword('NULL'):
+                    left = {'type': 'is', 'expr': left, 'right': {'type': 'literal', 'value': None}, 'negated': True}
+                    continue
+            if self._accept_keyword('IN'):
+                node = {'type': 'in', 'expr': left, 'negated': negated, 'values': [], 'select': None}
+                if self._accept_punct('('):
+                    if self._is_keyword('SELECT', 'VALUES', 'WITH'):
+                        node['select'] = self._select({})
+                        self._expect_punct(')')
+                    else:
+                        node['values'] = self._expression_list(')')
+                else:
+                    # IN table-name or table-valued function
+                    node['select'] = {'type': 'select', 'ctes': {}, 'order_by': [], 'limit': None, 'cores': [{
+                        'columns': [{'type': 'star', 'table': None, 'alias': None}],
+                        'from': [self._table_or_subquery()], 'where': None, 'group_by': [], 'having': None
+                    }]}
+                left = node
+                continue
+            operator = self._accept_keyword('LIKE', 'GLOB', 'REGEXP', 'MATCH')
+            if operator:
+                node = {'type': 'like', 'op': operator, 'expr': left, 'pattern': self._arithmetic(), 'negated': negated}
+                if self._accept_keyword('ESCAPE'):
+                    node['escape'] = self._arithmetic()
+                left = node
+                continue
+            if self._accept_keyword('BETWEEN'):
+                low = self._arithmetic()
+                self._expect_keyword('AND')
+                left = {'type': 'between', 'expr': left, 'low': low, 'high': self._arithmetic(), 'negated': negated}
+                continue
+            if negated:
+                raise SQLParseError(f"Unexpected token after NOT: {self._peek()[1]!r}")
+            return left
+            
+    def _arithmetic(self):
+        """Parse binary arithmetic, bitwise, concatenation and JSON operators."""
+        left = self._unary()
+        while self._peek()[0] == 'operator' and self._peek()[1] not in self.COMPARISONS and self._peek()[1] != '~':
+            op = self._next()[1]
+            left = {'type': 'binary', 'op': op, 'left': left, 'right': self._unary()}
+        return left
+        
+    def _unary(self):
+        """Parse unary operators and the COLLATE postfix."""
+        kind, value = self._peek()
+        if kind == 'operator' and value in ('-', '+', '~'):
+            self._next()
+            operand = self._unary()
+            if value in ('-', '+') and operand['type'] == 'literal':
+                return operand
+            return {'type': 'unary', 'op': value, 'arg': operand}
+        expression = self._primary()
+        while self._accept_keyword('COLLATE'):
+            self._next()
+        return expression
+        
+    def _primary(self):
+        """Parse literals, parameters, columns, function calls, CASE, CAST and subqueries."""
+        kind, value = self._peek()
+        if kind in ('string', 'number', 'blob'):
+            self._next()
+            return {'type': 'literal', 'value': value}
+        if kind == 'parameter':
+            self._next()
+            return {'type': 'parameter'}
+        if kind == 'punct' and value == '(':
+            self._next()
+            if self._is_keyword('SELECT', 'VALUES', 'WITH'):
+                select = self._select({})
+                self._expect_punct(')')
+                return {'type': 'subquery', 'select': select}
+            items = self._expression_list(')')
+            return items[0] if len(items) == 1 else {'type': 'row', 'items': items}
+        if kind == 'word':
+            keyword = value.upper()
+            if keyword in ('NULL', 'TRUE', 'FALSE', 'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP'):
+                self._next()
+                return {'type': 'literal', 'value': None if keyword == 'NULL' else keyword}
+            if keyword == 'EXISTS' or (keyword == 'NOT' and self._is_keyword('EXISTS', offset=1)):
+                negated = keyword == 'NOT'
+                self._position += 2 if negated else 1
+                self._expect_punct('(')
+                select = self._select({})
+                self._expect_punct(')')
+                return {'type': 'exists', 'select': select, 'negated': negated}
+            if keyword == 'CASE':
+                self._next()
+                args = []
+                if not self._is_keyword('WHEN'):
+                    args.append(self._expression())
+                while self._accept_keyword('WHEN'):
+                    args.append(self._expression())
+                    self._expect_keyword('THEN')
+                    args.append(self._expression())
+                if self._accept_keyword('ELSE'):
+                    args.append(self._expression())
+                self._expect_keyword('END')
+                return {'type': 'function', 'name': 'CASE', 'args': args}
+            if keyword == 'CAST' and self._peek(1) == ('punct', '('):
+                self._position += 2
+                expression = self._expression()
+                self._expect_keyword('AS')
+                while not self._accept_punct(')'):
+                    self._next()
+                return {'type': 'function', 'name': 'CAST', 'args': [expression]}
+            if keyword == 'RAISE' and self._peek(1) == ('punct', '('):
+                self._next()
+                self._skip_parenthesized()
+                return {'type': 'literal', 'value': None}
+        if kind in ('word', 'identifier') and self._peek(1) == ('punct', '(') and (kind == 'identifier' or self._is_name()
+                                                                                 or value.upper() in ('REPLACE', 'LIKE', 'GLOB')):
+            name = self._next()[1]
+            self._next()
+            if self._accept_punct('*'):
+                self._expect_punct(')')
+                args = []
+            else:
+                self._accept_keyword('DISTINCT')
+                args = self._expression_list(')')
+            if self._accept_keyword('FILTER'):
+                self._skip_parenthesized()
+            if self._accept_keyword('OVER'):
+                if self._peek() == ('punct', '('):
+                    self._skip_parenthesized()
+                else:
+                    self._name()
+            return {'type': 'function', 'name': name.upper(), 'args': args}
+        if self._is_name():
+            parts = [self._name()]
+            while self._accept_punct('.'):
+                parts.append(self._name())
+            table = parts[-2] if len(parts) > 1 else None
+            return {'type': 'column', 'table': table, 'name': parts[-1]}
+        raise SQLParseError(f"Unexpected token {value!r}")
+        
+    # Analysis
+    
+    def analyze(self, sql):
+        """Parse a statement and summarize the tables and column usage an index could serve.
+
+        Returns a dict with 'statement', 'tables' [(table, alias)],
+        'predicates' [{table, column, kind, operator, value, clause,
+        disjunctive, candidates}], 'joins', 'order_by', 'group_by',
+        'projections', 'select_star', 'target_table' and, for UPDATE, the
+        'assigned_columns'. Predicate kinds are equality, range, in,
+        like_prefix, like, is_null, join and other.
+        """
+        statement = self.parse(sql)
+        summary = {
+            'statement': statement['type'],
+            'tables': [],
+            'target_table': None,
+            'predicates': [],
+            'joins': [],
+            'order_by': [],
+            'group_by': [],
+            'projections': [],
+            'select_star': [],
+            'assigned_columns': []
+        }
+        if statement['type'] == 'select':
+            self._analyze_select(statement, None, summary)
+            return summary
+            
+        summary['target_table'] = statement['table']
+        scope = {'sources': {}, 'ctes': statement.get('ctes', {}), 'parent': None}
+        self._add_source(scope, {'type': 'table', 'name': statement['table'], 'alias': statement['alias']}, summary)
+        if statement['type'] == 'insert':
+            if statement['select'] is not None:
+                self._analyze_select(statement['select'], None, summary)
+            return summary
+        for source in statement.get('from', []):
+            self._add_source(scope, source, summary)
+        for assignment in statement.get('assignments', []):
+            summary['assigned_columns'].extend(assignment['columns'])
+            self._collect_subqueries(assignment['expression'], scope, summary)
+        self._analyze_condition(statement['where'], scope, summary, 'where')
+        return summary
+        
+    def _analyze_select(self, select, parent, summary):
+        """Analyze every core of a (compound) select within an optional outer scope."""
+        ctes = dict(parent['ctes'] if parent else {}, **select['ctes'])
+        for cte in select['ctes'].values():
+            self._analyze_select(cte, {'sources': {}, 'ctes': ctes, 'parent': None}, summary)
+            
+        first_scope = None
+        for core in select['cores']:
+            scope = {'sources': {}, 'ctes': ctes, 'parent': parent}
+            for source in core['from']:
+                self._add_source(scope, source, summary)
+            for source in self._flatten_sources(core['from']):
+                if source.get('on') is not None:
+                    self._analyze_condition(source['on'], scope, summary, 'join')
+            self._analyze_condition(core['where'], scope, summary, 'where')
+            
+            aliases = {}
+            for result in core['columns']:
+                if result['type'] == 'star':
+                    tables = [self._resolve_table(scope, result['table'])] if result['table'] else self._base_tables(scope)
+                    summary['select_star'].extend(table for table in tables if table and table not in summary['select_star'])
+                    continue
+                expression = result['expression']
+                if result['alias']:
+                    aliases[result['alias'].lower()] = expression
+                for column in self._columns(expression):
+                    self._add_column(summary['projections'], scope, column)
+                self._collect_subqueries(expression, scope, summary)
+                
+            for expression in core['group_by']:
+                expression = self._dereference(expression, aliases, core['columns'])
+                if expression['type'] == 'column':
+                    self._add_column(summary['group_by'], scope, expression)
+            self._analyze_condition(core['having'], scope, summary, 'having')
+            if first_scope is None:
+                first_scope = (scope, aliases, core['columns'])
+                
+        if first_scope is not None:
+            scope, aliases, columns = first_scope
+            for term in select['order_by']:
+                expression = self._dereference(term['expression'], aliases, columns)
+                if expression['type'] == 'column':
+                    entry = self._resolve_column(scope, expression)
+                    if entry is not None:
+                        entry['direction'] = term['direction']
+                        summary['order_by'].append(entry)
+                        
+    def _dereference(self, expression, aliases, columns):
+        """Map result column aliases and ordinals used in ORDER BY/GROUP BY to their expressions."""
+        if expression['type'] == 'column' and expression['table'] is None and expression['name'].lower() in aliases:
+            return aliases[expression['name'].lower()]
+        if expression['type'] == 'literal' and str(expression['value']).isdigit():
+            index = int(expression['value']) - 1
+            if 0 <= index < len(columns) and columns[index]['type'] == 'expression':
+                return columns[index]['expression']
+        return expression
+        
+    def _flatten_sources(self, sources):
+        """Yield the sources of a FROM clause, descending into parenthesized joins."""
+        for source in sources:
+            if source['type'] == 'join':
+                yield from self._flatten_sources(source['sources'])
+            yield source
+            
+    def _add_source(self, scope, source, summary):
+        """Register a FROM source under its alias and analyze derived tables."""
+        if source['type'] == 'join':
+            for inner in source['sources']:
+                self._add_source(scope, inner, summary)
+            return
+        if source['type'] == 'subquery':
+            self._analyze_select(source['select'], {'sources': {}, 'ctes': scope['ctes'], 'parent': scope['parent']}, summary)
+            if source['alias']:
+                scope['sources'][source['alias'].lower()] = None
+            return
+        if source['type'] == 'function':
+            scope['sources'][(source['alias'] or source['name']).lower()] = None
+            for arg in source['args']:
+                self._collect_subqueries(arg, scope, summary)
+            return
+        # USING joins the new table with the tables before it
+        preceding = self._base_tables(scope)
+        name = source['name']
+        if name.lower() in scope['ctes']:
+            # Columns of a CTE do not belong to a base table
+            scope['sources'][(source['alias'] or name).lower()] = None
+            return
+        scope['sources'][(source['alias'] or name).lower()] = name
+        if source['alias']:
+            scope['sources'].setdefault(name.lower(), name)
+        entry = (name, source['alias']) if source['alias'] else name
+        if entry not in summary['tables']:
+            summary['tables'].append(entry)
+        for column in source.get('using', []):
+            self._add_using(preceding, name, column, summary)
+            
+    def _base_tables(self, scope):
+        """Return the distinct base tables of a scope in FROM order."""
+        tables = []
+        for table in scope['sources'].values():
+            if table is not None and table not in tables:
+                tables.append(table)
+        return tables
+        
+    def _resolve_table(self, scope, qualifier):
+        """Resolve a table alias or name through the enclosing scopes (None for derived tables)."""
+        while scope is not None:
+            if qualifier.lower() in scope['sources']:
+                return scope['sources'][qualifier.lower()]
+            scope = scope['parent']
+        return None
+        
+    def _resolve_column(self, scope, column):
+        """Return {'table', 'column', 'candidates'} for a column reference, or None if it is not a base column."""
+        if column['table'] is not None:
+            table = self._resolve_table(scope, column['table'])
+            if table is None:
+                return None
+            return {'table': table, 'column': column['name'], 'candidates': [table]}
+        tables = self._base_tables(scope)
+        if not tables and len(scope['sources']) == 0 and scope['parent'] is not None:
+            tables = self._base_tables(scope['parent'])
+        if not tables:
+            return None
+        return {'table': tables[0] if len(tables) == 1 else None, 'column': column['name'], 'candidates': tables}
+        
+    def _add_column(self, entries, scope, column):
+        """Append a resolved column to a list unless it is already there."""
+        entry = self._resolve_column(scope, column)
+        if entry is not None and not any(
+                e['table'] == entry['table'] and e['column'].lower() == entry['column'].lower() for e in entries):
+            entries.append(entry)
+            
+    def _add_using(self, preceding, table, column, summary):
+        """Record a USING (column) join between a table and the base tables joined before it."""
+        right = {'table': table, 'column': column, 'candidates': [table]}
+        # The left side may be a derived table, in which case only the new table can use an index
+        left_table = preceding[0] if len(preceding) == 1 else None
+        left = {'table': left_table, 'column': column, 'candidates': preceding}
+        self._add_join(summary, left, right, 'join')
+            
+    def _add_join(self, summary, left, right, clause, disjunctive=False):
+        """Record a join predicate on both of its columns."""
+        summary['joins'].append({'left': (left['table'], left['column']), 'right': (right['table'], right['column'])})
+        for entry, other in ((left, right), (right, left)):
+            if entry['table'] is None and not entry['candidates']:
+                continue
+            summary['predicates'].append(dict(
+                entry, kind='join', operator='=', value=None, clause=clause, disjunctive=disjunctive,
+                other=(other['table'], other['column'])
+            ))
+            
+    def _columns(self, expression):
+        """Yield the column references of an expression, not descending into subqueries."""
+        if expression is None:
+            return
+        if expression['type'] == 'column':
+            yield expression
+            return
+        for key in ('left', 'right', 'arg', 'expr', 'pattern', 'low', 'high', 'escape'):
+            if isinstance(expression.get(key), dict):
+                yield from self._columns(expression[key])
+        for key in ('args', 'items', 'values'):
+            for item in expression.get(key) or []:
+                yield from self._columns(item)
+                
+    def _collect_subqueries(self, expression, scope, summary):
+        """Analyze the subqueries nested in an expression with the scope as their outer scope."""
+        if expression is None:
+            return
+        if expression.get('select') is not None:
+            self._analyze_select(expression['select'], scope, summary)
+        for key in ('left', 'right', 'arg', 'expr', 'pattern', 'low', 'high', 'escape'):
+            if isinstance(expression.get(key), dict):
+                self._collect_subqueries(expression[key], scope, summary)
+        for key in ('args', 'items', 'values'):
+            for item in expression.get(key) or []:
+                self._collect_subqueries(item, scope, summary)
+                
+    def _analyze_condition(self, expression, scope, summary, clause, disjunctive=False):
+        """Classify the predicates of a WHERE, ON or HAVING condition."""
+        if expression is None:
+            return
+        kind = expression['type']
+        if kind == 'and':
+            for arg in expression['args']:
+                self._analyze_condition(arg, scope, summary, clause, disjunctive)
+            return
+        if kind == 'or':
+            for arg in expression['args']:
+                self._analyze_condition(arg, scope, summary, clause, True)
+            return
+            
+        self._collect_subqueries(expression, scope, summary)
+        predicate = self._classify(expression)
+        if predicate is None:
+            # Columns used in predicates no index can serve
+            for column in self._columns(expression):
+                entry = self._resolve_column(scope, column)
+                if entry is not None:
+                    summary['predicates'].append(dict(
+                        entry, kind='other', operator=None, value=None, clause=clause, disjunctive=disjunctive
+                    ))
+            return
+            
+        column, predicate_kind, operator, value = predicate
+        if predicate_kind == 'join':
+            left = self._resolve_column(scope, column)
+            right = self._resolve_column(scope, value)
+            if left is not None and right is not None:
+                self._add_join(summary, left, right, clause, disjunctive)
+            return
+        entry = self._resolve_column(scope, column)
+        if entry is not None:
+            summary['predicates'].append(dict(
+                entry, kind=predicate_kind, operator=operator, value=value, clause=clause, disjunctive=disjunctive
+            ))
+            
+    def _is_constant(self, expression):
+        """Return True if an expression references no columns of the current row."""
+        return not any(True for _ in self._columns(expression))
+        
+    def _classify(self, expression):
+        """Return (column, kind, operator, value) for an indexable predicate, or None."""
+        kind = expression['type']
+        if kind == 'binary' and expression['op'] in self.COMPARISONS:
+            left, right, op = expression['left'], expression['right'], expression['op']
+            if left['type'] != 'column' and right['type'] == 'column':
+                left, right, op = right, left, self.FLIPPED.get(op, op)
+            if left['type'] != 'column':
+                return None
+            if op in ('!=', '<>'):
+                return None
+            if right['type'] == 'column':
+                return (left, 'join', '=', right) if op == '=' else None
+            if not self._is_constant(right):
+                return None
+            value = right.get('value') if right['type'] == 'literal' else None
+            return (left, 'equality' if op == '=' else 'range', op, value)
+        if kind == 'is' and expression['expr']['type'] == 'column':
+            if expression['negated']:
+                return None
+            if expression['right']['type'] == 'literal' and expression['right']['value'] is None:
+                return (expression['expr'], 'is_null', 'IS', None)
+            if self._is_constant(expression['right']):
+                return (expression['expr'], 'equality', 'IS', None)
+            return None
+        if kind == 'in' and expression['expr']['type'] == 'column' and not expression['negated']:
+            if expression['select'] is None and not all(self._is_constant(v) for v in expression['values']):
+                return None
+            return (expression['expr'], 'in', 'IN', len(expression['values']) or None)
+        if kind == 'between' and expression['expr']['type'] == 'column' and not expression['negated']:
+            if self._is_constant(expression['low']) and self._is_constant(expression['high']):
+                return (expression['expr'], 'range', 'BETWEEN', None)
+            return None
+        if kind == 'like' and expression['expr']['type'] == 'column' and not expression['negated']:
+            if expression['op'] not in ('LIKE', 'GLOB') or not self._is_constant(expression['pattern']):
+                return None
+            pattern = expression['pattern'].get('value') if expression['pattern']['type'] == 'literal' else None
+            wildcards = '%_' if expression['op'] == 'LIKE' else '*?['
+            if pattern and pattern.startswith("'") and len(pattern) > 2 and pattern[1] not in wildcards:
+                return (expression['expr'], 'like_prefix', expression['op'], pattern)
+            return (expression['expr'], 'like', expression['op'], pattern)
+        return None
+
+
 class DatabaseManager:
     """Manages database connections and operations."""
     
+    # Tables the tool keeps for itself, next to the monitored application's tables
+    METADATA_TABLES = frozenset({
+        'analysis_watermarks', 'column_statistics', 'execution_plan_nodes', 'execution_plans',
+        'fingerprint_candidates', 'index_candidates', 'index_recommendations', 'latency_sketches',
+        'performance_comparisons', 'query_fingerprints', 'query_logs', 'query_rollups', 'table_writes'
+    })
+    
     def __init__(self, db_file):
         """Initialize with database file path."""
         self.db_file = db_file
@@ -33,6 +1013,9 @@ class DatabaseManager:
         # But we'll be careful to only use the connection from one thread at a time
         self.conn = None
         self.cursor = None
+        # Query logs live in one file per day next to the database
+        self.log_store = QueryLogStore.for_database(db_file)
+        self.catalog = SchemaCatalog(self)
             
     def connect(self):
         """Establish a database connection that can be used across threads."""
@@ -64,55 +1047,354 @@ class DatabaseManager:
             self.conn.commit()
             
     def setup_tables(self):
-        """Set up necessary tables if they don't exist."""
+        """Set up necessary tables and upgrade existing databases to the latest schema.
+
+        Each migration runs once, in its own transaction, and the schema
+        version reached is recorded in PRAGMA user_version.
+        """
         try:
             self.ensure_connected()
-            # Table to store query logs
-            self.execute('''
-                CREATE TABLE IF NOT EXISTS query_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    query TEXT NOT NULL,
-                    execution_time REAL NOT NULL,
-                    execution_plan TEXT,
-                    timestamp TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Table to store index recommendations
-            self.execute('''
-                CREATE TABLE IF NOT EXISTS index_recommendations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    table_name TEXT NOT NULL,
-                    column_name TEXT NOT NULL,
-                    score REAL NOT NULL,
-                    index_type TEXT,
-                    create_statement TEXT NOT NULL,
-                    applied INTEGER DEFAULT 0,
-                    timestamp TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Table to store performance comparison results
-            self.execute('''
-                CREATE TABLE IF NOT EXISTS performance_comparisons (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    query_id INTEGER,
-                    original_time REAL,
-                    optimized_time REAL,
-                    improvement_percent REAL,
-                    index_id INTEGER,
-                    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(query_id) REFERENCES query_logs(id),
-                    FOREIGN KEY(index_id) REFERENCES index_recommendations(id)
-                )
-            ''')
-            
-            self.conn.commit()
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            for target_version, description, migration in self._migrations():
+                if version >= target_version:
+                    continue
+                try:
+                    self.execute("BEGIN")
+                    migration()
+                    self.execute(f"PRAGMA user_version = {target_version}")
+                    self.conn.commit()
+                except sqlite3.Error:
+                    self.conn.rollback()
+                    raise
+                version = target_version
+                logger.info(f"Applied schema migration {target_version}: {description}")
             return True
         except sqlite3.Error as e:
             logger.error(f"Error setting up tables: {e}")
             return False
             
+    def _migrations(self):
+        """Return the ordered (version, description, migration) schema migrations."""
+        return [
+            (1, 'base tables', self._migrate_base_tables),
+            (2, 'query fingerprints', self._migrate_query_fingerprints),
+            (3, 'query timing columns', self._migrate_timing_columns),
+            (4, 'latency sketches', self._migrate_latency_sketches),
+            (5, 'execution plan store', self._migrate_plan_store),
+            (6, 'metadata indexes', self._migrate_metadata_indexes),
+            (7, 'time-bucket rollups', self._migrate_rollups),
+            (8, 'daily query log partitions', self._migrate_log_partitions),
+            (9, 'incremental analysis state', self._migrate_analysis_state),
+            (10, 'fingerprint candidate map', self._migrate_fingerprint_candidates),
+            (11, 'column statistics and index savings', self._migrate_column_statistics),
+            (12, 'covering index candidates', self._migrate_covering_candidates),
+            (13, 'ordered composite candidates', self._migrate_candidate_ordering),
+            (14, 'plan usage counters', self._migrate_plan_usage),
+            (15, 'comparison result store', self._migrate_comparison_store),
+            (16, 'table write counters', self._migrate_table_writes)
+        ]
+        
+    def _migrate_base_tables(self):
+        """Create the query log, recommendation and comparison tables."""
+        # Table to store query logs
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS query_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query TEXT NOT NULL,
+                execution_time REAL NOT NULL,
+                execution_plan TEXT,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Table to store index recommendations
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS index_recommendations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                column_name TEXT NOT NULL,
+                score REAL NOT NULL,
+                index_type TEXT,
+                create_statement TEXT NOT NULL,
+                applied INTEGER DEFAULT 0,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Table to store performance comparison results
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS performance_comparisons (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                query_id INTEGER,
+                original_time REAL,
+                optimized_time REAL,
+                improvement_percent REAL,
+                index_id INTEGER,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(query_id) REFERENCES query_logs(id),
+                FOREIGN KEY(index_id) REFERENCES index_recommendations(id)
+            )
+        ''')
+        
+    def _migrate_query_fingerprints(self):
+        """Add query fingerprints and the running statistics per query shape."""
+        self._ensure_column('query_logs', 'fingerprint', 'TEXT')
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS query_fingerprints (
+                fingerprint TEXT PRIMARY KEY,
+                normalized_query TEXT NOT NULL,
+                sample_query TEXT,
+                query_count INTEGER NOT NULL DEFAULT 0,
+                total_time REAL NOT NULL DEFAULT 0,
+                min_time REAL,
+                max_time REAL,
+                first_seen TEXT DEFAULT CURRENT_TIMESTAMP,
+                last_seen TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+    def _migrate_timing_columns(self):
+        """Add the row materialization timings to query logs."""
+        self._ensure_column('query_logs', 'rows_returned', 'INTEGER')
+        self._ensure_column('query_logs', 'first_row_time', 'REAL')
+        self._ensure_column('query_logs', 'step_time', 'REAL')
+        
+    def _migrate_latency_sketches(self):
+        """Add the all-time and hourly latency sketches per query shape."""
+        self._ensure_column('query_fingerprints', 'latency_sketch', 'TEXT')
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS latency_sketches (
+                fingerprint TEXT NOT NULL,
+                bucket_start TEXT NOT NULL,
+                sketch TEXT NOT NULL,
+                PRIMARY KEY (fingerprint, bucket_start)
+            ) WITHOUT ROWID
+        ''')
+        self.execute("CREATE INDEX IF NOT EXISTS idx_latency_sketches_bucket ON latency_sketches (bucket_start)")
+        
+    def _migrate_plan_store(self):
+        """Add the deduplicated execution plan store."""
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS execution_plans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                plan_hash TEXT NOT NULL UNIQUE,
+                plan_text TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS execution_plan_nodes (
+                plan_id INTEGER NOT NULL REFERENCES execution_plans(id),
+                node_id INTEGER NOT NULL,
+                parent_id INTEGER,
+                detail TEXT NOT NULL,
+                operation TEXT,
+                table_name TEXT,
+                index_name TEXT,
+                is_covering INTEGER DEFAULT 0,
+                PRIMARY KEY (plan_id, node_id)
+            ) WITHOUT ROWID
+        ''')
+        self.execute("CREATE INDEX IF NOT EXISTS idx_plan_nodes_table ON execution_plan_nodes (table_name, operation)")
+        self.execute("CREATE INDEX IF NOT EXISTS idx_plan_nodes_index ON execution_plan_nodes (index_name)")
+        self._ensure_column('query_logs', 'plan_id', 'INTEGER REFERENCES execution_plans(id)')
+        
+    def _migrate_metadata_indexes(self):
+        """Index the access paths used on the tool's own tables."""
+        # Recent logs, time windows and retention
+        self.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_timestamp ON query_logs (timestamp)")
+        # Slow query lookups
+        self.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_execution_time ON query_logs (execution_time)")
+        # Executions of a query shape and of a plan
+        self.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_fingerprint ON query_logs (fingerprint)")
+        self.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_plan ON query_logs (plan_id)")
+        # Most frequent query shapes
+        self.execute("CREATE INDEX IF NOT EXISTS idx_query_fingerprints_count ON query_fingerprints (query_count)")
+        # Latest comparisons
+        self.execute("CREATE INDEX IF NOT EXISTS idx_performance_comparisons_timestamp ON performance_comparisons (timestamp)")
+        self.execute("CREATE INDEX IF NOT EXISTS idx_performance_comparisons_index ON performance_comparisons (index_id)")
+        
+    def _migrate_rollups(self):
+        """Add the minute, hour and day rollups and fill them from the existing logs."""
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS query_rollups (
+                granularity TEXT NOT NULL,
+                bucket_start TEXT NOT NULL,
+                query_count INTEGER NOT NULL,
+                total_time REAL NOT NULL,
+                min_time REAL,
+                max_time REAL,
+                sketch TEXT,
+                PRIMARY KEY (granularity, bucket_start)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Logs without a fingerprint are folded in later by QueryMonitor.backfill_fingerprints
+        writer = QueryLogWriter(self.db_file)
+        cursor = self.conn.execute(
+            "SELECT execution_time, timestamp FROM query_logs WHERE fingerprint IS NOT NULL AND timestamp IS NOT NULL"
+        )
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            writer.update_rollups(self.conn, [
+                {'execution_time': row[0], 'timestamp': row[1]} for row in rows
+            ])
+            
+    def _migrate_log_partitions(self):
+        """Move the query logs into the daily partition files and drop the old table.
+
+        Moved rows are numbered in id order within their partition, so an
+        interrupted move assigns the same ids when it is run again.
+        """
+        cursor = self.conn.execute(
+            "SELECT id, query, execution_time, execution_plan, plan_id, timestamp, fingerprint, "
+            "rows_returned, first_row_time, step_time FROM query_logs ORDER BY id"
+        )
+        row_numbers = {}
+        moved = 0
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            batch = []
+            for row in rows:
+                entry = dict(row)
+                entry['timestamp'] = entry['timestamp'] or utc_timestamp()
+                key = self.log_store.partition_key(entry['timestamp'])
+                row_numbers[key] = row_numbers.get(key, 0) + 1
+                entry['id'] = self.log_store.id_base(key) + row_numbers[key]
+                batch.append(entry)
+            self.log_store.insert(batch, skip_existing=True)
+            moved += len(batch)
+        if moved:
+            logger.info(f"Moved {moved} logged queries into daily partitions")
+        self.execute("DROP TABLE query_logs")
+        
+    def _migrate_analysis_state(self):
+        """Add the index candidate aggregates and the per-partition analysis watermarks."""
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS index_candidates (
+                candidate_key TEXT PRIMARY KEY,
+                table_name TEXT NOT NULL,
+                columns TEXT NOT NULL,
+                is_composite INTEGER NOT NULL DEFAULT 0,
+                query_count INTEGER NOT NULL DEFAULT 0,
+                total_time REAL NOT NULL DEFAULT 0,
+                first_seen TEXT,
+                last_seen TEXT
+            )
+        ''')
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_watermarks (
+                partition_key TEXT PRIMARY KEY,
+                last_log_id INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        
+    def _migrate_fingerprint_candidates(self):
+        """Map query shapes to the candidate indexes they could use."""
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS fingerprint_candidates (
+                fingerprint TEXT NOT NULL,
+                candidate_key TEXT NOT NULL,
+                PRIMARY KEY (fingerprint, candidate_key)
+            ) WITHOUT ROWID
+        ''')
+        # Re-read the retained logs on the next refresh so the map covers them
+        self._reset_candidates()
+        
+    def _migrate_column_statistics(self):
+        """Add the sampled column statistics and the estimated savings per query shape and candidate."""
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS column_statistics (
+                table_name TEXT NOT NULL COLLATE NOCASE,
+                column_name TEXT NOT NULL COLLATE NOCASE,
+                row_count INTEGER NOT NULL,
+                distinct_count INTEGER NOT NULL,
+                null_fraction REAL NOT NULL,
+                most_common TEXT NOT NULL,
+                histogram TEXT NOT NULL,
+                sampled_at TEXT NOT NULL,
+                PRIMARY KEY (table_name, column_name)
+            ) WITHOUT ROWID
+        ''')
+        self._ensure_column('fingerprint_candidates', 'saved_fraction', 'REAL NOT NULL DEFAULT 0')
+        # Re-read the retained logs on the next refresh so every pair gets its estimate
+        self._reset_candidates()
+        
+    def _migrate_covering_candidates(self):
+        """Mark candidates that also carry the projected columns, so queries can be answered from the index."""
+        self._ensure_column('index_candidates', 'is_covering', 'INTEGER NOT NULL DEFAULT 0')
+        # Re-read the retained logs on the next refresh so covering candidates are proposed for them
+        self._reset_candidates()
+        
+    def _migrate_candidate_ordering(self):
+        """Add key column directions to candidates and the predicates each one satisfies per query shape."""
+        self._ensure_column('index_candidates', 'descending', "TEXT NOT NULL DEFAULT '[]'")
+        self._ensure_column('fingerprint_candidates', 'satisfies', "TEXT NOT NULL DEFAULT '[]'")
+        self.execute("CREATE INDEX IF NOT EXISTS idx_fingerprint_candidates_key ON fingerprint_candidates (candidate_key)")
+        # Composite keys are now ordered rather than sorted, so rebuild them from the retained logs
+        self._reset_candidates()
+        
+    def _migrate_plan_usage(self):
+        """Count how often and when each stored plan was used, backfilled from the retained logs."""
+        self._ensure_column('execution_plans', 'use_count', "INTEGER NOT NULL DEFAULT 0")
+        self._ensure_column('execution_plans', 'last_used', "TEXT")
+        usage = {}
+        for key in self.log_store.partitions():
+            conn = self.log_store.connection(key)
+            if conn is None:
+                continue
+            rows = conn.execute(
+                "SELECT plan_id, COUNT(*), MAX(timestamp) FROM query_logs WHERE plan_id IS NOT NULL GROUP BY plan_id"
+            )
+            for plan_id, count, last_used in rows:
+                entry = usage.setdefault(plan_id, [0, last_used])
+                entry[0] += count
+                entry[1] = max(entry[1], last_used)
+        self.conn.executemany(
+            "UPDATE execution_plans SET use_count = ?, last_used = ? WHERE id = ?",
+            [(count, last_used, plan_id) for plan_id, (count, last_used) in usage.items()]
+        )
+        
+    def _migrate_comparison_store(self):
+        """Key the performance comparisons by query shape, index definition and database state."""
+        for column_name, column_definition in (
+            ('fingerprint', 'TEXT'), ('query', 'TEXT'), ('table_name', 'TEXT'), ('index_name', 'TEXT'),
+            ('columns', 'TEXT'), ('index_definition', 'TEXT'), ('schema_version', 'INTEGER'),
+            ('data_signature', 'TEXT'), ('mode', 'TEXT'),
+            ('iterations', 'INTEGER'), ('verdict', 'TEXT'), ('result', 'TEXT')
+        ):
+            self._ensure_column('performance_comparisons', column_name, column_definition)
+        self.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_performance_comparisons_key ON performance_comparisons "
+            "(fingerprint, index_definition, schema_version, data_signature)"
+        )
+        
+    def _migrate_table_writes(self):
+        """Count the captured writes per table, so stored comparisons notice changed data."""
+        self.execute('''
+            CREATE TABLE IF NOT EXISTS table_writes (
+                table_name TEXT PRIMARY KEY COLLATE NOCASE,
+                write_count INTEGER NOT NULL DEFAULT 0,
+                last_write TEXT
+            )
+        ''')
+        
+    def _reset_candidates(self):
+        """Forget the candidates derived from the logs, so the next refresh re-reads every retained log."""
+        self.execute("DELETE FROM fingerprint_candidates")
+        self.execute("DELETE FROM index_candidates")
+        self.execute("DELETE FROM analysis_watermarks")
+        
+    def _ensure_column(self, table_name, column_name, column_definition):
+        """Add a column to an existing table if it is missing."""
+        columns = [col['name'] for col in self.execute_and_fetch(f"PRAGMA table_info({table_name})")]
+        if column_name not in columns:
+            self.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
+            
     def execute(self, query, params=()):
         """Execute a SQL query with parameters."""
         try:
@@ -169,6 +1451,11 @@ class DatabaseManager:
             logger.error(f"Error getting index columns: {e}")
             return []
             
+    def get_schema_version(self):
+        """Get the schema cookie, which SQLite increments on every schema change."""
+        self.ensure_connected()
+        return self.conn.execute("PRAGMA schema_version").fetchone()[0]
+            
     def get_row_count(self, table_name):
         """Get the number of rows in a table."""
         try:
@@ -179,534 +1466,4195 @@ class DatabaseManager:
             return 0
 
 
-class QueryMonitor:
-    """Monitors queries and their execution plans."""
+class SchemaCatalog:
+    """In-process cache of the tables, columns and indexes of a database.
+
+    The whole catalog is read with a few pragma table-valued function
+    queries and reused until PRAGMA schema_version changes, so callers can
+    look up indexes and columns per table without issuing PRAGMAs.
+    """
+    
+    def __init__(self, db_manager):
+        """Initialize with a database manager; the catalog is loaded on first use."""
+        self.db_manager = db_manager
+        self._version = None
+        self._tables = {}
+        self._lock = threading.Lock()
+        
+    def _current(self):
+        """Return the table map, reloading it if the schema changed since it was loaded."""
+        version = self.db_manager.get_schema_version()
+        with self._lock:
+            if version != self._version:
+                self._tables = self._load()
+                self._version = version
+            return self._tables
+            
+    def invalidate(self):
+        """Force the next lookup to reload the catalog."""
+        with self._lock:
+            self._version = None
+            
+    def _load(self):
+        """Read every table with its columns, indexes and row estimate."""
+        conn = self.db_manager.conn
+        tables = {}
+        for row in conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        ):
+            tables[row[0].lower()] = {
+                'name': row[0],
+                'without_rowid': bool(re.search(r'\bWITHOUT\s+ROWID\s*;?\s*$', row[1] or '', re.IGNORECASE)),
+                'columns': [],
+                'indexes': [],
+                'rowid_alias': None,
+                'row_estimate': None
+            }
+            
+        for row in conn.execute(
+            "SELECT m.name, c.name, c.type, c.\"notnull\", c.pk FROM sqlite_master m, pragma_table_info(m.name) c "
+            "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, c.cid"
+        ):
+            table = tables.get(row[0].lower())
+            if table is not None:
+                table['columns'].append({'name': row[1], 'type': row[2] or '', 'notnull': bool(row[3]), 'pk': row[4]})
+        for table in tables.values():
+            pk_columns = [column for column in table['columns'] if column['pk']]
+            # A single INTEGER PRIMARY KEY column is the rowid itself
+            if not table['without_rowid'] and len(pk_columns) == 1 and pk_columns[0]['type'].upper() == 'INTEGER':
+                table['rowid_alias'] = pk_columns[0]['name']
+                
+        indexes = {}
+        for row in conn.execute(
+            "SELECT m.name, l.name, l.\"unique\", l.origin, l.partial FROM sqlite_master m, pragma_index_list(m.name) l "
+            "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, l.seq DESC"
+        ):
+            table = tables.get(row[0].lower())
+            if table is None:
+                continue
+            index = {
+                'name': row[1],
+                'unique': bool(row[2]),
+                'origin': row[3],
+                'partial': bool(row[4]),
+                'has_expression': False,
+                'columns': [],
+                'descending': []
+            }
+            table['indexes'].append(index)
+            indexes[row[1]] = index
+        for row in conn.execute(
+            "SELECT l.name, x.cid, x.name, x.\"desc\" FROM sqlite_master m, pragma_index_list(m.name) l, "
+            "pragma_index_xinfo(l.name) x WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND x.key = 1 "
+            "ORDER BY l.name, x.seqno"
+        ):
+            index = indexes.get(row[0])
+            if index is None:
+                continue
+            if row[1] == -2:
+                # Expression key columns have no name
+                index['has_expression'] = True
+                index['columns'].append(None)
+            else:
+                index['columns'].append(row[2])
+            index['descending'].append(bool(row[3]))
+            
+        self._load_row_estimates(conn, tables)
+        return tables
+        
+    def _load_row_estimates(self, conn, tables):
+        """Fill in row estimates from sqlite_stat1, or from the largest rowid when ANALYZE has not run."""
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).fetchone() is not None
+        if has_stats:
+            for row in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+                table = tables.get((row[0] or '').lower())
+                if table is not None and row[1] and table['row_estimate'] is None:
+                    table['row_estimate'] = int(row[1].split()[0])
+        for table in tables.values():
+            if table['row_estimate'] is None and not table['without_rowid']:
+                # The largest rowid is a cheap upper bound for tables that are rarely deleted from
+                quoted = table['name'].replace('"', '""')
+                table['row_estimate'] = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{quoted}"').fetchone()[0]
+                
+    @property
+    def schema_version(self):
+        """Return the schema version the cached catalog was loaded at."""
+        self._current()
+        return self._version
+        
+    def tables(self):
+        """Return the names of all tables."""
+        return [table['name'] for table in self._current().values()]
+        
+    def table(self, table_name):
+        """Return the catalog entry of a table (case-insensitive), or None if it does not exist."""
+        return self._current().get(table_name.lower())
+        
+    def columns(self, table_name):
+        """Return the column names of a table."""
+        table = self.table(table_name)
+        return [column['name'] for column in table['columns']] if table else []
+        
+    def has_column(self, table_name, column_name):
+        """Return True if a table has a column (case-insensitive)."""
+        return column_name.lower() in {name.lower() for name in self.columns(table_name)}
+        
+    def indexes(self, table_name):
+        """Return the indexes of a table with their ordered key columns."""
+        table = self.table(table_name)
+        return table['indexes'] if table else []
+        
+    def indexed_columns(self, table_name):
+        """Return the columns that are a key column of any index, including the rowid alias."""
+        table = self.table(table_name)
+        if not table:
+            return set()
+        columns = {column for index in table['indexes'] for column in index['columns'] if column}
+        if table['rowid_alias']:
+            columns.add(table['rowid_alias'])
+        return columns
+        
+    def leading_columns(self, table_name):
+        """Return the columns an index (or the rowid) can be searched by directly."""
+        table = self.table(table_name)
+        if not table:
+            return set()
+        columns = {index['columns'][0] for index in table['indexes'] if index['columns'] and index['columns'][0]}
+        if table['rowid_alias']:
+            columns.add(table['rowid_alias'])
+        return columns
+        
+    def row_estimate(self, table_name):
+        """Return the estimated number of rows of a table, or None if unknown."""
+        table = self.table(table_name)
+        return table['row_estimate'] if table else None
+
+
+class SelectivityEstimator:
+    """Estimates the fraction of a table's rows that a predicate selects.
+
+    Distinct counts come from sqlite_stat1 when an analyzed index leads with
+    the column, otherwise from a random rowid sample of the column. The same
+    sample gives the null fraction, the most common values and an equi-depth
+    histogram. These are cached in column_statistics and resampled once they
+    are a day old or the table's row estimate has drifted.
+    """
+    
+    SAMPLE_SIZE = 2000
+    HISTOGRAM_BUCKETS = 50
+    MOST_COMMON_VALUES = 10
+    MAX_AGE = timedelta(days=1)
+    # Relative change of the row estimate after which a sample is stale
+    MAX_DRIFT = 0.2
+    # SQLite's own guesses when a predicate has no literal to look up
+    DEFAULT_RANGE_SELECTIVITY = 0.25
+    DEFAULT_LIKE_SELECTIVITY = 0.1
+    
+    def __init__(self, db_manager):
+        """Initialize with a database manager."""
+        self.db_manager = db_manager
+        self._cache = {}
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def literal(token):
+        """Return the Python value of a SQL literal token, or None for parameters and expressions."""
+        if not isinstance(token, str):
+            return None
+        if len(token) >= 2 and token[0] == "'" and token[-1] == "'":
+            return token[1:-1].replace("''", "'")
+        try:
+            return int(token)
+        except ValueError:
+            pass
+        try:
+            return float(token)
+        except ValueError:
+            return None
+            
+    @staticmethod
+    def _sort_key(value):
+        """Order values the way SQLite does: numbers before text."""
+        if isinstance(value, (int, float)):
+            return (0, value, '')
+        return (1, 0, str(value))
+        
+    def column(self, table_name, column_name):
+        """Return the statistics of a column, sampling it if the cached ones are missing or stale."""
+        catalog = self.db_manager.catalog
+        table = catalog.table(table_name)
+        if table is None:
+            return None
+        row_count = table['row_estimate'] or 0
+        key = (table['name'].lower(), column_name.lower())
+        with self._lock:
+            stats = self._cache.get(key)
+            if stats is None or not self._is_fresh(stats, row_count):
+                stats = self._load(table['name'], column_name)
+                if stats is None or not self._is_fresh(stats, row_count):
+                    stats = self._sample(table, column_name)
+                    self._save(stats)
+                self._cache[key] = stats
+            return stats
+            
+    def _is_fresh(self, stats, row_count):
+        """Return True if cached statistics are recent and the table has not grown or shrunk much."""
+        if datetime.strptime(stats['sampled_at'], '%Y-%m-%d %H:%M:%S') < datetime.utcnow() - self.MAX_AGE:
+            return False
+        return abs(row_count - stats['row_count']) <= self.MAX_DRIFT * max(stats['row_count'], 1)
+        
+    def _load(self, table_name, column_name):
+        """Return the persisted statistics of a column, or None."""
+        row = self.db_manager.execute_and_fetch(
+            "SELECT * FROM column_statistics WHERE table_name = ? AND column_name = ?",
+            (table_name, column_name),
+            fetch_all=False
+        )
+        if row is None:
+            return None
+        return {
+            'table': row['table_name'],
+            'column': row['column_name'],
+            'row_count': row['row_count'],
+            'distinct_count': row['distinct_count'],
+            'null_fraction': row['null_fraction'],
+            'most_common': json.loads(row['most_common']),
+            'histogram': json.loads(row['histogram']),
+            'sampled_at': row['sampled_at']
+        }
+        
+    def _save(self, stats):
+        """Persist the statistics of a column."""
+        try:
+            self.db_manager.conn.execute(
+                "INSERT OR REPLACE INTO column_statistics "
+                "(table_name, column_name, row_count, distinct_count, null_fraction, most_common, histogram, sampled_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    stats['table'], stats['column'], stats['row_count'], stats['distinct_count'],
+                    stats['null_fraction'], json.dumps(stats['most_common']), json.dumps(stats['histogram']),
+                    stats['sampled_at']
+                )
+            )
+            self.db_manager.conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error saving column statistics for {stats['table']}.{stats['column']}: {e}")
+            
+    def _sample(self, table, column_name):
+        """Sample a column and summarize it as distinct count, null fraction, common values and histogram."""
+        conn = self.db_manager.conn
+        quoted_table = table['name'].replace('"', '""')
+        quoted_column = column_name.replace('"', '""')
+        max_rowid = 0
+        if not table['without_rowid']:
+            max_rowid = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{quoted_table}"').fetchone()[0]
+        if max_rowid > self.SAMPLE_SIZE:
+            # Random rowid lookups read a few pages instead of the whole table
+            rowids = random.sample(range(1, max_rowid + 1), self.SAMPLE_SIZE)
+            values = [
+                row[0] for row in conn.execute(
+                    f'SELECT "{quoted_column}" FROM "{quoted_table}" WHERE rowid IN (SELECT value FROM json_each(?))',
+                    (json.dumps(rowids),)
+                )
+            ]
+        else:
+            values = [
+                row[0] for row in conn.execute(
+                    f'SELECT "{quoted_column}" FROM "{quoted_table}" LIMIT ?', (self.SAMPLE_SIZE,)
+                )
+            ]
+            
+        row_count = max(table['row_estimate'] or 0, len(values))
+        sample_size = len(values)
+        non_null = [value for value in values if value is not None and not isinstance(value, bytes)]
+        null_fraction = (sample_size - len(non_null)) / sample_size if sample_size else 0.0
+        frequencies = {}
+        for value in non_null:
+            frequencies[value] = frequencies.get(value, 0) + 1
+            
+        distinct_count = self._stat1_distinct(table, column_name)
+        if distinct_count is None:
+            # Duj1 estimator: scales the sample's distinct count by how many values occurred only once
+            sampled_distinct = len(frequencies)
+            singletons = sum(1 for count in frequencies.values() if count == 1)
+            n = len(non_null)
+            if n and row_count:
+                denominator = n - singletons + singletons * n / row_count
+                distinct_count = n * sampled_distinct / denominator if denominator else sampled_distinct
+            else:
+                distinct_count = sampled_distinct
+        distinct_count = max(1, int(round(distinct_count)))
+        
+        most_common = []
+        if sample_size:
+            for value, count in sorted(frequencies.items(), key=lambda item: item[1], reverse=True)[:self.MOST_COMMON_VALUES]:
+                # Only values seen more than once stand out from the uniform remainder
+                if count > 1:
+                    most_common.append([value, count / sample_size])
+                    
+        ordered = sorted(non_null, key=self._sort_key)
+        histogram = []
+        if ordered:
+            buckets = min(self.HISTOGRAM_BUCKETS, len(ordered))
+            histogram = [ordered[min(i * len(ordered) // buckets, len(ordered) - 1)] for i in range(buckets)]
+            histogram.append(ordered[-1])
+            
+        return {
+            'table': table['name'],
+            'column': column_name,
+            'row_count': row_count,
+            'distinct_count': distinct_count,
+            'null_fraction': null_fraction,
+            'most_common': most_common,
+            'histogram': histogram,
+            'sampled_at': utc_timestamp()
+        }
+        
+    def _stat1_distinct(self, table, column_name):
+        """Return the distinct count of a column from sqlite_stat1 or a unique key, or None."""
+        row_count = table['row_estimate'] or 0
+        if table['rowid_alias'] and table['rowid_alias'].lower() == column_name.lower():
+            return row_count
+        conn = self.db_manager.conn
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).fetchone() is not None
+        for index in table['indexes']:
+            if not index['columns'] or (index['columns'][0] or '').lower() != column_name.lower():
+                continue
+            if index['unique'] and len(index['columns']) == 1 and not index['partial']:
+                return row_count
+            if has_stats:
+                row = conn.execute("SELECT stat FROM sqlite_stat1 WHERE idx = ?", (index['name'],)).fetchone()
+                figures = row[0].split() if row and row[0] else []
+                if len(figures) >= 2 and figures[0].isdigit() and figures[1].isdigit() and int(figures[1]):
+                    return int(figures[0]) / int(figures[1])
+        return None
+        
+    def average_width(self, table_name, column_name):
+        """Return the estimated average bytes a column takes in a record, header byte included."""
+        stats = self.column(table_name, column_name)
+        if stats is None:
+            return 8
+        values = stats['histogram'] + [value for value, _ in stats['most_common']]
+        if not values:
+            return 1
+        widths = []
+        for value in values:
+            if isinstance(value, int):
+                # Integers are stored in 1 to 8 bytes depending on magnitude
+                widths.append(min(8, max(1, (abs(int(value)).bit_length() + 8) // 8)))
+            elif isinstance(value, float):
+                widths.append(8)
+            else:
+                widths.append(len(str(value).encode('utf-8')))
+        return (1.0 - stats['null_fraction']) * sum(widths) / len(widths) + 1
+        
+    def _fraction_below(self, histogram, value, inclusive):
+        """Return the fraction of the histogram's values below (or at) a value."""
+        keys = [self._sort_key(bound) for bound in histogram]
+        key = self._sort_key(value)
+        position = bisect.bisect_right(keys, key) if inclusive else bisect.bisect_left(keys, key)
+        return position / len(keys)
+        
+    def selectivity(self, table_name, predicate):
+        """Return the estimated fraction of rows a parsed predicate selects from a table."""
+        stats = self.column(table_name, predicate['column'])
+        if stats is None:
+            return 1.0
+        row_count = max(stats['row_count'], 1)
+        not_null = 1.0 - stats['null_fraction']
+        distinct = max(stats['distinct_count'], 1)
+        common = {self._sort_key(value): fraction for value, fraction in stats['most_common']}
+        common_total = sum(common.values())
+        # Selectivity of an equality with an unknown value
+        uniform = not_null / distinct
+        
+        kind = predicate['kind']
+        value = self.literal(predicate['value'])
+        if kind == 'equality':
+            if value is None:
+                selectivity = uniform
+            elif self._sort_key(value) in common:
+                selectivity = common[self._sort_key(value)]
+            else:
+                selectivity = max(not_null - common_total, 0.0) / max(distinct - len(common), 1)
+        elif kind == 'in':
+            count = predicate['value'] if isinstance(predicate['value'], int) else 1
+            selectivity = min(1.0, count * uniform)
+        elif kind == 'join':
+            selectivity = 1.0 / distinct
+        elif kind == 'is_null':
+            selectivity = stats['null_fraction']
+        elif kind == 'range':
+            if value is None or not stats['histogram']:
+                selectivity = self.DEFAULT_RANGE_SELECTIVITY
+            elif predicate['operator'] in ('<', '<='):
+                selectivity = not_null * self._fraction_below(stats['histogram'], value, predicate['operator'] == '<=')
+            else:
+                selectivity = not_null * (1.0 - self._fraction_below(stats['histogram'], value, predicate['operator'] == '>'))
+        elif kind == 'like_prefix':
+            prefix = re.split(r'[%_]', value, maxsplit=1)[0] if isinstance(value, str) else ''
+            if not prefix or not stats['histogram']:
+                selectivity = self.DEFAULT_LIKE_SELECTIVITY
+            else:
+                upper = self._fraction_below(stats['histogram'], prefix + '\U0010ffff', False)
+                selectivity = not_null * (upper - self._fraction_below(stats['histogram'], prefix, False))
+                selectivity = max(selectivity, uniform)
+        else:
+            selectivity = 1.0
+        return min(1.0, max(selectivity, 1.0 / row_count))
+        
+    def invalidate(self):
+        """Forget the cached statistics so every column is resampled on next use."""
+        with self._lock:
+            self._cache.clear()
+            try:
+                self.db_manager.execute("DELETE FROM column_statistics")
+                self.db_manager.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error clearing column statistics: {e}")
+
+
+class QueryTimer:
+    """Times a statement from prepare until its last row has been fetched.
+
+    SQLite evaluates most of a query lazily while rows are stepped, so the
+    timing covers fetching every row rather than just cursor.execute().
+    """
+    
+    def __init__(self, fetch_size=1000):
+        """Initialize with the number of rows fetched per step batch."""
+        self.fetch_size = fetch_size
+        
+    def measure(self, cursor, query, params=(), keep_rows=True):
+        """Execute a statement on a cursor, fetch every row and return the timings.
+
+        Times are reported in seconds: execution_time covers the whole
+        statement, first_row_time the prepare plus the first row and step_time
+        the stepping of the remaining rows.
+        """
+        rows = []
+        row_count = 0
+        
+        start_ns = time.perf_counter_ns()
+        cursor.execute(query, params)
+        first_row = cursor.fetchone()
+        first_row_ns = time.perf_counter_ns()
+        
+        if first_row is not None:
+            row_count = 1
+            if keep_rows:
+                rows.append(first_row)
+            while True:
+                chunk = cursor.fetchmany(self.fetch_size)
+                if not chunk:
+                    break
+                row_count += len(chunk)
+                if keep_rows:
+                    rows.extend(chunk)
+        end_ns = time.perf_counter_ns()
+        
+        return {
+            'execution_time': (end_ns - start_ns) / 1e9,
+            'first_row_time': (first_row_ns - start_ns) / 1e9,
+            'step_time': (end_ns - first_row_ns) / 1e9,
+            'rows_returned': row_count,
+            'columns': [column[0] for column in cursor.description] if cursor.description else [],
+            'rows': rows
+        }
+
+
+class LatencySketch:
+    """Mergeable quantile sketch for query latencies.
+
+    Latencies are counted in logarithmically sized buckets (DDSketch style),
+    so every quantile is reported within the configured relative accuracy
+    and two sketches merge exactly by adding their bucket counts.
+    """
+    
+    MIN_VALUE = 1e-9
+    
+    def __init__(self, relative_accuracy=0.01):
+        """Initialize an empty sketch with the given relative accuracy."""
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        
+    def add(self, value, count=1):
+        """Add a latency value (in seconds) to the sketch."""
+        if value is None:
+            return
+        if value <= self.MIN_VALUE:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        
+    def merge(self, other):
+        """Merge another sketch with the same accuracy into this one."""
+        if other is None or other.count == 0:
+            return self
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+        
+    def quantile(self, q):
+        """Return the estimated latency at quantile q (0..1), or None if empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return self.min
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+        
+    def percentiles(self, percentiles=(50, 95, 99)):
+        """Return a dict such as {'p50': ..., 'p95': ..., 'p99': ...} in seconds."""
+        return {f"p{p}": self.quantile(p / 100.0) for p in percentiles}
+        
+    def to_json(self):
+        """Serialize the sketch for storage."""
+        return json.dumps({
+            'a': self.relative_accuracy,
+            'n': self.count,
+            's': self.total,
+            'lo': self.min,
+            'hi': self.max,
+            'z': self.zero_count,
+            'b': self.buckets
+        }, separators=(',', ':'))
+        
+    @classmethod
+    def from_json(cls, data):
+        """Deserialize a sketch produced by to_json; returns an empty sketch for None."""
+        if not data:
+            return cls()
+        raw = json.loads(data)
+        sketch = cls(raw.get('a', 0.01))
+        sketch.count = raw.get('n', 0)
+        sketch.total = raw.get('s', 0.0)
+        sketch.min = raw.get('lo')
+        sketch.max = raw.get('hi')
+        sketch.zero_count = raw.get('z', 0)
+        sketch.buckets = {int(index): count for index, count in raw.get('b', {}).items()}
+        return sketch
+
+
+class ExecutionPlanStore:
+    """Stores each distinct execution plan once, as text and as a tree of plan nodes.
+
+    Log rows reference plans by id, and the parsed nodes (operation, table
+    and index used) can be queried directly instead of searching plan text.
+    """
+    
+    CACHE_SIZE = 10000
+    _PLAN_LINE_PATTERN = re.compile(r'^(\d+)\|(\d+)\|\d*\|(.*)$')
+    _ACCESS_PATTERN = re.compile(
+        r'^(SCAN|SEARCH)\s+(?:TABLE\s+)?([^\s(]+)(?:\s+AS\s+([^\s(]+))?'
+        r'(?:\s+USING\s+(?:(COVERING)\s+)?INDEX\s+([^\s(]+)|\s+USING\s+(?:INTEGER\s+)?PRIMARY\s+KEY)?',
+        re.IGNORECASE
+    )
+    _TABLE_REFERENCE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+([\w"`\[\]]+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+    _NOT_ALIASES = {
+        'where', 'join', 'inner', 'left', 'right', 'full', 'outer', 'cross', 'natural', 'on', 'using',
+        'group', 'order', 'having', 'limit', 'union', 'except', 'intersect', 'window', 'set', 'values'
+    }
+    
+    def __init__(self):
+        """Initialize with an empty plan id cache."""
+        self._plan_ids = OrderedDict()
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def plan_hash(plan_text):
+        """Return the hash that identifies a plan."""
+        return hashlib.sha1(plan_text.encode('utf-8')).hexdigest()
+        
+    def _table_aliases(self, query):
+        """Map the aliases used in a query's FROM and JOIN clauses to table names."""
+        aliases = {}
+        for match in self._TABLE_REFERENCE_PATTERN.finditer(query or ''):
+            table_name = match.group(1).strip('"`[]')
+            aliases[table_name.lower()] = table_name
+            alias = match.group(2)
+            if alias and alias.lower() not in self._NOT_ALIASES:
+                aliases[alias.lower()] = table_name
+        return aliases
+        
+    def parse_plan(self, plan_text, query=None):
+        """Parse 'id|parent|notused|detail' plan lines into plan nodes.
+
+        Plan details name tables by alias when one is used, so the query is
+        used to resolve aliases back to table names.
+        """
+        aliases = self._table_aliases(query)
+        nodes = []
+        for position, line in enumerate((plan_text or '').splitlines()):
+            line = line.strip()
+            if not line:
+                continue
+            match = self._PLAN_LINE_PATTERN.match(line)
+            if match:
+                node_id, parent_id, detail = int(match.group(1)), int(match.group(2)), match.group(3).strip()
+            else:
+                node_id, parent_id, detail = -(position + 1), 0, line
+                
+            operation = None
+            table_name = None
+            index_name = None
+            is_covering = 0
+            access = self._ACCESS_PATTERN.match(detail)
+            if access:
+                operation = access.group(1).upper()
+                table_name = access.group(2)
+                if not access.group(3):
+                    table_name = aliases.get(table_name.lower(), table_name)
+                index_name = access.group(5)
+                is_covering = 1 if access.group(4) else 0
+            elif detail.upper().startswith('USE TEMP B-TREE'):
+                operation = 'TEMP B-TREE'
+            elif detail:
+                operation = detail.split()[0].upper()
+                
+            nodes.append({
+                'node_id': node_id,
+                'parent_id': parent_id,
+                'detail': detail,
+                'operation': operation,
+                'table_name': table_name,
+                'index_name': index_name,
+                'is_covering': is_covering
+            })
+        return nodes
+        
+    def get_or_create(self, conn, plan_text, query=None):
+        """Return the id of a stored plan, storing the plan and its nodes if it is new."""
+        if not plan_text:
+            return None
+        plan_hash = self.plan_hash(plan_text)
+        with self._lock:
+            plan_id = self._plan_ids.get(plan_hash)
+            if plan_id is not None:
+                self._plan_ids.move_to_end(plan_hash)
+                return plan_id
+                
+        row = conn.execute("SELECT id FROM execution_plans WHERE plan_hash = ?", (plan_hash,)).fetchone()
+        if row is not None:
+            plan_id = row[0]
+        else:
+            # Another writer may store the same plan in the meantime; the unique hash keeps one copy
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO execution_plans (plan_hash, plan_text) VALUES (?, ?)",
+                (plan_hash, plan_text)
+            ).rowcount
+            plan_id = conn.execute("SELECT id FROM execution_plans WHERE plan_hash = ?", (plan_hash,)).fetchone()[0]
+            if inserted:
+                conn.executemany(
+                    """
+                    INSERT OR IGNORE INTO execution_plan_nodes
+                        (plan_id, node_id, parent_id, detail, operation, table_name, index_name, is_covering)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    [
+                        (plan_id, n['node_id'], n['parent_id'], n['detail'], n['operation'],
+                         n['table_name'], n['index_name'], n['is_covering'])
+                        for n in self.parse_plan(plan_text, query)
+                    ]
+                )
+            
+        with self._lock:
+            self._plan_ids[plan_hash] = plan_id
+            if len(self._plan_ids) > self.CACHE_SIZE:
+                self._plan_ids.popitem(last=False)
+        return plan_id
+        
+    def record_use(self, conn, records):
+        """Add the records' executions to the use count and last use of their plans."""
+        usage = {}
+        for r in records:
+            if r.get('plan_id') is None:
+                continue
+            entry = usage.setdefault(r['plan_id'], [0, r['timestamp']])
+            entry[0] += 1
+            entry[1] = max(entry[1], r['timestamp'])
+        conn.executemany(
+            "UPDATE execution_plans SET use_count = use_count + ?, "
+            "last_used = MAX(COALESCE(last_used, ''), ?) WHERE id = ?",
+            [(count, last_used, plan_id) for plan_id, (count, last_used) in usage.items()]
+        )
+        
+    def clear_cache(self):
+        """Forget cached plan ids, e.g. after a rolled back transaction."""
+        with self._lock:
+            self._plan_ids.clear()
+            
+    def get_texts(self, conn, plan_ids):
+        """Return {plan_id: plan_text} for the given plan ids."""
+        plan_ids = [plan_id for plan_id in set(plan_ids) if plan_id is not None]
+        texts = {}
+        for start in range(0, len(plan_ids), 500):
+            chunk = plan_ids[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            for row in conn.execute(f"SELECT id, plan_text FROM execution_plans WHERE id IN ({placeholders})", chunk):
+                texts[row[0]] = row[1]
+        return texts
+        
+    def get_nodes(self, conn, plan_ids):
+        """Return {plan_id: [nodes]} for the given plan ids."""
+        plan_ids = [plan_id for plan_id in set(plan_ids) if plan_id is not None]
+        nodes = {plan_id: [] for plan_id in plan_ids}
+        # Stay well below SQLite's host parameter limit
+        for start in range(0, len(plan_ids), 500):
+            chunk = plan_ids[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            rows = conn.execute(
+                f"""
+                SELECT plan_id, node_id, parent_id, detail, operation, table_name, index_name, is_covering
+                FROM execution_plan_nodes
+                WHERE plan_id IN ({placeholders})
+                ORDER BY plan_id, node_id
+                """,
+                chunk
+            ).fetchall()
+            for row in rows:
+                nodes[row[0]].append({
+                    'node_id': row[1],
+                    'parent_id': row[2],
+                    'detail': row[3],
+                    'operation': row[4],
+                    'table_name': row[5],
+                    'index_name': row[6],
+                    'is_covering': row[7]
+                })
+        return nodes
+
+
+class QueryLogStore:
+    """Stores query logs in one SQLite file per UTC day.
+
+    Retention deletes whole partition files instead of deleting rows, and
+    readers only open the partitions that overlap the requested time range.
+    Log ids embed the partition day (day ordinal * ID_SPAN + row number), so
+    they are unique across partitions and map back to their partition.
+    """
+    
+    ID_SPAN = 1 << 32
+    CACHE_SIZE = 8
+    COLUMNS = (
+        "id, query, execution_time, execution_plan, plan_id, timestamp, fingerprint, "
+        "rows_returned, first_row_time, step_time"
+    )
+    _FILE_PATTERN = re.compile(r'^query_logs_(\d{8})\.db$')
+    
+    def __init__(self, directory):
+        """Initialize with the directory that holds the partition files."""
+        self.directory = directory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Bumped whenever partitions are dropped so each thread closes its own
+        # connections to them on its next access
+        self._epoch = 0
+        # Dropped partitions whose files wait until no live thread has them open
+        self._dropped = set()
+        self._initialized = set()
+        # Partition path -> {connection: thread that opened it}
+        self._open = {}
+        
+    @classmethod
+    def for_database(cls, db_file):
+        """Return a store for the partitions kept next to a database file."""
+        return cls(os.path.splitext(db_file)[0] + '_logs')
+        
+    @staticmethod
+    def partition_key(timestamp):
+        """Return the partition key (YYYYMMDD) of a 'YYYY-MM-DD HH:MM:SS' timestamp or date."""
+        return timestamp[0:4] + timestamp[5:7] + timestamp[8:10]
+        
+    def id_base(self, key):
+        """Return the first id of a partition; its rows get ids above it."""
+        return date(int(key[0:4]), int(key[4:6]), int(key[6:8])).toordinal() * self.ID_SPAN
+        
+    def partition_of(self, log_id):
+        """Return the partition key a log id belongs to."""
+        return date.fromordinal(log_id // self.ID_SPAN).strftime('%Y%m%d')
+        
+    def path(self, key):
+        """Return the file path of a partition."""
+        return os.path.join(self.directory, f"query_logs_{key}.db")
+        
+    def partitions(self, start=None, end=None, newest_first=False):
+        """Return the keys of the existing partitions overlapping [start, end)."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        keys = []
+        for name in names:
+            match = self._FILE_PATTERN.match(name)
+            if not match:
+                continue
+            key = match.group(1)
+            if key in self._dropped:
+                continue
+            if start is not None and key < self.partition_key(start):
+                continue
+            if end is not None and key > self.partition_key(end):
+                continue
+            keys.append(key)
+        return sorted(keys, reverse=newest_first)
+        
+    def connection(self, key, create=False):
+        """Return this thread's connection to a partition, or None if it does not exist."""
+        cache = getattr(self._local, 'connections', None)
+        if cache is None:
+            cache = self._local.connections = OrderedDict()
+            self._local.epoch = self._epoch
+        elif self._local.epoch != self._epoch:
+            self._close_dropped(cache)
+            
+        conn = cache.get(key)
+        if conn is not None:
+            cache.move_to_end(key)
+            return conn
+            
+        path = self.path(key)
+        # Opened under the lock so a partition cannot be dropped while it is being opened
+        with self._lock:
+            if key in self._dropped:
+                if not create:
+                    return None
+                # Written to again before its last reader let go; the next retention run drops it
+                self._dropped.discard(key)
+            if not create and not os.path.exists(path):
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            if path not in self._initialized:
+                self._create_schema(conn, key)
+                self._initialized.add(path)
+            self._open.setdefault(path, {})[conn] = threading.current_thread()
+                
+        cache[key] = conn
+        if len(cache) > self.CACHE_SIZE:
+            self._release(*cache.popitem(last=False))
+        return conn
+        
+    def _release(self, key, conn):
+        """Close one of the calling thread's partition connections and forget it."""
+        conn.close()
+        with self._lock:
+            self._open.get(self.path(key), {}).pop(conn, None)
+            if key in self._dropped:
+                self._remove_dropped()
+                
+    def _close_dropped(self, cache):
+        """Close the calling thread's connections to partitions dropped since its last access."""
+        with self._lock:
+            dropped, epoch = set(self._dropped), self._epoch
+        for key in [key for key in cache if key in dropped]:
+            self._release(key, cache.pop(key))
+        self._local.epoch = epoch
+        
+    def _remove_dropped(self):
+        """Delete the files of dropped partitions no live thread has open; called with the lock held."""
+        for key in list(self._dropped):
+            path = self.path(key)
+            connections = self._open.get(path, {})
+            if any(thread.is_alive() for thread in connections.values()):
+                continue
+            # Connections left behind by finished threads are never used again
+            for conn in connections:
+                conn.close()
+            self._open.pop(path, None)
+            self._dropped.discard(key)
+            self._initialized.discard(path)
+            for suffix in ('', '-wal', '-shm', '-journal'):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not remove query log partition file {path + suffix}: {e}")
+        
+    def _create_schema(self, conn, key):
+        """Create the log table of a partition and start its ids at the partition base."""
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS query_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    query TEXT NOT NULL,
+                    execution_time REAL NOT NULL,
+                    execution_plan TEXT,
+                    plan_id INTEGER,
+                    timestamp TEXT NOT NULL,
+                    fingerprint TEXT,
+                    rows_returned INTEGER,
+                    first_row_time REAL,
+                    step_time REAL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_timestamp ON query_logs (timestamp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_execution_time ON query_logs (execution_time)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_fingerprint ON query_logs (fingerprint)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_plan ON query_logs (plan_id)")
+            conn.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT 'query_logs', ? "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'query_logs')",
+                (self.id_base(key),)
+            )
+            
+    def insert(self, rows, skip_existing=False):
+        """Insert log rows (dicts with the log columns) into their partitions and return the last id.
+
+        Each partition is written in its own transaction. Rows that carry an
+        id keep it; with skip_existing=True rows whose id is already stored
+        are skipped, which makes re-running a move of existing rows safe.
+        """
+        by_partition = OrderedDict()
+        for row in rows:
+            by_partition.setdefault(self.partition_key(row['timestamp']), []).append(row)
+            
+        last_id = None
+        for key, partition_rows in by_partition.items():
+            conn = self.connection(key, create=True)
+            values = [
+                (row.get('id'), row['query'], row['execution_time'], row.get('execution_plan'), row.get('plan_id'),
+                 row['timestamp'], row.get('fingerprint'), row.get('rows_returned'), row.get('first_row_time'),
+                 row.get('step_time'))
+                for row in partition_rows
+            ]
+            statement = (
+                f"INSERT {'OR IGNORE ' if skip_existing else ''}INTO query_logs ({self.COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            )
+            with conn:
+                if len(values) == 1:
+                    last_id = conn.execute(statement, values[0]).lastrowid
+                else:
+                    conn.executemany(statement, values)
+        return last_id
+        
+    def fetch(self, sql, params=(), start=None, end=None, newest_first=True):
+        """Run a query against every partition overlapping [start, end) and yield its rows.
+
+        Partitions are opened lazily, so a caller that stops early does not
+        touch the remaining ones.
+        """
+        for key in self.partitions(start, end, newest_first):
+            conn = self.connection(key)
+            if conn is None:
+                continue
+            yield from conn.execute(sql, params)
+            
+    def count(self):
+        """Return the number of logged rows across all partitions."""
+        total = 0
+        for key in self.partitions():
+            conn = self.connection(key)
+            if conn is None:
+                continue
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'query_logs'").fetchone()
+            # Rows are only ever removed with their partition, so ids are dense
+            if row is not None:
+                total += row[0] - self.id_base(key)
+        return total
+        
+    def drop_before(self, cutoff_date):
+        """Delete every partition older than a cutoff date (YYYY-MM-DD) and return the rows dropped.
+
+        Dropped partitions are no longer listed or opened. Other threads are
+        never interrupted: each closes its own connections to them on its next
+        access, and a partition's files are deleted once no live thread still
+        has it open.
+        """
+        cutoff_key = self.partition_key(cutoff_date)
+        keys = [key for key in self.partitions() if key < cutoff_key]
+        if not keys:
+            return 0
+        dropped = 0
+        for key in keys:
+            conn = self.connection(key)
+            if conn is not None:
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'query_logs'").fetchone()
+                dropped += row[0] - self.id_base(key) if row is not None else 0
+                
+        with self._lock:
+            self._epoch += 1
+            self._dropped.update(keys)
+        self._close_dropped(self._local.connections)
+        with self._lock:
+            self._remove_dropped()
+        return dropped
+        
+    def close(self):
+        """Close the partition connections opened by the calling thread."""
+        cache = getattr(self._local, 'connections', None)
+        if cache:
+            for key, conn in list(cache.items()):
+                self._release(key, conn)
+            cache.clear()
+
+
+class QueryLogWriter:
+    """Writes captured query records to query_logs and the per-shape statistics.
+
+    In direct mode records are written synchronously on the caller's
+    connection. In buffered mode they are queued in memory and a background
+    thread writes them with executemany, one transaction per batch, whenever
+    the batch fills up or the flush interval elapses. The log rows themselves
+    go to the daily partitions of a QueryLogStore.
+    """
+    
+    FINGERPRINT_UPSERT = """
+        INSERT INTO query_fingerprints
+            (fingerprint, normalized_query, sample_query, query_count, total_time, min_time, max_time, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(fingerprint) DO UPDATE SET
+            query_count = query_count + excluded.query_count,
+            total_time = total_time + excluded.total_time,
+            min_time = MIN(COALESCE(min_time, excluded.min_time), excluded.min_time),
+            max_time = MAX(COALESCE(max_time, excluded.max_time), excluded.max_time),
+            last_seen = MAX(last_seen, excluded.last_seen)
+    """
+    TABLE_WRITES_UPSERT = """
+        INSERT INTO table_writes (table_name, write_count, last_write) VALUES (?, ?, ?)
+        ON CONFLICT(table_name) DO UPDATE SET
+            write_count = write_count + excluded.write_count,
+            last_write = MAX(COALESCE(last_write, excluded.last_write), excluded.last_write)
+    """
+    ROLLUP_GRANULARITIES = ('minute', 'hour', 'day')
+    # Statements starting with these words may modify a table
+    WRITE_KEYWORDS = ('insert', 'update', 'delete', 'replace', 'with')
+    TARGET_CACHE_SIZE = 5000
+    # A failed batch is tried this many times, waiting RETRY_DELAY seconds longer each time
+    WRITE_ATTEMPTS = 3
+    RETRY_DELAY = 0.1
+    _STOP = object()
+    
+    def __init__(self, db_file, batch_size=500, flush_interval=1.0, log_store=None):
+        """Initialize with the database file, batching thresholds and log partition store."""
+        self.db_file = db_file
+        self.log_store = log_store or QueryLogStore.for_database(db_file)
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.plan_store = ExecutionPlanStore()
+        self.parser = SQLParser()
+        # Table each query shape writes to, or None for reads
+        self._targets = OrderedDict()
+        self._targets_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+        
+    def write_batch(self, conn, records):
+        """Write a batch of records on a connection and return the last log id.
+
+        The caller owns the statistics transaction and is responsible for
+        committing; the log rows are committed to their partitions here,
+        before it. A failure can therefore leave some partitions written
+        while the statistics are rolled back, so records are marked 'logged'
+        once their partition is committed and a retry of the batch only
+        redoes the statistics for them.
+        """
+        if not records:
+            return None
+            
+        # Records that were not sampled only contribute to the statistics
+        sampled = [r for r in records if r.get('sampled', True)]
+        rows = [
+            dict(r, plan_id=self.plan_store.get_or_create(conn, r.get('execution_plan'), r['query']), execution_plan=None)
+            for r in sampled
+        ]
+        self.plan_store.record_use(conn, rows)
+        self.fold_statistics(conn, records)
+        
+        by_partition = OrderedDict()
+        for record, row in zip(sampled, rows):
+            if not record.get('logged'):
+                by_partition.setdefault(QueryLogStore.partition_key(row['timestamp']), []).append((record, row))
+        last_id = None
+        for pairs in by_partition.values():
+            last_id = self.log_store.insert([row for _, row in pairs])
+            for record, _ in pairs:
+                record['logged'] = True
+        return last_id
+        
+    def write(self, conn, records):
+        """Write a batch in one statistics transaction, retrying failures, and return the last log id.
+
+        A batch that still fails after WRITE_ATTEMPTS is dropped and the
+        number of log rows and executions lost is logged.
+        """
+        error = None
+        for attempt in range(1, self.WRITE_ATTEMPTS + 1):
+            try:
+                with conn:
+                    return self.write_batch(conn, records)
+            except sqlite3.Error as e:
+                # Plan ids cached during the failed transaction no longer exist
+                self.plan_store.clear_cache()
+                error = e
+                if attempt < self.WRITE_ATTEMPTS:
+                    logger.warning(f"Error writing {len(records)} query log records, retrying: {e}")
+                    time.sleep(self.RETRY_DELAY * attempt)
+        lost_rows = sum(1 for r in records if r.get('sampled', True) and not r.get('logged'))
+        logger.error(
+            f"Dropped {lost_rows} query log rows and the statistics of {len(records)} executions "
+            f"after {self.WRITE_ATTEMPTS} attempts: {error}"
+        )
+        return None
+        
+    def fold_statistics(self, conn, records):
+        """Fold records into the per-shape statistics and latency sketches."""
+        # Aggregate the batch per fingerprint so each shape is upserted only once
+        stats = {}
+        for r in records:
+            entry = stats.get(r['fingerprint'])
+            if entry is None:
+                stats[r['fingerprint']] = [
+                    r['fingerprint'], r['normalized_query'], r['query'], 1, r['execution_time'],
+                    r['execution_time'], r['execution_time'], r['timestamp'], r['timestamp']
+                ]
+            else:
+                entry[3] += 1
+                entry[4] += r['execution_time']
+                entry[5] = min(entry[5], r['execution_time'])
+                entry[6] = max(entry[6], r['execution_time'])
+                entry[8] = max(entry[8], r['timestamp'])
+        conn.executemany(self.FINGERPRINT_UPSERT, list(stats.values()))
+        self._update_sketches(conn, records)
+        self.update_rollups(conn, records)
+        self._count_table_writes(conn, records)
+        
+    def target_table(self, record):
+        """Return the table a captured statement writes to, or None; parsed once per query shape."""
+        fingerprint = record['fingerprint']
+        with self._targets_lock:
+            if fingerprint in self._targets:
+                self._targets.move_to_end(fingerprint)
+                return self._targets[fingerprint]
+            target = None
+            if (record['normalized_query'] or '').split(' ', 1)[0] in self.WRITE_KEYWORDS:
+                try:
+                    parsed = self.parser.analyze(record['query'])
+                    if parsed['statement'] in ('insert', 'update', 'delete'):
+                        target = parsed['target_table']
+                except SQLParseError:
+                    pass
+            self._targets[fingerprint] = target
+            if len(self._targets) > self.TARGET_CACHE_SIZE:
+                self._targets.popitem(last=False)
+            return target
+            
+    def _count_table_writes(self, conn, records):
+        """Add the batch's write executions to the per-table write counters."""
+        writes = {}
+        for r in records:
+            table_name = self.target_table(r)
+            if table_name is not None:
+                entry = writes.setdefault(table_name.lower(), [table_name.lower(), 0, r['timestamp']])
+                entry[1] += 1
+                entry[2] = max(entry[2], r['timestamp'])
+        if writes:
+            conn.executemany(self.TABLE_WRITES_UPSERT, list(writes.values()))
+        
+    @staticmethod
+    def bucket_start(timestamp, granularity):
+        """Return the start of the minute, hour or day bucket containing a timestamp."""
+        if granularity == 'minute':
+            return timestamp[:16] + ':00'
+        if granularity == 'hour':
+            return timestamp[:13] + ':00:00'
+        return timestamp[:10] + ' 00:00:00'
+        
+    def update_rollups(self, conn, records):
+        """Merge records (execution_time, timestamp) into the minute, hour and day rollups."""
+        rollups = {}
+        for r in records:
+            for granularity in self.ROLLUP_GRANULARITIES:
+                key = (granularity, self.bucket_start(r['timestamp'], granularity))
+                entry = rollups.get(key)
+                if entry is None:
+                    entry = rollups[key] = {
+                        'count': 0,
+                        'total_time': 0.0,
+                        'min_time': r['execution_time'],
+                        'max_time': r['execution_time'],
+                        'sketch': LatencySketch()
+                    }
+                entry['count'] += 1
+                entry['total_time'] += r['execution_time']
+                entry['min_time'] = min(entry['min_time'], r['execution_time'])
+                entry['max_time'] = max(entry['max_time'], r['execution_time'])
+                entry['sketch'].add(r['execution_time'])
+                
+        updates = []
+        for (granularity, bucket_start), entry in rollups.items():
+            row = conn.execute(
+                "SELECT query_count, total_time, min_time, max_time, sketch FROM query_rollups "
+                "WHERE granularity = ? AND bucket_start = ?",
+                (granularity, bucket_start)
+            ).fetchone()
+            if row is not None:
+                entry['count'] += row[0]
+                entry['total_time'] += row[1]
+                entry['min_time'] = min(entry['min_time'], row[2])
+                entry['max_time'] = max(entry['max_time'], row[3])
+                entry['sketch'].merge(LatencySketch.from_json(row[4]))
+            updates.append((
+                granularity, bucket_start, entry['count'], entry['total_time'],
+                entry['min_time'], entry['max_time'], entry['sketch'].to_json()
+            ))
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO query_rollups
+                (granularity, bucket_start, query_count, total_time, min_time, max_time, sketch)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            updates
+        )
+        
+    def _update_sketches(self, conn, records):
+        """Merge the batch into the hourly and all-time latency sketches of each shape."""
+        hourly = {}
+        overall = {}
+        for r in records:
+            bucket_start = self.bucket_start(r['timestamp'], 'hour')
+            key = (r['fingerprint'], bucket_start)
+            if key not in hourly:
+                hourly[key] = LatencySketch()
+            hourly[key].add(r['execution_time'])
+            if r['fingerprint'] not in overall:
+                overall[r['fingerprint']] = LatencySketch()
+            overall[r['fingerprint']].add(r['execution_time'])
+            
+        updates = []
+        for (fingerprint, bucket_start), sketch in hourly.items():
+            row = conn.execute(
+                "SELECT sketch FROM latency_sketches WHERE fingerprint = ? AND bucket_start = ?",
+                (fingerprint, bucket_start)
+            ).fetchone()
+            if row is not None:
+                sketch.merge(LatencySketch.from_json(row[0]))
+            updates.append((fingerprint, bucket_start, sketch.to_json()))
+        conn.executemany(
+            "INSERT OR REPLACE INTO latency_sketches (fingerprint, bucket_start, sketch) VALUES (?, ?, ?)",
+            updates
+        )
+        
+        updates = []
+        for fingerprint, sketch in overall.items():
+            row = conn.execute(
+                "SELECT latency_sketch FROM query_fingerprints WHERE fingerprint = ?",
+                (fingerprint,)
+            ).fetchone()
+            if row is not None:
+                sketch.merge(LatencySketch.from_json(row[0]))
+            updates.append((sketch.to_json(), fingerprint))
+        conn.executemany("UPDATE query_fingerprints SET latency_sketch = ? WHERE fingerprint = ?", updates)
+        
+    def start(self):
+        """Start the background flush thread if it is not already running."""
+        with self._start_lock:
+            if self._closed:
+                return False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='QueryLogWriter', daemon=True)
+                self._thread.start()
+            return True
+            
+    def enqueue(self, record):
+        """Queue a record for the next batch."""
+        if self._thread is None and not self.start():
+            logger.warning("Query log writer is closed; dropping log record")
+            return
+        self._queue.put(record)
+        
+    def pending(self):
+        """Return the approximate number of records waiting to be written."""
+        return self._queue.qsize()
+        
+    def flush(self, timeout=None):
+        """Block until every record queued so far has been written."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+        
+    def close(self, timeout=None):
+        """Flush outstanding records and stop the background thread."""
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+            
+    def _run(self):
+        """Collect queued records and write them in batches until stopped."""
+        # The monitored database keeps the journal mode its application chose
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        batch = []
+        waiters = []
+        stopping = False
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while not stopping:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    item = None
+                    
+                if item is self._STOP:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif item is not None:
+                    batch.append(item)
+                    
+                expired = time.monotonic() >= deadline
+                if batch and (len(batch) >= self.batch_size or expired or waiters or stopping):
+                    self.write(conn, batch)
+                    batch = []
+                if expired:
+                    deadline = time.monotonic() + self.flush_interval
+                for waiter in waiters:
+                    waiter.set()
+                waiters = []
+        finally:
+            self.log_store.close()
+            conn.close()
+
+
+class QueryMonitor:
+    """Monitors queries and their execution plans."""
+    
+    PLAN_CACHE_SIZE = 5000
+    
+    def __init__(self, db_manager, config_manager=None):
+        """Initialize with a database manager and optional configuration."""
+        self.db_manager = db_manager
+        self.fingerprinter = QueryFingerprinter()
+        self.timer = QueryTimer()
+        
+        capture_mode = 'direct'
+        batch_size = 500
+        flush_interval = 1.0
+        sample_rate = 1.0
+        slow_query_threshold = 1.0
+        if config_manager is not None:
+            capture_mode = config_manager.get('MONITORING', 'capture_mode', capture_mode).strip().lower()
+            batch_size = int(config_manager.get('MONITORING', 'batch_size', batch_size))
+            flush_interval = float(config_manager.get('MONITORING', 'flush_interval', flush_interval))
+            sample_rate = float(config_manager.get('MONITORING', 'sample_rate', sample_rate))
+            slow_query_threshold = float(config_manager.get('MONITORING', 'slow_query_threshold', slow_query_threshold))
+        self.buffered = capture_mode == 'buffered'
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.slow_query_threshold = slow_query_threshold
+        self.log_writer = QueryLogWriter(db_manager.db_file, batch_size, flush_interval, db_manager.log_store)
+        if self.buffered:
+            self.log_writer.start()
+        # Unsampled executions waiting to be folded into the statistics in direct mode
+        self._pending = []
+            
+        # Execution plans per (fingerprint, schema_version), reused until the schema changes
+        self._plan_cache = OrderedDict()
+        self._plan_cache_version = None
+        
+    def capture_query(self, query, force=False):
+        """Capture a query, its execution plan and execution time.
+
+        The execution is sampled like any other unless force is set. In
+        buffered mode, or when the execution was not sampled, the returned
+        query id is None.
+        """
+        result = self.capture(query, force=force)
+        if 'error' in result:
+            return None, result['error'], None
+        return result['execution_time'], result['execution_plan'], result['query_id']
+        
+    def capture(self, query, force=False):
+        """Capture a query and return its timings, execution plan and result rows.
+
+        Every execution is counted in the per-shape statistics, but only a
+        sample of executions (sample_rate, plus every execution slower than
+        slow_query_threshold) is written to query_logs with its plan. Pass
+        force=True only for an explicit analysis request that needs the plan.
+        """
+        try:
+            if query.strip().upper().startswith(('EXPLAIN', 'PRAGMA')):
+                # We don't log EXPLAIN or PRAGMA queries
+                self.db_manager.execute(query)
+                return {'execution_time': None, 'execution_plan': None, 'query_id': None}
+                
+            fingerprint, normalized_query = self.fingerprinter.fingerprint(query)
+            sampled = force or self.sample_rate >= 1.0 or random.random() < self.sample_rate
+            
+            # Plans are looked up before execution so DDL can still be explained
+            execution_plan = self._get_execution_plan(query, fingerprint) if sampled else None
+            
+            # Execute query and measure performance, including fetching every row
+            self.db_manager.ensure_connected()
+            timing = self.timer.measure(self.db_manager.cursor, query)
+            if self.db_manager.conn.in_transaction:
+                # Data modifications issued through the monitor are committed like before
+                self.db_manager.commit()
+                
+            if not sampled and timing['execution_time'] >= self.slow_query_threshold:
+                # Slow executions are always logged
+                sampled = True
+                try:
+                    execution_plan = self._get_execution_plan(query, fingerprint)
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not explain slow query after execution: {e}")
+            
+            # Log query together with its shape
+            record = {
+                'query': query,
+                'normalized_query': normalized_query,
+                'fingerprint': fingerprint,
+                'execution_time': timing['execution_time'],
+                'first_row_time': timing['first_row_time'],
+                'step_time': timing['step_time'],
+                'rows_returned': timing['rows_returned'],
+                'execution_plan': execution_plan,
+                'timestamp': utc_timestamp(),
+                'sampled': sampled
+            }
+            timing['query_id'] = self._log(record)
+            timing['execution_plan'] = execution_plan
+            timing['fingerprint'] = fingerprint
+            timing['sampled'] = sampled
+            
+            return timing
+        except Exception as e:
+            logger.error(f"Error capturing query: {e}")
+            return {'error': str(e)}
+            
+    def _get_execution_plan(self, query, fingerprint):
+        """Return the execution plan of a query, explaining each shape once per schema version."""
+        schema_version = self.db_manager.get_schema_version()
+        if schema_version != self._plan_cache_version:
+            self._plan_cache.clear()
+            self._plan_cache_version = schema_version
+            
+        execution_plan = self._plan_cache.get(fingerprint)
+        if execution_plan is not None:
+            self._plan_cache.move_to_end(fingerprint)
+            return execution_plan
+            
+        plan_rows = self.db_manager.execute_and_fetch(f"EXPLAIN QUERY PLAN {query}")
+        execution_plan = "\n".join([f"{row['id']}|{row['parent']}|{row['notused']}|{row['detail']}" for row in plan_rows])
+        self._plan_cache[fingerprint] = execution_plan
+        if len(self._plan_cache) > self.PLAN_CACHE_SIZE:
+            self._plan_cache.popitem(last=False)
+        return execution_plan
+        
+    def _log(self, record):
+        """Hand a captured record to the log writer and return its id when known."""
+        if self.buffered:
+            self.log_writer.enqueue(record)
+            return None
+        # Unsampled reads are only folded into the statistics once a batch has
+        # built up, or together with the next sampled execution or write; writes
+        # go out at once so stored comparisons of their table stop being served
+        self._pending.append(record)
+        if (not record['sampled'] and len(self._pending) < self.log_writer.batch_size
+                and self.log_writer.target_table(record) is None):
+            return None
+        return self._write_pending()
+        
+    def _write_pending(self):
+        """Write the pending direct-mode records and return the last log id."""
+        records, self._pending = self._pending, []
+        if not records:
+            return None
+        # Writing through the connection keeps the shared cursor's result set intact
+        return self.log_writer.write(self.db_manager.conn, records)
+        
+    def flush(self, timeout=None):
+        """Wait until buffered or pending log records have been written."""
+        if not self.buffered:
+            self._write_pending()
+        return self.log_writer.flush(timeout)
+        
+    def close(self):
+        """Flush buffered log records and stop the background writer."""
+        self.flush()
+        self.log_writer.close()
+            
+    def backfill_fingerprints(self, batch_size=1000):
+        """Fingerprint logged queries that were captured before fingerprinting existed."""
+        log_store = self.db_manager.log_store
+        try:
+            backfilled = 0
+            for key in log_store.partitions():
+                partition = log_store.connection(key)
+                while True:
+                    logs = partition.execute(
+                        "SELECT id, query, execution_time, timestamp FROM query_logs WHERE fingerprint IS NULL LIMIT ?",
+                        (batch_size,)
+                    ).fetchall()
+                    if not logs:
+                        break
+                        
+                    records = []
+                    updates = []
+                    for log in logs:
+                        fingerprint, normalized_query = self.fingerprinter.fingerprint(log['query'])
+                        updates.append((fingerprint, log['id']))
+                        records.append({
+                            'query': log['query'],
+                            'normalized_query': normalized_query,
+                            'fingerprint': fingerprint,
+                            'execution_time': log['execution_time'],
+                            'timestamp': log['timestamp']
+                        })
+                    self.log_writer.fold_statistics(self.db_manager.conn, records)
+                    with partition:
+                        partition.executemany("UPDATE query_logs SET fingerprint = ? WHERE id = ?", updates)
+                    self.db_manager.commit()
+                    backfilled += len(logs)
+                    
+            if backfilled:
+                logger.info(f"Backfilled fingerprints for {backfilled} logged queries")
+            return backfilled
+        except sqlite3.Error as e:
+            self.db_manager.conn.rollback()
+            logger.error(f"Error backfilling query fingerprints: {e}")
+            return 0
+            
+    def backfill_execution_plans(self, batch_size=1000):
+        """Move plan text stored on older log rows into the deduplicated plan store."""
+        log_store = self.db_manager.log_store
+        plan_store = self.log_writer.plan_store
+        try:
+            backfilled = 0
+            for key in log_store.partitions():
+                partition = log_store.connection(key)
+                while True:
+                    logs = partition.execute(
+                        "SELECT id, query, execution_plan FROM query_logs "
+                        "WHERE plan_id IS NULL AND execution_plan IS NOT NULL LIMIT ?",
+                        (batch_size,)
+                    ).fetchall()
+                    if not logs:
+                        break
+                        
+                    updates = [
+                        (plan_store.get_or_create(self.db_manager.conn, log['execution_plan'], log['query']), log['id'])
+                        for log in logs
+                    ]
+                    # Plans are committed first so log rows never point at a missing plan
+                    self.db_manager.commit()
+                    with partition:
+                        partition.executemany(
+                            "UPDATE query_logs SET plan_id = ?, execution_plan = NULL WHERE id = ?",
+                            updates
+                        )
+                    backfilled += len(logs)
+                    
+            if backfilled:
+                logger.info(f"Moved execution plans of {backfilled} logged queries into the plan store")
+            return backfilled
+        except sqlite3.Error as e:
+            self.db_manager.conn.rollback()
+            self.log_writer.plan_store.clear_cache()
+            logger.error(f"Error backfilling execution plans: {e}")
+            return 0
+            
+    def clear_logs(self, cutoff_date):
+        """Drop logged queries older than a cutoff date (YYYY-MM-DD) and return the count.
+
+        Logs are partitioned by day, so retention deletes whole partition
+        files and never takes a lock on the partitions being written.
+        """
+        try:
+            deleted = self.db_manager.log_store.drop_before(cutoff_date)
+            # Minute rollups only serve recent charts; hour and day rollups are kept
+            self.db_manager.execute(
+                "DELETE FROM query_rollups WHERE granularity = 'minute' AND bucket_start < ?",
+                (cutoff_date,)
+            )
+            self.db_manager.commit()
+            return deleted
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Error clearing query logs: {e}")
+            return 0
+            
+    def _with_plans(self, logs):
+        """Fill in the execution plan text of log rows from the plan store."""
+        plans = self.log_writer.plan_store.get_texts(self.db_manager.conn, [log['plan_id'] for log in logs])
+        for log in logs:
+            if log['execution_plan'] is None:
+                log['execution_plan'] = plans.get(log['plan_id'])
+        return logs
+            
+    def get_query_logs(self, limit=100, start=None, end=None):
+        """Retrieve the most recent query logs, optionally between start and end (UTC timestamps)."""
+        try:
+            conditions = []
+            params = []
+            if start is not None:
+                conditions.append("timestamp >= ?")
+                params.append(start)
+            if end is not None:
+                conditions.append("timestamp < ?")
+                params.append(end)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            # Partitions are read newest first, so the first rows are the most recent overall
+            logs = self.db_manager.log_store.fetch(
+                f"SELECT {QueryLogStore.COLUMNS} FROM query_logs {where} ORDER BY timestamp DESC LIMIT ?",
+                tuple(params) + (limit,),
+                start,
+                end
+            )
+            return self._with_plans([dict(log) for log in itertools.islice(logs, limit)])
+        except sqlite3.Error as e:
+            logger.error(f"Error getting query logs: {e}")
+            return []
+            
+    def get_slow_queries(self, threshold=1.0, limit=20):
+        """Retrieve slow queries above threshold execution time."""
+        try:
+            logs = self.db_manager.log_store.fetch(
+                f"SELECT {QueryLogStore.COLUMNS} FROM query_logs "
+                f"WHERE execution_time > ? ORDER BY execution_time DESC LIMIT ?",
+                (threshold, limit)
+            )
+            logs = heapq.nlargest(limit, (dict(log) for log in logs), key=lambda log: log['execution_time'])
+            return self._with_plans(logs)
+        except sqlite3.Error as e:
+            logger.error(f"Error getting slow queries: {e}")
+            return []
+            
+    def get_frequent_queries(self, limit=20):
+        """Retrieve the most frequent query shapes."""
+        try:
+            logs = self.db_manager.execute_and_fetch(
+                """
+                SELECT fingerprint, normalized_query AS query, sample_query,
+                       query_count AS count, total_time / query_count AS avg_time,
+                       min_time, max_time, total_time, latency_sketch
+                FROM query_fingerprints
+                WHERE query_count > 0
+                ORDER BY query_count DESC
+                LIMIT ?
+                """,
+                (limit,)
+            )
+            result = []
+            for log in logs:
+                entry = dict(log)
+                entry.update(LatencySketch.from_json(entry.pop('latency_sketch')).percentiles())
+                result.append(entry)
+            return result
+        except sqlite3.Error as e:
+            logger.error(f"Error getting frequent queries: {e}")
+            return []
+            
+    def get_fingerprint_stats(self, fingerprint):
+        """Retrieve the aggregate statistics of a single query shape."""
+        try:
+            stats = self.db_manager.execute_and_fetch(
+                "SELECT *, total_time / query_count AS avg_time FROM query_fingerprints WHERE fingerprint = ?",
+                (fingerprint,),
+                fetch_all=False
+            )
+            if not stats:
+                return None
+            stats = dict(stats)
+            stats.update(LatencySketch.from_json(stats.pop('latency_sketch')).percentiles())
+            return stats
+        except sqlite3.Error as e:
+            logger.error(f"Error getting fingerprint stats: {e}")
+            return None
+            
+    def get_latency_percentiles(self, fingerprint=None, start=None, end=None, percentiles=(50, 95, 99)):
+        """Return latency percentiles (in seconds) from the stored sketches.
+
+        Without a time window the all-time sketch of a fingerprint is used;
+        otherwise the hourly sketches between start and end (UTC timestamp
+        strings) are merged, across all fingerprints if none is given.
+        """
+        try:
+            sketch = LatencySketch()
+            if fingerprint is not None and start is None and end is None:
+                row = self.db_manager.execute_and_fetch(
+                    "SELECT latency_sketch FROM query_fingerprints WHERE fingerprint = ?",
+                    (fingerprint,),
+                    fetch_all=False
+                )
+                if row is not None:
+                    sketch.merge(LatencySketch.from_json(row['latency_sketch']))
+            else:
+                conditions = []
+                params = []
+                if fingerprint is not None:
+                    conditions.append("fingerprint = ?")
+                    params.append(fingerprint)
+                if start is not None:
+                    conditions.append("bucket_start >= ?")
+                    params.append(start[:13] + ':00:00')
+                if end is not None:
+                    conditions.append("bucket_start < ?")
+                    params.append(end)
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+                for row in self.db_manager.execute_and_fetch(f"SELECT sketch FROM latency_sketches {where}", tuple(params)):
+                    sketch.merge(LatencySketch.from_json(row['sketch']))
+                    
+            result = sketch.percentiles(percentiles)
+            result['count'] = sketch.count
+            return result
+        except sqlite3.Error as e:
+            logger.error(f"Error getting latency percentiles: {e}")
+            return {}
+
+
+class WorkloadIngester:
+    """Loads captured workloads from trace files into the query logs.
+
+    JSON lines, CSV and plain SQL statement files are read as streams and
+    written in large batches, each batch fingerprinted and folded into the
+    per-shape statistics in one transaction, so memory use is bounded by
+    the batch size rather than the file size.
+    """
+    
+    FORMATS = {
+        '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'json',
+        '.csv': 'csv',
+        '.sql': 'sql', '.log': 'sql', '.txt': 'sql'
+    }
+    QUERY_FIELDS = ('query', 'sql', 'statement')
+    FINGERPRINT_CACHE_SIZE = 100000
+    # Whitespace and comments before a statement's first token
+    _LEADING_COMMENTS = re.compile(r"(?:\s+|--[^\n]*(?:\n|$)|/\*.*?(?:\*/|$))*", re.DOTALL)
+    
+    def __init__(self, db_manager, batch_size=50000):
+        """Initialize with a database manager and the number of statements written per transaction."""
+        self.db_manager = db_manager
+        self.batch_size = max(1, int(batch_size))
+        self.fingerprinter = QueryFingerprinter()
+        self.log_writer = QueryLogWriter(db_manager.db_file, log_store=db_manager.log_store)
+        self._fingerprints = {}
+        
+    def ingest(self, path, file_format=None):
+        """Ingest a workload file and return the ingestion statistics.
+
+        The format is taken from the file extension unless file_format
+        ('jsonl', 'json', 'csv' or 'sql') is given.
+        """
+        file_format = file_format or self.FORMATS.get(os.path.splitext(path)[1].lower())
+        readers = {'jsonl': self._read_jsonl, 'json': self._read_json, 'csv': self._read_csv, 'sql': self._read_sql}
+        if file_format not in readers:
+            raise ValueError(f"Unsupported workload file format: {path}")
+            
+        start_ns = time.perf_counter_ns()
+        stats = {'statements': 0, 'skipped': 0, 'batches': 0}
+        default_timestamp = utc_timestamp()
+        batch = []
+        with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+            for entry in readers[file_format](f):
+                record = self._to_record(entry, default_timestamp)
+                if record is None:
+                    stats['skipped'] += 1
+                    continue
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._write(batch)
+                    stats['statements'] += len(batch)
+                    stats['batches'] += 1
+                    batch = []
+        if batch:
+            self._write(batch)
+            stats['statements'] += len(batch)
+            stats['batches'] += 1
+            
+        stats['seconds'] = round((time.perf_counter_ns() - start_ns) / 1e9, 3)
+        stats['statements_per_second'] = round(stats['statements'] / stats['seconds'], 1) if stats['seconds'] else None
+        logger.info(
+            f"Ingested {stats['statements']} statements from {path} in {stats['seconds']}s "
+            f"({stats['statements_per_second']} statements/s, {stats['skipped']} skipped)"
+        )
+        return stats
+        
+    def _write(self, batch):
+        """Write one batch of records and its statistics, raising if it fails."""
+        conn = self.db_manager.conn
+        try:
+            self.log_writer.write_batch(conn, batch)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            self.log_writer.plan_store.clear_cache()
+            raise
+            
+    def _fingerprint(self, query):
+        """Fingerprint a query, reusing the result for statements that repeat verbatim."""
+        result = self._fingerprints.get(query)
+        if result is None:
+            if len(self._fingerprints) >= self.FINGERPRINT_CACHE_SIZE:
+                self._fingerprints.clear()
+            result = self._fingerprints[query] = self.fingerprinter.fingerprint(query)
+        return result
+        
+    def _to_record(self, entry, default_timestamp):
+        """Turn a parsed trace entry into a log record, or None if it holds no statement."""
+        query = None
+        for field in self.QUERY_FIELDS:
+            if entry.get(field):
+                query = str(entry[field]).strip()
+                break
+        if not query or query.upper().startswith(('EXPLAIN', 'PRAGMA')):
+            return None
+            
+        fingerprint, normalized_query = self._fingerprint(query)
+        return {
+            'query': query,
+            'normalized_query': normalized_query,
+            'fingerprint': fingerprint,
+            'execution_time': self._parse_duration(entry),
+            'timestamp': self._parse_timestamp(entry.get('timestamp'), default_timestamp),
+            'rows_returned': self._parse_number(entry.get('rows_returned'), int)
+        }
+        
+    @staticmethod
+    def _parse_number(value, cast=float):
+        """Return a number from a trace field, or None if it is missing or malformed."""
+        if value is None or value == '':
+            return None
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            return None
+            
+    def _parse_duration(self, entry):
+        """Return the execution time in seconds from execution_time, duration or duration_ms."""
+        for field, scale in (('execution_time', 1.0), ('duration', 1.0), ('duration_ms', 0.001)):
+            value = self._parse_number(entry.get(field))
+            if value is not None:
+                return value * scale
+        # Statement logs without timings still count towards query frequency
+        return 0.0
+        
+    @staticmethod
+    def _parse_timestamp(value, default):
+        """Normalize epoch seconds or ISO 8601 timestamps to 'YYYY-MM-DD HH:MM:SS' UTC."""
+        if value is None or value == '':
+            return default
+        if isinstance(value, (int, float)) or re.match(r'^\d+(\.\d+)?$', str(value)):
+            return datetime.utcfromtimestamp(float(value)).strftime('%Y-%m-%d %H:%M:%S')
+        value = str(value).strip()
+        if re.match(r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}$', value[:19]):
+            return value[:10] + ' ' + value[11:19]
+        if re.match(r'^\d{4}-\d{2}-\d{2}$', value):
+            return value + ' 00:00:00'
+        return default
+        
+    def _read_jsonl(self, f):
+        """Yield one entry per JSON object line."""
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping malformed JSON on line {line_number}")
+                yield {}
+                continue
+            yield entry if isinstance(entry, dict) else {'query': entry}
+            
+    def _read_json(self, f):
+        """Yield the entries of a JSON array, or of JSON lines if the file does not hold an array.
+
+        An array is loaded whole, so large traces are better kept as JSON lines.
+        """
+        head = f.read(1)
+        while head.isspace():
+            head = f.read(1)
+        if head != '[':
+            yield from self._read_jsonl(itertools.chain([head + f.readline()], f))
+            return
+        try:
+            entries = json.loads(head + f.read())
+        except ValueError as e:
+            logger.warning(f"Skipping malformed JSON array: {e}")
+            yield {}
+            return
+        for entry in entries:
+            yield entry if isinstance(entry, dict) else {'query': entry}
+            
+    def _read_csv(self, f):
+        """Yield one entry per CSV row, using the header row for field names."""
+        for row in csv.DictReader(f):
+            yield {key.strip().lower(): value for key, value in row.items() if key}
+            
+    def _read_sql(self, f):
+        """Yield one entry per ';'-terminated statement of a plain SQL file.
+
+        Statement ends are found with sqlite3.complete_statement, so a ';'
+        or quote inside a string literal, quoted identifier, comment or
+        trigger body does not end a statement. Comments before a statement
+        are dropped.
+        """
+        buffer = ''
+        for line in f:
+            buffer += line
+            start = 0
+            position = buffer.find(';', len(buffer) - len(line))
+            while position != -1:
+                if sqlite3.complete_statement(buffer[start:position + 1]):
+                    statement = self._statement_text(buffer[start:position + 1])
+                    if statement:
+                        yield {'query': statement}
+                    start = position + 1
+                position = buffer.find(';', position + 1)
+            buffer = buffer[start:]
+        statement = self._statement_text(buffer)
+        if statement:
+            yield {'query': statement}
+            
+    def _statement_text(self, text):
+        """Return a statement without the comments before it and its trailing ';'."""
+        return text[self._LEADING_COMMENTS.match(text).end():].strip().rstrip(';').strip()
+
+
+class IndexRecommender:
+    """Recommends indexes based on query patterns.
+
+    Analysis is incremental: candidate indexes are aggregated in
+    index_candidates and a watermark per log partition records the last log
+    row folded in, so each refresh only reads the rows logged since. The
+    refresh also maps each query shape to the candidates it could use, with
+    the share of the shape's time each candidate would save according to a
+    rows-examined cost model over the estimated predicate selectivities.
+    Recommendations are a set chosen for the time it saves across the
+    workload, net of index maintenance and within the disk budgets.
+    """
+    
+    PARSE_CACHE_SIZE = 5000
+    REFRESH_BATCH_SIZE = 5000
+    # Predicate kinds an index can serve
+    INDEXABLE_KINDS = {'equality', 'range', 'in', 'like_prefix', 'is_null', 'join'}
+    # Predicate kinds after which the next index column can still narrow the search
+    POINT_KINDS = {'equality', 'in', 'is_null', 'join'}
+    # A row fetched through an index costs about this many rows read by a full scan,
+    # or about one when the index covers the query and the table is not visited
+    LOOKUP_COST = 3.0
+    COVERING_LOOKUP_COST = 1.0
+    # Covering variants are proposed only for narrow projections
+    MAX_COVERING_COLUMNS = 6
+    MAX_INCLUDED_COLUMNS = 3
+    # Share of the achievable benefit after which no more indexes are picked
+    BENEFIT_TARGET = 0.95
+    # Net benefits within this share of the best count as a tie, won by the smaller index
+    TIE_TOLERANCE = 0.01
+    # Bytes per index entry besides the key columns (rowid and cell header), and average page fill
+    INDEX_ENTRY_OVERHEAD = 12
+    PAGE_FILL = 0.75
+    CANDIDATE_UPSERT = """
+        INSERT INTO index_candidates
+            (candidate_key, table_name, columns, descending, is_composite, is_covering, query_count, total_time, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(candidate_key) DO UPDATE SET
+            query_count = query_count + excluded.query_count,
+            total_time = total_time + excluded.total_time,
+            last_seen = MAX(last_seen, excluded.last_seen)
+    """
+    
+    def __init__(self, db_manager, config_manager=None):
+        """Initialize with a database manager and optional configuration."""
+        self.db_manager = db_manager
+        # Executions lose half their weight in the score every half-life
+        self.recency_half_life_days = 7.0
+        # Disk budgets for the recommended indexes, in total and per table
+        self.index_budget_mb = 1024.0
+        self.table_index_budget_mb = 256.0
+        if config_manager is not None:
+            self.recency_half_life_days = float(
+                config_manager.get('ANALYSIS', 'recency_half_life_days', self.recency_half_life_days)
+            )
+            self.index_budget_mb = float(config_manager.get('ANALYSIS', 'index_budget_mb', self.index_budget_mb))
+            self.table_index_budget_mb = float(
+                config_manager.get('ANALYSIS', 'table_index_budget_mb', self.table_index_budget_mb)
+            )
+        self.plan_store = ExecutionPlanStore()
+        self.parser = SQLParser()
+        self.fingerprinter = QueryFingerprinter()
+        self.estimator = SelectivityEstimator(db_manager)
+        # Parsed query shapes per fingerprint, so each shape is parsed once
+        self._parse_cache = OrderedDict()
+        self._refresh_lock = threading.Lock()
+        
+    def analyze(self, limit=10, start=None, end=None):
+        """Fold in newly logged queries and return the recommended set of indexes.
+
+        Without a time window the all-time workload is scored; otherwise only
+        the executions between start and end (UTC timestamp strings) count.
+        """
+        try:
+            self.refresh()
+            
+            # Pick the set of accumulated candidates that captures most of the benefit
+            return self._select_indexes(self._load_candidates(), start=start, end=end, limit=limit)
+        except Exception as e:
+            logger.error(f"Error analyzing for index recommendations: {e}")
+            return []
+            
+    def refresh(self):
+        """Fold the log rows past each partition's watermark into the candidates and return their count."""
+        log_store = self.db_manager.log_store
+        conn = self.db_manager.conn
+        with self._refresh_lock:
+            watermarks = {
+                row['partition_key']: row['last_log_id']
+                for row in self.db_manager.execute_and_fetch("SELECT partition_key, last_log_id FROM analysis_watermarks")
+            }
+            partitions = log_store.partitions()
+            processed = 0
+            for key in partitions:
+                partition = log_store.connection(key)
+                last_id = watermarks.get(key, 0)
+                while True:
+                    logs = partition.execute(
+                        "SELECT id, query, execution_time, execution_plan, plan_id, fingerprint, timestamp "
+                        "FROM query_logs WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, self.REFRESH_BATCH_SIZE)
+                    ).fetchall()
+                    if not logs:
+                        break
+                    last_id = logs[-1]['id']
+                    try:
+                        potential_indexes = self._collect_candidates(logs)
+                        self._fold_candidates(potential_indexes)
+                        self._map_fingerprints(potential_indexes)
+                        conn.execute(
+                            "INSERT OR REPLACE INTO analysis_watermarks (partition_key, last_log_id) VALUES (?, ?)",
+                            (key, last_id)
+                        )
+                        conn.commit()
+                    except sqlite3.Error:
+                        conn.rollback()
+                        raise
+                    processed += len(logs)
+                    
+            # Partitions dropped by retention no longer need a watermark
+            stale = [(key,) for key in watermarks if key not in set(partitions)]
+            if stale:
+                conn.executemany("DELETE FROM analysis_watermarks WHERE partition_key = ?", stale)
+                conn.commit()
+            if processed:
+                logger.info(f"Folded {processed} logged queries into the index candidates")
+            return processed
+            
+    def reset(self):
+        """Forget the accumulated candidates so the next refresh re-reads every retained log."""
+        with self._refresh_lock:
+            self.db_manager.execute("DELETE FROM index_candidates")
+            self.db_manager.execute("DELETE FROM fingerprint_candidates")
+            self.db_manager.execute("DELETE FROM analysis_watermarks")
+            self.db_manager.commit()
+            
+    def _collect_candidates(self, query_logs):
+        """Return the candidate index occurrences found in a batch of log rows."""
+        plan_nodes = self.plan_store.get_nodes(self.db_manager.conn, [log['plan_id'] for log in query_logs])
+            
+        # Analyze each query and collect potential indexes
+        potential_indexes = []
+        savings = {}
+        for log in query_logs:
+            query = log['query']
+            
+            # Find tables and the columns an index could serve
+            parsed = self._parse_query(query, log['fingerprint'])
+            
+            # Skip non-SELECT queries for simplicity
+            if parsed is None or parsed['statement'] != 'select' or not parsed['tables']:
+                continue
+            columns = self._indexable_columns(parsed)
+            covering = self._covering_columns(parsed, columns)
+                
+            # Tables the plan reads with a full scan, i.e. without any index
+            if log['plan_id'] is not None:
+                nodes = plan_nodes.get(log['plan_id'], [])
+            else:
+                nodes = self.plan_store.parse_plan(log['execution_plan'], query)
+            scanned_tables = {
+                node['table_name'].lower() for node in nodes
+                if node['operation'] == 'SCAN' and not node['index_name'] and node['table_name']
+            }
+            
+            for table_name, table_cols in columns.items():
+                # Look for full table scans
+                if table_name.lower() in scanned_tables:
+                    indexed_columns = self._get_leading_columns(table_name)
+                    for column_name in table_cols:
+                        if column_name not in indexed_columns:
+                            saved_fraction, satisfies = self._cached_usage(
+                                savings, parsed, log['fingerprint'], table_name, [column_name]
+                            )
+                            potential_indexes.append({
+                                'table': table_name,
+                                'column': column_name,
+                                'query_id': log['id'],
+                                'fingerprint': log['fingerprint'],
+                                'execution_time': log['execution_time'],
+                                'timestamp': log['timestamp'],
+                                'saved_fraction': saved_fraction,
+                                'satisfies': satisfies
+                            })
+                            
+                # Look for opportunities for composite indexes, with the key columns in a usable order
+                key_cols, descending = self._order_columns(parsed, table_name, table_cols)
+                if len(key_cols) > 1:
+                    saved_fraction, satisfies = self._cached_usage(
+                        savings, parsed, log['fingerprint'], table_name, key_cols, descending
+                    )
+                    potential_indexes.append({
+                        'table': table_name,
+                        'column': "_".join(key_cols),
+                        'is_composite': True,
+                        'composite_columns': key_cols,
+                        'descending': descending,
+                        'query_id': log['id'],
+                        'fingerprint': log['fingerprint'],
+                        'execution_time': log['execution_time'],
+                        'timestamp': log['timestamp'],
+                        'saved_fraction': saved_fraction,
+                        'satisfies': satisfies
+                    })
+                    
+                # Look for covering variants that let the query skip the table
+                included = [column for column in covering.get(table_name, []) if column not in key_cols]
+                if key_cols and included:
+                    covering_cols = key_cols + included
+                    covering_descending = descending + [False] * len(included)
+                    saved_fraction, satisfies = self._cached_usage(
+                        savings, parsed, log['fingerprint'], table_name, covering_cols, covering_descending,
+                        covering=True, scanned=table_name.lower() in scanned_tables
+                    )
+                    potential_indexes.append({
+                        'table': table_name,
+                        'column': "_".join(covering_cols),
+                        'is_composite': True,
+                        'is_covering': True,
+                        'composite_columns': covering_cols,
+                        'descending': covering_descending,
+                        'query_id': log['id'],
+                        'fingerprint': log['fingerprint'],
+                        'execution_time': log['execution_time'],
+                        'timestamp': log['timestamp'],
+                        'saved_fraction': saved_fraction,
+                        'satisfies': satisfies
+                    })
+        return potential_indexes
+        
+    def _table_predicates(self, parsed, table_name):
+        """Return the indexable, non-disjunctive predicates of a parsed query on a table, by lower-case column."""
+        predicates = {}
+        for predicate in parsed['predicates']:
+            if predicate['kind'] not in self.INDEXABLE_KINDS or predicate['disjunctive']:
+                continue
+            resolved = self._resolve_table(predicate)
+            if resolved is not None and resolved.lower() == table_name.lower():
+                predicates.setdefault(predicate['column'].lower(), []).append(predicate)
+        return predicates
+        
+    def _sort_columns(self, parsed, table_name, clause):
+        """Return the (column, descending) pairs of an ORDER BY or GROUP BY, or None if they span other tables."""
+        entries = parsed[clause]
+        columns = []
+        for entry in entries:
+            resolved = self._resolve_table(entry)
+            if resolved is None or resolved.lower() != table_name.lower():
+                return None
+            columns.append((entry['column'], entry.get('direction') == 'DESC'))
+        return columns
+        
+    def _order_columns(self, parsed, table_name, table_cols):
+        """Order a table's columns for a composite index and return (columns, descending flags).
+
+        Columns with equality-like predicates come first, most selective
+        first, then the most selective range column, then the ORDER BY and
+        GROUP BY columns in their direction. Other range columns are left
+        out since the search cannot use them, and so is the rowid alias,
+        which the table itself is keyed by and every index entry stores.
+        No columns are returned when the rowid alias was the only point
+        column, since the rowid lookup already finds the rows.
+        """
+        predicates = self._table_predicates(parsed, table_name)
+        table = self.db_manager.catalog.table(table_name)
+        rowid_alias = (table['rowid_alias'] or '').lower() if table else ''
+        rowid_point = False
+        points = []
+        ranges = []
+        for column_name in table_cols:
+            column_predicates = predicates.get(column_name.lower())
+            if not column_predicates:
+                continue
+            point = [p for p in column_predicates if p['kind'] in self.POINT_KINDS]
+            if column_name.lower() == rowid_alias:
+                rowid_point = rowid_point or bool(point)
+                continue
+            selectivity = min(self.estimator.selectivity(table_name, p) for p in (point or column_predicates))
+            (points if point else ranges).append((selectivity, column_name))
+            
+        if rowid_point and not points:
+            return [], []
+        columns = [column_name for _, column_name in sorted(points, key=lambda item: item[0])]
+        if ranges:
+            columns.append(min(ranges, key=lambda item: item[0])[1])
+        descending = [False] * len(columns)
+        sort_columns = [
+            (column_name, desc)
+            for clause in ('order_by', 'group_by')
+            for column_name, desc in (self._sort_columns(parsed, table_name, clause) or [])
+        ]
+        sort_start = len(columns)
+        for column_name, desc in sort_columns:
+            if column_name.lower() != rowid_alias and column_name.lower() not in (column.lower() for column in columns):
+                columns.append(column_name)
+                descending.append(desc)
+        # An index scanned backwards serves a uniformly descending order just as well
+        if descending[sort_start:] and all(descending[sort_start:]):
+            descending = [False] * len(columns)
+        return columns, descending
+        
+    def _covering_columns(self, parsed, columns):
+        """Return, per table, the extra columns an index on its indexable columns needs to cover the query.
+
+        A table qualifies only if every column the query references on it is
+        known, none of them is selected with *, and the index stays narrow.
+        The rowid alias is stored in every index entry, so it is never added.
+        """
+        referenced = OrderedDict()
+        uncertain = {table.lower() for table in parsed['select_star']}
+        for entry in parsed['predicates'] + parsed['projections'] + parsed['order_by'] + parsed['group_by']:
+            table_name = self._resolve_table(entry)
+            if table_name is None:
+                uncertain.update(candidate.lower() for candidate in entry['candidates'])
+                continue
+            table_refs = referenced.setdefault(table_name.lower(), [])
+            if entry['column'].lower() not in (column.lower() for column in table_refs):
+                table_refs.append(entry['column'])
+                
+        covering = {}
+        for table_name, table_cols in columns.items():
+            if table_name.lower() in uncertain:
+                continue
+            table = self.db_manager.catalog.table(table_name)
+            rowid_alias = (table['rowid_alias'] or '').lower() if table else ''
+            keyed = {column.lower() for column in table_cols}
+            included = [
+                column for column in referenced.get(table_name.lower(), [])
+                if column.lower() not in keyed and column.lower() != rowid_alias
+            ]
+            if 0 < len(included) <= self.MAX_INCLUDED_COLUMNS and len(table_cols) + len(included) <= self.MAX_COVERING_COLUMNS:
+                covering[table_name] = included
+        return covering
+        
+    def _cached_usage(self, savings, parsed, fingerprint, table_name, columns, descending=None, covering=False, scanned=True):
+        """Return (saved fraction, satisfied predicates) of an index for a query shape, computed once per batch."""
+        descending = descending or [False] * len(columns)
+        key = (fingerprint, table_name.lower(), tuple(columns), tuple(descending), covering, scanned)
+        if key not in savings:
+            savings[key] = (
+                self._saved_fraction(parsed, table_name, columns, covering, scanned),
+                self._satisfied_predicates(parsed, table_name, columns, descending)
+            )
+        return savings[key]
+        
+    def _seek_prefix(self, parsed, table_name, columns):
+        """Walk an index key against a query's predicates.
+
+        Returns the combined selectivity of the predicates the search can
+        use, those predicates, and the number of leading key columns fixed
+        by equality-like predicates.
+        """
+        predicates = self._table_predicates(parsed, table_name)
+        selectivity = 1.0
+        used = []
+        fixed = 0
+        for column_name in columns:
+            column_predicates = predicates.get(column_name.lower())
+            if not column_predicates:
+                break
+            point = [p for p in column_predicates if p['kind'] in self.POINT_KINDS]
+            selectivity *= min(self.estimator.selectivity(table_name, p) for p in (point or column_predicates))
+            used.extend(point or column_predicates)
+            if not point:
+                # A range ends the part of the key the search can use
+                break
+            fixed += 1
+        return selectivity, used, fixed
+        
+    @staticmethod
+    def _describe_predicate(predicate):
+        """Return a short SQL-like description of a parsed predicate."""
+        column_name = predicate['column']
+        if predicate['kind'] == 'join':
+            other_table, other_column = predicate['other']
+            return f"{column_name} = {other_table + '.' if other_table else ''}{other_column}"
+        if predicate['kind'] == 'in':
+            return f"{column_name} IN (...)"
+        if predicate['kind'] == 'is_null':
+            return f"{column_name} IS NULL"
+        if predicate['kind'] == 'like_prefix':
+            return f"{column_name} LIKE {predicate['value'] or '?'}"
+        return f"{column_name} {predicate['operator']} ?"
+        
+    def _satisfied_predicates(self, parsed, table_name, columns, descending):
+        """Return descriptions of the predicates, ORDER BY and GROUP BY an index key would serve."""
+        _, used, fixed = self._seek_prefix(parsed, table_name, columns)
+        satisfies = [self._describe_predicate(predicate) for predicate in used]
+        if not used:
+            return satisfies
+        fixed_columns = {column.lower() for column in columns[:fixed]}
+        following = [column.lower() for column in columns[fixed:]]
+        
+        # The rows come out in key order after the equality-fixed prefix
+        order = [
+            (column_name, desc) for column_name, desc in (self._sort_columns(parsed, table_name, 'order_by') or [])
+            if column_name.lower() not in fixed_columns
+        ]
+        if parsed['order_by'] and self._sort_columns(parsed, table_name, 'order_by') is not None:
+            key_directions = descending[fixed:fixed + len(order)]
+            same = [desc == key_desc for (_, desc), key_desc in zip(order, key_directions)]
+            if [column_name.lower() for column_name, _ in order] == following[:len(order)] and (all(same) or not any(same)):
+                satisfies.append("ORDER BY " + ", ".join(
+                    f"{column_name} DESC" if desc else column_name for column_name, desc in order
+                ) if order else "ORDER BY (fixed by equality)")
+        group = [
+            column_name.lower() for column_name, _ in (self._sort_columns(parsed, table_name, 'group_by') or [])
+            if column_name.lower() not in fixed_columns
+        ]
+        if parsed['group_by'] and self._sort_columns(parsed, table_name, 'group_by') is not None:
+            if set(group) == set(following[:len(group)]):
+                satisfies.append("GROUP BY " + ", ".join(entry['column'] for entry in parsed['group_by']))
+        return satisfies
+        
+    def _saved_fraction(self, parsed, table_name, columns, covering=False, scanned=True):
+        """Estimate the share of a query's time on a table that an index on columns would save.
+
+        The index narrows the search with each leading column that has an
+        equality, IN, IS NULL or join predicate, plus one range or LIKE
+        prefix column after them. The rows it then examines cost a table
+        lookup each, or a plain index read if the index covers the query,
+        against one sequential read per row for the full scan. On a table
+        the plan already searches through an index, a covering index is
+        compared with the same key without the covered columns.
+        """
+        rows = self.db_manager.catalog.row_estimate(table_name) or 0
+        if rows <= 1:
+            return 0.0
+        selectivity, used, _ = self._seek_prefix(parsed, table_name, columns)
+        if not used:
+            return 0.0
+            
+        examined = rows * selectivity
+        cost = math.log2(rows) + examined * (self.COVERING_LOOKUP_COST if covering else self.LOOKUP_COST)
+        baseline = rows if scanned else math.log2(rows) + examined * self.LOOKUP_COST
+        return max(0.0, 1.0 - cost / baseline)
+        
+    @staticmethod
+    def _candidate_key(idx):
+        """Return the key that identifies a candidate index."""
+        # Key columns are ordered, so their order and direction are part of the identity
+        columns = [
+            f"{column} desc" if desc else column
+            for column, desc in zip(idx.get('composite_columns') or [], idx.get('descending') or itertools.repeat(False))
+        ]
+        if idx.get('is_covering', False):
+            return f"{idx['table']}_covering_{'_'.join(columns)}"
+        if idx.get('is_composite', False):
+            return f"{idx['table']}_composite_{'_'.join(columns)}"
+        return f"{idx['table']}_{idx['column']}"
+        
+    def _fold_candidates(self, potential_indexes):
+        """Add candidate occurrences to the persisted per-candidate counts and times."""
+        # Aggregate the batch per candidate so each one is upserted only once
+        batch = {}
+        for idx in potential_indexes:
+            key = self._candidate_key(idx)
+            entry = batch.get(key)
+            if entry is None:
+                columns = idx['composite_columns'] if idx.get('is_composite', False) else [idx['column']]
+                batch[key] = [
+                    key, idx['table'], json.dumps(columns), json.dumps(idx.get('descending') or [False] * len(columns)),
+                    1 if idx.get('is_composite', False) else 0, 1 if idx.get('is_covering', False) else 0,
+                    1, idx['execution_time'], idx['timestamp'], idx['timestamp']
+                ]
+            else:
+                entry[6] += 1
+                entry[7] += idx['execution_time']
+                entry[8] = min(entry[8], idx['timestamp'])
+                entry[9] = max(entry[9], idx['timestamp'])
+        self.db_manager.conn.executemany(self.CANDIDATE_UPSERT, list(batch.values()))
+        
+    def _map_fingerprints(self, potential_indexes):
+        """Record which query shapes each candidate index would serve, and how."""
+        pairs = {
+            (idx['fingerprint'], self._candidate_key(idx)): (idx['saved_fraction'], json.dumps(idx['satisfies']))
+            for idx in potential_indexes if idx['fingerprint']
+        }
+        self.db_manager.conn.executemany(
+            "INSERT OR IGNORE INTO fingerprint_candidates (fingerprint, candidate_key, saved_fraction, satisfies) "
+            "VALUES (?, ?, ?, ?)",
+            [(fingerprint, key, fraction, satisfies) for (fingerprint, key), (fraction, satisfies) in pairs.items()]
+        )
+        
+    def _workload(self, start=None, end=None, writes=False):
+        """Return a cursor of (fingerprint, executions, total time, last seen, sample query) per query shape.
+
+        By default the shapes mapped to candidates are returned, with writes
+        the INSERT, UPDATE, DELETE and REPLACE shapes. The all-time statistics
+        come from query_fingerprints; a time window sums the hourly latency
+        sketches instead.
+        """
+        if writes:
+            shape_filter = (
+                "(ltrim(qf.normalized_query) LIKE 'insert%' OR ltrim(qf.normalized_query) LIKE 'update%' "
+                "OR ltrim(qf.normalized_query) LIKE 'delete%' OR ltrim(qf.normalized_query) LIKE 'replace%')"
+            )
+        else:
+            shape_filter = "qf.fingerprint IN (SELECT fingerprint FROM fingerprint_candidates)"
+        if start is None and end is None:
+            return self.db_manager.conn.execute(f"""
+                SELECT qf.fingerprint, qf.query_count, qf.total_time, qf.last_seen, qf.sample_query
+                FROM query_fingerprints qf
+                WHERE qf.query_count > 0
+                AND {shape_filter}
+            """)
+        conditions = [shape_filter]
+        params = []
+        if start is not None:
+            conditions.append("ls.bucket_start >= ?")
+            params.append(start[:13] + ':00:00')
+        if end is not None:
+            conditions.append("ls.bucket_start < ?")
+            params.append(end)
+        return self.db_manager.conn.execute(f"""
+            SELECT ls.fingerprint, SUM(json_extract(ls.sketch, '$.n')), SUM(json_extract(ls.sketch, '$.s')),
+                   MAX(ls.bucket_start), qf.sample_query
+            FROM latency_sketches ls
+            JOIN query_fingerprints qf ON qf.fingerprint = ls.fingerprint
+            WHERE {' AND '.join(conditions)}
+            GROUP BY ls.fingerprint
+        """, params)
+        
+    def _decay(self, last_seen):
+        """Return the recency weight of each last-seen timestamp."""
+        now = np.datetime64(datetime.utcnow(), 's')
+        ages = (now - np.asarray(last_seen, dtype='datetime64[s]')) / np.timedelta64(1, 'D')
+        return np.exp2(-np.maximum(ages, 0.0) / self.recency_half_life_days)
+        
+    def _load_candidates(self):
+        """Return the accumulated candidates that are not already covered by an index."""
+        candidates = []
+        for row in self.db_manager.execute_and_fetch("SELECT * FROM index_candidates WHERE query_count > 0"):
+            columns = json.loads(row['columns'])
+            # The index may have been created since the candidate was recorded
+            if not row['is_composite']:
+                if columns[0] in self._get_leading_columns(row['table_name']):
+                    continue
+            elif self._has_index_on(row['table_name'], columns):
+                continue
+            candidates.append({
+                'table': row['table_name'],
+                'column': "_".join(columns) if row['is_composite'] else columns[0],
+                'is_composite': bool(row['is_composite']),
+                'is_covering': bool(row['is_covering']),
+                'composite_columns': columns if row['is_composite'] else [],
+                'descending': json.loads(row['descending']) if row['is_composite'] else []
+            })
+        return candidates
+            
+    def _parse_query(self, query, fingerprint=None):
+        """Parse a query into its tables and column usage, once per query shape.
+
+        Returns the SQLParser.analyze summary, or None if the statement
+        cannot be parsed. Results are cached per fingerprint in a bounded
+        LRU cache.
+        """
+        if fingerprint is None:
+            fingerprint = self.fingerprinter.fingerprint(query)[0]
+        if fingerprint in self._parse_cache:
+            self._parse_cache.move_to_end(fingerprint)
+            return self._parse_cache[fingerprint]
+            
+        try:
+            parsed = self.parser.analyze(query)
+        except SQLParseError as e:
+            logger.debug(f"Could not parse query {fingerprint}: {e}")
+            parsed = None
+        self._parse_cache[fingerprint] = parsed
+        if len(self._parse_cache) > self.PARSE_CACHE_SIZE:
+            self._parse_cache.popitem(last=False)
+        return parsed
+        
+    def _resolve_table(self, entry):
+        """Return the table of a parsed column, using the schema when the column is unqualified."""
+        if entry['table'] is not None:
+            return entry['table']
+        for table_name in entry['candidates']:
+            if self.db_manager.catalog.has_column(table_name, entry['column']):
+                return table_name
+        return None
+        
+    def _indexable_columns(self, parsed):
+        """Group the indexable predicate, ORDER BY and GROUP BY columns of a parsed query by table."""
+        entries = [p for p in parsed['predicates'] if p['kind'] in self.INDEXABLE_KINDS]
+        entries += parsed['order_by'] + parsed['group_by']
+        columns = OrderedDict()
+        for entry in entries:
+            table_name = self._resolve_table(entry)
+            if table_name is None:
+                continue
+            table_cols = columns.setdefault(table_name, [])
+            if entry['column'] not in table_cols:
+                table_cols.append(entry['column'])
+        return columns
+            
+    def _has_index_on(self, table_name, columns):
+        """Return True if an existing index on a table starts with exactly these columns."""
+        wanted = [column.lower() for column in columns]
+        return any(
+            [(column or '').lower() for column in index['columns'][:len(wanted)]] == wanted
+            for index in self.db_manager.catalog.indexes(table_name)
+        )
+        
+    def _get_leading_columns(self, table_name):
+        """Get the columns an existing index can already search a table by, from the schema catalog."""
+        # If table_name is a tuple (table, alias), use the actual table name
+        if isinstance(table_name, tuple):
+            table_name = table_name[0]
+        # A column further along a composite key does not make single-column lookups cheap
+        return self.db_manager.catalog.leading_columns(table_name)
+            
+    def _workload_matrix(self, candidates, start=None, end=None):
+        """Return the sparse query shape x candidate matrix and its workload vectors, or None.
+
+        Entries are the estimated share of a shape's time each candidate
+        saves; each shape carries its executions, total time and a recency
+        weight that halves every recency_half_life_days.
+        """
+        positions = {self._candidate_key(idx): i for i, idx in enumerate(candidates)}
+        
+        # Workload vectors, one entry per query shape
+        shapes = {}
+        counts = []
+        times = []
+        last_seen = []
+        for fingerprint, count, total_time, seen, _ in self._workload(start, end):
+            shapes[fingerprint] = len(counts)
+            counts.append(count or 0)
+            times.append(total_time or 0.0)
+            last_seen.append(seen or utc_timestamp())
+        if not shapes:
+            return None
+            
+        # Non-zero entries of the matrix as (shape, candidate, saved fraction)
+        rows = []
+        cols = []
+        fractions = []
+        for fingerprint, key, fraction in self.db_manager.conn.execute(
+            "SELECT fingerprint, candidate_key, saved_fraction FROM fingerprint_candidates"
+        ):
+            shape = shapes.get(fingerprint)
+            column = positions.get(key)
+            if shape is not None and column is not None:
+                rows.append(shape)
+                cols.append(column)
+                fractions.append(fraction)
+        if not rows:
+            return None
+        return {
+            'rows': np.asarray(rows, dtype=np.intp),
+            'cols': np.asarray(cols, dtype=np.intp),
+            'fractions': np.asarray(fractions, dtype=np.float64),
+            'counts': np.asarray(counts, dtype=np.float64),
+            'times': np.asarray(times, dtype=np.float64),
+            'decay': self._decay(last_seen)
+        }
+        
+    @staticmethod
+    def _candidate_metrics(matrix, n):
+        """Return the per-candidate column sums of the workload matrix."""
+        rows, cols, fractions = matrix['rows'], matrix['cols'], matrix['fractions']
+        decayed = matrix['times'] * matrix['decay']
+        total_count = np.bincount(cols, weights=matrix['counts'][rows], minlength=n)
+        total_time = np.bincount(cols, weights=matrix['times'][rows], minlength=n)
+        decayed_time = np.bincount(cols, weights=decayed[rows], minlength=n)
+        decayed_saved = np.bincount(cols, weights=decayed[rows] * fractions, minlength=n)
+        return {
+            'count': total_count,
+            'avg_time': np.divide(total_time, total_count, out=np.zeros(n), where=total_count > 0),
+            'time_saved': np.bincount(cols, weights=matrix['times'][rows] * fractions, minlength=n),
+            'decayed_saved': decayed_saved,
+            'impact': np.divide(decayed_saved, decayed_time, out=np.zeros(n), where=decayed_time > 0),
+            'workload_time': float(decayed.sum())
+        }
+        
+    def _select_indexes(self, candidates, start=None, end=None, limit=None):
+        """Choose a small set of indexes that captures most of the workload's estimated benefit.
+
+        Indexes are picked greedily by read benefit net of write maintenance
+        cost. An index is credited with every query served by a candidate
+        whose key is a prefix of its own, and a query on a table only counts
+        the best selected index for it, so (a) is not picked next to (a, b).
+        Picking stops when the set captures BENEFIT_TARGET of the achievable
+        benefit, nothing left has a positive net benefit, or no remaining
+        index fits the per-table and total size budgets. A wider index, such
+        as a covering variant, is only picked over a narrower one when it
+        saves clearly more.
+        """
+        if not candidates:
+            return []
+        matrix = self._workload_matrix(candidates, start, end)
+        if matrix is None:
+            return []
+        n = len(candidates)
+        metrics = self._candidate_metrics(matrix, n)
+        tables = [idx['table'].lower() for idx in candidates]
+        keys = [[column.lower() for column in (idx['composite_columns'] or [idx['column']])] for idx in candidates]
+        
+        # Candidates whose key extends each candidate's key, itself included
+        by_table = {}
+        for i, table in enumerate(tables):
+            by_table.setdefault(table, []).append(i)
+        extended_by = {
+            i: [j for j in by_table[tables[i]] if keys[j][:len(keys[i])] == keys[i]]
+            for i in range(n)
+        }
+                    
+        # Re-key the matrix by (shape, table) so each query counts one index per table
+        entries = {}
+        shape_table_rows = {}
+        for shape, column, fraction in zip(matrix['rows'].tolist(), matrix['cols'].tolist(), matrix['fractions'].tolist()):
+            row = shape_table_rows.setdefault((shape, tables[column]), len(shape_table_rows))
+            for target in extended_by[column]:
+                if fraction > entries.get((row, target), 0.0):
+                    entries[(row, target)] = fraction
+        if not entries:
+            return []
+        rows = np.fromiter((row for row, _ in entries), dtype=np.intp, count=len(entries))
+        cols = np.fromiter((column for _, column in entries), dtype=np.intp, count=len(entries))
+        fractions = np.fromiter(entries.values(), dtype=np.float64, count=len(entries))
+        row_shapes = np.empty(len(shape_table_rows), dtype=np.intp)
+        for (shape, _), row in shape_table_rows.items():
+            row_shapes[row] = shape
+        weights = (matrix['times'] * matrix['decay'])[row_shapes][rows]
+        raw_weights = matrix['times'][row_shapes][rows]
+        
+        best_fraction = np.zeros(len(shape_table_rows))
+        np.maximum.at(best_fraction, rows, fractions)
+        achievable = float(np.dot((matrix['times'] * matrix['decay'])[row_shapes], best_fraction))
+        
+        sizes = np.array([self._index_size(idx) for idx in candidates], dtype=np.float64)
+        maintenance = self.maintenance_costs(candidates, start, end)
+        total_budget = self.index_budget_mb * 1024 * 1024
+        table_budget = self.table_index_budget_mb * 1024 * 1024
+        used_total = 0.0
+        used_by_table = {}
+        
+        selected = []
+        chosen = np.zeros(n, dtype=bool)
+        served = np.zeros(len(shape_table_rows))
+        captured = 0.0
+        while limit is None or len(selected) < limit:
+            gain = np.bincount(cols, weights=weights * np.maximum(fractions - served[rows], 0.0), minlength=n)
+            net = gain - maintenance
+            table_room = np.array([table_budget - used_by_table.get(table, 0.0) for table in tables])
+            feasible = ~chosen & (sizes <= total_budget - used_total) & (sizes <= table_room)
+            net[~feasible] = -np.inf
+            best = net.max()
+            if not best > 0:
+                break
+            # Among near ties, such as an index and its covering variant on a point lookup, take the smallest
+            near = np.flatnonzero(net >= best * (1 - self.TIE_TOLERANCE))
+            pick = int(near[np.argmin(sizes[near])])
+                
+            picked = cols == pick
+            raw_gain = float(np.dot(raw_weights[picked], np.maximum(fractions[picked] - served[rows[picked]], 0.0)))
+            np.maximum.at(served, rows[picked], fractions[picked])
+            chosen[pick] = True
+            used_total += sizes[pick]
+            used_by_table[tables[pick]] = used_by_table.get(tables[pick], 0.0) + sizes[pick]
+            
+            recommendation = self._recommendation(candidates[pick], metrics, pick, gain[pick], raw_gain)
+            recommendation['estimated_size_mb'] = round(float(sizes[pick]) / (1024 * 1024), 2)
+            recommendation['maintenance_cost'] = round(float(maintenance[pick]), 4)
+            selected.append(recommendation)
+            
+            captured += float(gain[pick])
+            if captured >= self.BENEFIT_TARGET * achievable:
+                break
+        return selected
+        
+    def _index_size(self, idx):
+        """Estimate the on-disk size in bytes of a candidate index."""
+        rows = self.db_manager.catalog.row_estimate(idx['table']) or 0
+        columns = idx['composite_columns'] or [idx['column']]
+        width = sum(self.estimator.average_width(idx['table'], column) for column in columns)
+        return rows * (width + self.INDEX_ENTRY_OVERHEAD) / self.PAGE_FILL
+        
+    def maintenance_costs(self, candidates, start=None, end=None):
+        """Return the (decayed) write time each candidate index would add to the workload.
+
+        A write already updates the table and each of its indexes, so a new
+        index is charged an equal share of the time of the writes on its
+        table; updates only count if they assign one of its columns.
+        """
+        costs = np.zeros(len(candidates))
+        shapes = self._workload(start, end, writes=True).fetchall()
+        if not shapes:
+            return costs
+        writes = {}
+        for (fingerprint, _, total_time, _, sample_query), weight in zip(
+            shapes, self._decay([shape[3] or utc_timestamp() for shape in shapes])
+        ):
+            parsed = self._parse_query(sample_query, fingerprint) if sample_query else None
+            if parsed is None or not parsed['target_table']:
+                continue
+            assigned = {column.lower() for column in parsed['assigned_columns']} if parsed['statement'] == 'update' else None
+            writes.setdefault(parsed['target_table'].lower(), []).append(((total_time or 0.0) * weight, assigned))
+            
+        for i, idx in enumerate(candidates):
+            table_writes = writes.get(idx['table'].lower())
+            if not table_writes:
+                continue
+            columns = {column.lower() for column in (idx['composite_columns'] or [idx['column']])}
+            structures = 1 + len(self.db_manager.catalog.indexes(idx['table']))
+            costs[i] = sum(time for time, assigned in table_writes if assigned is None or assigned & columns) / structures
+        return costs
+        
+    def _recommendation(self, data, metrics, i, decayed_saved, time_saved):
+        """Build the recommendation dict of a candidate from its workload metrics."""
+        # Generate appropriate index name and statement based on whether it's composite
+        if data['is_composite']:
+            # For composite indexes, use all columns in key order and direction
+            descending = data.get('descending') or [False] * len(data['composite_columns'])
+            index_name = "idx_{}_{}".format(data['table'], '_'.join(
+                f"{column}_desc" if desc else column for column, desc in zip(data['composite_columns'], descending)
+            ))
+            column_list = ', '.join(
+                f"{column} DESC" if desc else column for column, desc in zip(data['composite_columns'], descending)
+            )
+            create_statement = f"CREATE INDEX {index_name} ON {data['table']} ({column_list})"
+            column_display = column_list
+            index_type = 'COVERING' if data.get('is_covering') else 'COMPOSITE'
+        else:
+            # For regular single-column indexes
+            index_name = f"idx_{data['table']}_{data['column']}"
+            create_statement = f"CREATE INDEX {index_name} ON {data['table']} ({data['column']})"
+            column_display = data['column']
+            index_type = ''
+            
+        # Score: share of the analyzed workload's (decayed) time saved, on a 0-10 scale
+        workload_time = metrics['workload_time']
+        score = float(decayed_saved) / workload_time * 10 if workload_time > 0 else 0.0
+        return {
+            'table': data['table'],
+            'column': column_display,
+            'score': round(score, 2),
+            'count': int(metrics['count'][i]),
+            'avg_execution_time': round(float(metrics['avg_time'][i]), 4),
+            'index_name': index_name,
+            'create_statement': create_statement,
+            'index_type': index_type,
+            'estimated_time_saved': round(float(time_saved), 4),
+            'estimated_impact': round(float(metrics['impact'][i]) * 100, 1),
+            'satisfies': self._candidate_satisfies(self._candidate_key(data))
+        }
+        
+    def _candidate_satisfies(self, candidate_key):
+        """Return the distinct predicates a candidate satisfies across the query shapes it serves."""
+        satisfies = []
+        for row in self.db_manager.conn.execute(
+            "SELECT satisfies FROM fingerprint_candidates WHERE candidate_key = ?", (candidate_key,)
+        ):
+            for description in json.loads(row[0]):
+                if description not in satisfies:
+                    satisfies.append(description)
+        return satisfies
+
+
+class WhatIfAnalyzer:
+    """Evaluates hypothetical indexes without building them on the real database.
+
+    The schema and the sqlite_stat1/sqlite_stat4 statistics are cloned into
+    an in-memory shadow database that holds no rows. Each candidate index is
+    created there inside a transaction, the workload is run through EXPLAIN
+    QUERY PLAN and the transaction is rolled back, so a candidate costs a few
+    planner calls however large its table is. The shadow is rebuilt when the
+    schema version or the statistics change.
+    """
+    
+    WORKLOAD_SIZE = 200
+    PLAN_CACHE_SIZE = 5000
+    # One whole statement: no comments, no string literals and nothing after
+    # an optional trailing semicolon
+    CREATE_INDEX_PATTERN = re.compile(
+        r'(?!.*(?:--|/\*))\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?["`\[]?(\w+)["`\]]?\s+'
+        r'ON\s+["`\[]?(\w+)["`\]]?\s*\(([^;\'()]*(?:\([^;\'()]*\)[^;\'()]*)*)\)'
+        r'(?:\s+WHERE\s+[^;\']+?)?\s*;?\s*',
+        re.IGNORECASE | re.DOTALL
+    )
+    INDEX_USE_PATTERN = re.compile(r'USING (?:COVERING )?INDEX (\S+)')
+    
+    def __init__(self, db_manager):
+        """Initialize with a database manager; the shadow is built on first use."""
+        self.db_manager = db_manager
+        self._shadow = None
+        self._shadow_key = None
+        # Plans of the workload queries without any hypothetical index
+        self._baseline_plans = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def _statistics_key(self):
+        """Return a key that changes whenever the schema or the ANALYZE statistics change."""
+        source = self.db_manager.conn
+        digest = hashlib.sha1()
+        stat_tables = [
+            row[0] for row in source.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('sqlite_stat1', 'sqlite_stat4') ORDER BY name"
+            )
+        ]
+        for name in stat_tables:
+            for row in source.execute(f"SELECT * FROM {name}"):
+                digest.update(repr(row).encode('utf-8'))
+        return (self.db_manager.get_schema_version(), digest.hexdigest())
+        
+    def _build_shadow(self):
+        """Create the in-memory shadow with the schema and statistics of the database."""
+        source = self.db_manager.conn
+        shadow = sqlite3.connect(':memory:', isolation_level=None, check_same_thread=False)
+        
+        # Tables first, then their indexes, then views, each in creation order
+        objects = source.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' AND type IN ('table', 'index', 'view')"
+        ).fetchall()
+        order = {'table': 0, 'index': 1, 'view': 2}
+        for object_type, name, sql in sorted(objects, key=lambda obj: order[obj[0]]):
+            try:
+                shadow.execute(sql)
+            except sqlite3.Error as e:
+                # e.g. the shadow tables a virtual table creates by itself
+                logger.debug(f"Shadow database skipped {object_type} {name}: {e}")
+                
+        # ANALYZE on the empty tables creates the statistics tables this build supports
+        shadow.execute("ANALYZE")
+        source_stats = {
+            row[0] for row in source.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('sqlite_stat1', 'sqlite_stat4')"
+            )
+        }
+        shadow_stats = {
+            row[0] for row in shadow.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ('sqlite_stat1', 'sqlite_stat4')"
+            )
+        }
+        if 'sqlite_stat1' in source_stats:
+            shadow.executemany(
+                "INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+                source.execute("SELECT tbl, idx, stat FROM sqlite_stat1")
+            )
+        if 'sqlite_stat4' in source_stats and 'sqlite_stat4' in shadow_stats:
+            shadow.executemany(
+                "INSERT INTO sqlite_stat4 (tbl, idx, neq, nlt, ndlt, sample) VALUES (?, ?, ?, ?, ?, ?)",
+                source.execute("SELECT tbl, idx, neq, nlt, ndlt, sample FROM sqlite_stat4")
+            )
+            
+        # Tables ANALYZE has never seen still get their size, so the planner weighs them correctly
+        analyzed = {row[0].lower() for row in shadow.execute("SELECT DISTINCT tbl FROM sqlite_stat1") if row[0]}
+        catalog = self.db_manager.catalog
+        shadow.executemany(
+            "INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, NULL, ?)",
+            [
+                (name, str(catalog.row_estimate(name)))
+                for name in catalog.tables()
+                if name.lower() not in analyzed and catalog.row_estimate(name)
+            ]
+        )
+        # Load the copied statistics into the planner
+        shadow.execute("ANALYZE sqlite_schema")
+        return shadow
+        
+    def _current_shadow(self):
+        """Return the shadow connection, rebuilding it if the schema or statistics changed."""
+        key = self._statistics_key()
+        if self._shadow is None or key != self._shadow_key:
+            if self._shadow is not None:
+                self._shadow.close()
+            self._shadow = self._build_shadow()
+            self._shadow_key = key
+            self._baseline_plans.clear()
+        return self._shadow
+        
+    def invalidate(self):
+        """Drop the shadow so the next evaluation rebuilds it."""
+        with self._lock:
+            if self._shadow is not None:
+                self._shadow.close()
+            self._shadow = None
+            self._shadow_key = None
+            self._baseline_plans.clear()
+            
+    @staticmethod
+    def _explain(shadow, query):
+        """Return the EXPLAIN QUERY PLAN detail lines of a query on the shadow."""
+        return [row[3] for row in shadow.execute(f"EXPLAIN QUERY PLAN {query.strip().rstrip(';')}")]
+        
+    def _baseline(self, shadow, query):
+        """Return the cached plan of a query without any hypothetical index."""
+        plan = self._baseline_plans.get(query)
+        if plan is None:
+            plan = self._explain(shadow, query)
+            self._baseline_plans[query] = plan
+            if len(self._baseline_plans) > self.PLAN_CACHE_SIZE:
+                self._baseline_plans.popitem(last=False)
+        else:
+            self._baseline_plans.move_to_end(query)
+        return plan
+        
+    @classmethod
+    def parse_create_index(cls, create_statement):
+        """Return (index name, table, key columns) of a CREATE INDEX statement, or None."""
+        match = cls.CREATE_INDEX_PATTERN.fullmatch(create_statement)
+        if not match:
+            return None
+        columns = []
+        for part in match.group(3).split(','):
+            tokens = part.strip().split()
+            if tokens:
+                columns.append(tokens[0].strip('"`[]'))
+        return match.group(1), match.group(2), columns
+        
+    def workload(self, table_name=None, limit=None):
+        """Return the most executed query shapes, optionally only those with candidates on a table."""
+        limit = limit or self.WORKLOAD_SIZE
+        if table_name is None:
+            rows = self.db_manager.execute_and_fetch(
+                "SELECT fingerprint, sample_query, query_count FROM query_fingerprints "
+                "WHERE sample_query IS NOT NULL ORDER BY query_count DESC LIMIT ?",
+                (limit,)
+            )
+        else:
+            rows = self.db_manager.execute_and_fetch("""
+                SELECT qf.fingerprint, qf.sample_query, qf.query_count
+                FROM query_fingerprints qf
+                WHERE qf.sample_query IS NOT NULL
+                AND qf.fingerprint IN (
+                    SELECT fc.fingerprint FROM fingerprint_candidates fc
+                    JOIN index_candidates ic ON ic.candidate_key = fc.candidate_key
+                    WHERE ic.table_name = ? COLLATE NOCASE
+                )
+                ORDER BY qf.query_count DESC
+                LIMIT ?
+            """, (table_name, limit))
+        return [
+            {'fingerprint': row['fingerprint'], 'query': row['sample_query'], 'count': row['query_count']}
+            for row in rows
+        ]
+        
+    def _borrow_statistics(self, shadow, table_name, index_name, columns):
+        """Give a hypothetical index sqlite_stat1 figures taken from indexes with the same leading columns.
+
+        The rows per key of a column prefix do not depend on the column order,
+        so any analyzed index whose leading columns are the same set supplies
+        them. Without figures for the first column SQLite's defaults are used.
+        """
+        table_rows = None
+        rows_per_prefix = {}
+        for idx, stat in shadow.execute(
+            "SELECT idx, stat FROM sqlite_stat1 WHERE tbl = ? COLLATE NOCASE", (table_name,)
+        ).fetchall():
+            figures = []
+            for token in (stat or '').split():
+                if not token.isdigit():
+                    break
+                figures.append(int(token))
+            if not figures:
+                continue
+            table_rows = figures[0]
+            if idx is None:
+                continue
+            index_columns = [row[0] for row in shadow.execute("SELECT name FROM pragma_index_info(?)", (idx,))]
+            for i in range(1, min(len(figures), len(index_columns) + 1)):
+                if any(column is None for column in index_columns[:i]):
+                    break
+                prefix = frozenset(column.lower() for column in index_columns[:i])
+                rows_per_prefix[prefix] = min(figures[i], rows_per_prefix.get(prefix, figures[i]))
+        if table_rows is None:
+            return
+            
+        figures = [table_rows]
+        for i in range(1, len(columns) + 1):
+            rows = rows_per_prefix.get(frozenset(column.lower() for column in columns[:i]))
+            if rows is None:
+                if i == 1:
+                    return
+                # A longer key is at least as selective as its prefix
+                rows = figures[-1]
+            figures.append(rows)
+        shadow.execute(
+            "INSERT INTO sqlite_stat1 (tbl, idx, stat) VALUES (?, ?, ?)",
+            (table_name, index_name, ' '.join(str(figure) for figure in figures))
+        )
+        shadow.execute("ANALYZE sqlite_schema")
+        
+    def _evaluate(self, shadow, create_statement, queries):
+        """Evaluate one hypothetical index against the workload on the shadow."""
+        parsed = self.parse_create_index(create_statement)
+        if parsed is None:
+            return {'create_statement': create_statement, 'error': 'Invalid CREATE INDEX statement', 'success': False}
+        index_name, table_name, columns = parsed
+        result = {
+            'create_statement': create_statement,
+            'index_name': index_name,
+            'table': table_name,
+            'columns': columns,
+            'queries_evaluated': 0,
+            'queries_using_index': 0,
+            'executions_using_index': 0,
+            'plans': [],
+            'success': True
+        }
+        
+        baselines = {}
+        for item in queries:
+            try:
+                baselines[item['query']] = self._baseline(shadow, item['query'])
+            except sqlite3.Error as e:
+                logger.debug(f"What-if analysis skipped a query: {e}")
+                
+        shadow.execute("BEGIN")
+        try:
+            shadow.execute(create_statement)
+            self._borrow_statistics(shadow, table_name, index_name, columns)
+            for item in queries:
+                before = baselines.get(item['query'])
+                if before is None:
+                    continue
+                after = self._explain(shadow, item['query'])
+                uses_index = any(
+                    match.group(1) == index_name
+                    for match in (self.INDEX_USE_PATTERN.search(detail) for detail in after) if match
+                )
+                result['queries_evaluated'] += 1
+                if uses_index:
+                    result['queries_using_index'] += 1
+                    result['executions_using_index'] += item.get('count') or 1
+                result['plans'].append({
+                    'fingerprint': item.get('fingerprint'),
+                    'query': item['query'],
+                    'before': before,
+                    'after': after,
+                    'uses_index': uses_index
+                })
+        except sqlite3.Error as e:
+            result['error'] = str(e)
+            result['success'] = False
+        finally:
+            shadow.execute("ROLLBACK")
+        return result
+        
+    def evaluate(self, create_statement, queries=None):
+        """Return which workload queries would use a hypothetical index and their plans before and after."""
+        return self.evaluate_many([create_statement], queries)[0]
+        
+    def evaluate_many(self, create_statements, queries=None):
+        """Evaluate hypothetical indexes one by one against the same shadow.
+
+        queries is a list of SQL strings or of dicts with query, fingerprint
+        and count; by default each index is evaluated against the most
+        executed query shapes with candidates on its table.
+        """
+        if queries is not None:
+            queries = [item if isinstance(item, dict) else {'query': item, 'count': 1} for item in queries]
+        results = []
+        try:
+            with self._lock:
+                shadow = self._current_shadow()
+                workloads = {}
+                for create_statement in create_statements:
+                    workload = queries
+                    if workload is None:
+                        parsed = self.parse_create_index(create_statement)
+                        table_name = parsed[1].lower() if parsed else None
+                        if table_name not in workloads:
+                            workloads[table_name] = self.workload(table_name) if table_name else []
+                        workload = workloads[table_name]
+                    results.append(self._evaluate(shadow, create_statement, workload))
+        except sqlite3.Error as e:
+            logger.error(f"Error evaluating hypothetical indexes: {e}")
+            results.extend(
+                {'create_statement': statement, 'error': str(e), 'success': False}
+                for statement in create_statements[len(results):]
+            )
+        return results
+
+
+class IndexAuditor:
+    """Finds indexes that cost writes without serving reads.
+
+    Index use comes from the stored plans: the log writer counts the
+    executions and last use of every plan, and the plan nodes name the
+    index each step uses. Only sampled executions carry a plan, so a low
+    sample rate makes rarely used indexes look unused. Three kinds of
+    dead weight are reported:
+
+    - unused: no plan used the index within the window,
+    - duplicate: another index has the same key,
+    - redundant: its key is a strict prefix of another index's key.
+
+    Indexes that enforce PRIMARY KEY or UNIQUE constraints are reported
+    without a DROP INDEX statement. Until plans have been captured for the
+    whole window, and at least MIN_CAPTURED_PLANS executions of them, the
+    report is provisional and unused indexes get no DROP INDEX statement.
+    """
     
-    def __init__(self, db_manager):
-        """Initialize with a database manager."""
+    MIN_CAPTURED_PLANS = 1000
+    
+    def __init__(self, db_manager, recommender=None):
+        """Initialize with a database manager and the recommender used to cost writes."""
         self.db_manager = db_manager
+        self.recommender = recommender or IndexRecommender(db_manager)
         
-    def capture_query(self, query):
-        """Capture a query, its execution plan and execution time."""
-        try:
-            if query.strip().upper().startswith(('EXPLAIN', 'PRAGMA')):
-                # We don't log EXPLAIN or PRAGMA queries
-                self.db_manager.execute(query)
-                return None, None, None
-                
-            # Get execution plan
-            plan_query = f"EXPLAIN QUERY PLAN {query}"
-            self.db_manager.execute(plan_query)
-            plan_rows = self.db_manager.cursor.fetchall()
-            execution_plan = "\n".join([f"{row['id']}|{row['parent']}|{row['notused']}|{row['detail']}" for row in plan_rows])
-            
-            # Execute query and measure performance
-            start_time = time.time()
-            self.db_manager.execute(query)
-            end_time = time.time()
-            execution_time = end_time - start_time
-            
-            # Log query
-            self.db_manager.execute(
-                "INSERT INTO query_logs (query, execution_time, execution_plan) VALUES (?, ?, ?)",
-                (query, execution_time, execution_plan)
-            )
-            self.db_manager.commit()
-            query_id = self.db_manager.cursor.lastrowid
-            
-            return execution_time, execution_plan, query_id
-        except Exception as e:
-            logger.error(f"Error capturing query: {e}")
-            return None, str(e), None
-            
-    def get_query_logs(self, limit=100, order_by="timestamp DESC"):
-        """Retrieve query logs."""
-        try:
-            logs = self.db_manager.execute_and_fetch(
-                f"SELECT * FROM query_logs ORDER BY {order_by} LIMIT ?",
-                (limit,)
-            )
-            return [dict(log) for log in logs]
-        except sqlite3.Error as e:
-            logger.error(f"Error getting query logs: {e}")
-            return []
-            
-    def get_slow_queries(self, threshold=1.0, limit=20):
-        """Retrieve slow queries above threshold execution time."""
+    def audit(self, unused_days=90):
+        """Return the unused, duplicate and redundant indexes of the user tables."""
         try:
-            logs = self.db_manager.execute_and_fetch(
-                "SELECT * FROM query_logs WHERE execution_time > ? ORDER BY execution_time DESC LIMIT ?",
-                (threshold, limit)
-            )
-            return [dict(log) for log in logs]
+            self.db_manager.ensure_connected()
+            catalog = self.db_manager.catalog
+            indexes = [
+                dict(index, table=table_name)
+                for table_name in catalog.tables()
+                if table_name.lower() not in DatabaseManager.METADATA_TABLES
+                for index in catalog.indexes(table_name)
+            ]
+            usage = self._index_usage()
+            observed_since, captured_plans = self.db_manager.conn.execute(
+                "SELECT MIN(created_at), COALESCE(SUM(use_count), 0) FROM execution_plans"
+            ).fetchone()
         except sqlite3.Error as e:
-            logger.error(f"Error getting slow queries: {e}")
-            return []
+            logger.error(f"Error auditing indexes: {e}")
+            return {
+                'unused': [], 'duplicate': [], 'redundant': [], 'observed_since': None,
+                'captured_plans': 0, 'provisional': True
+            }
             
-    def get_frequent_queries(self, limit=20):
-        """Retrieve the most frequent queries."""
+        cutoff = (datetime.utcnow() - timedelta(days=unused_days)).strftime('%Y-%m-%d %H:%M:%S')
+        # An index can only be called unused once the plans cover the window and enough executions
+        provisional = observed_since is None or observed_since > cutoff or captured_plans < self.MIN_CAPTURED_PLANS
+        findings = []
+        for index in indexes:
+            index['use_count'], index['last_used'] = usage.get(index['name'].lower(), (0, None))
+            # Constraint indexes are needed whether or not a query reads them
+            if self._enforces_constraint(index):
+                continue
+            if index['last_used'] is None:
+                findings.append(('unused', index, "Not used by any captured plan", None))
+            elif index['last_used'] < cutoff:
+                findings.append(('unused', index, f"Not used since {index['last_used']}", None))
+        duplicates = self._duplicates(indexes)
+        duplicated = {index['name'] for index, _, _ in duplicates}
+        findings.extend(('duplicate',) + finding for finding in duplicates)
+        findings.extend(
+            ('redundant',) + finding for finding in self._redundant(indexes) if finding[0]['name'] not in duplicated
+        )
+        
+        costs = self.recommender.maintenance_costs([
+            {'table': index['table'], 'column': '', 'composite_columns': [column for column in index['columns'] if column]}
+            for _, index, _, _ in findings
+        ])
+        sizes = self._index_sizes({index['name'] for _, index, _, _ in findings})
+        report = {
+            'unused': [], 'duplicate': [], 'redundant': [], 'observed_since': observed_since,
+            'captured_plans': captured_plans, 'provisional': provisional
+        }
+        for (kind, index, reason, kept), cost in zip(findings, costs):
+            entry = self._entry(index, reason, kept, sizes.get(index['name']), float(cost))
+            if kind == 'unused' and provisional:
+                entry['drop_statement'] = None
+            report[kind].append(entry)
+        for kind in ('unused', 'duplicate', 'redundant'):
+            report[kind].sort(key=lambda entry: (-(entry['size_bytes'] or 0), entry['index_name']))
+        return report
+        
+    def _index_usage(self):
+        """Return {index name (lower case): (use count, last use)} from the stored plans."""
+        usage = {}
+        for row in self.db_manager.conn.execute('''
+            SELECT n.index_name, SUM(p.use_count), MAX(p.last_used)
+            FROM (SELECT DISTINCT plan_id, index_name FROM execution_plan_nodes WHERE index_name IS NOT NULL) n
+            JOIN execution_plans p ON p.id = n.plan_id
+            GROUP BY n.index_name COLLATE NOCASE
+        '''):
+            usage[row[0].lower()] = (row[1] or 0, row[2])
+        return usage
+        
+    @staticmethod
+    def _key(index):
+        """Return the comparable key of an index, or None if it cannot be compared."""
+        if index['partial'] or index['has_expression']:
+            return None
+        return [(column.lower(), desc) for column, desc in zip(index['columns'], index['descending'])]
+        
+    @staticmethod
+    def _enforces_constraint(index):
+        """Return True if dropping the index would drop a uniqueness guarantee."""
+        return index['origin'] != 'c' or index['unique']
+        
+    def _duplicates(self, indexes):
+        """Return the (index, reason, kept index) of every index with the same key as another."""
+        groups = {}
+        for index in indexes:
+            key = self._key(index)
+            if key is not None:
+                groups.setdefault((index['table'].lower(), tuple(key)), []).append(index)
+        findings = []
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            # Keep the index that enforces a constraint, then the most used one
+            group.sort(key=lambda index: (index['origin'] == 'c', not index['unique'], -index['use_count'], index['name']))
+            kept = group[0]
+            findings.extend((index, f"Same key as {kept['name']}", kept) for index in group[1:])
+        return findings
+        
+    def _redundant(self, indexes):
+        """Return the (index, reason, covering index) indexes whose key is a prefix of another index's key."""
+        findings = []
+        for index in indexes:
+            key = self._key(index)
+            if key is None or index['unique']:
+                continue
+            flipped = [(column, not desc) for column, desc in key]
+            for other in indexes:
+                other_key = self._key(other)
+                if (other is index or other_key is None or other['table'].lower() != index['table'].lower()
+                        or len(other_key) <= len(key)):
+                    continue
+                # A key read backwards serves the reversed order just as well
+                if other_key[:len(key)] in (key, flipped):
+                    findings.append((index, f"Key is a prefix of {other['name']}", other))
+                    break
+        return findings
+        
+    def _index_sizes(self, names):
+        """Return {index name: bytes on disk} from dbstat, or {} if it is not compiled in."""
+        sizes = {}
         try:
-            logs = self.db_manager.execute_and_fetch(
-                """
-                SELECT query, COUNT(*) as count, AVG(execution_time) as avg_time
-                FROM query_logs 
-                GROUP BY query 
-                ORDER BY count DESC
-                LIMIT ?
-                """,
-                (limit,)
-            )
-            return [dict(log) for log in logs]
-        except sqlite3.Error as e:
-            logger.error(f"Error getting frequent queries: {e}")
-            return []
+            for name in names:
+                row = self.db_manager.conn.execute(
+                    "SELECT pgsize FROM dbstat WHERE name = ? AND aggregate = TRUE", (name,)
+                ).fetchone()
+                sizes[name] = row[0] if row else None
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Index sizes unavailable: {e}")
+            return {}
+        return sizes
+        
+    def _entry(self, index, reason, kept, size_bytes, write_overhead):
+        """Build the report entry of an index."""
+        # Dropping a unique duplicate is only safe if the kept index is unique too
+        droppable = not self._enforces_constraint(index) or (
+            kept is not None and index['origin'] == 'c' and kept['unique'] and self._key(kept) == self._key(index)
+        )
+        quoted = index['name'].replace('"', '""')
+        return {
+            'index_name': index['name'],
+            'table': index['table'],
+            'columns': [column or '<expression>' for column in index['columns']],
+            'unique': index['unique'],
+            'partial': index['partial'],
+            'use_count': index['use_count'],
+            'last_used': index['last_used'],
+            'size_bytes': size_bytes,
+            'size_mb': round(size_bytes / (1024 * 1024), 3) if size_bytes is not None else None,
+            'write_overhead': write_overhead,
+            'reason': reason,
+            'kept_index': kept['name'] if kept else None,
+            'drop_statement': f'DROP INDEX "{quoted}"' if droppable else None
+        }
 
 
-class IndexRecommender:
-    """Recommends indexes based on query patterns."""
+class ComparisonStore:
+    """Persists performance comparison results and serves repeats of them.
+
+    Results are keyed by the query's fingerprint, the index definition
+    without its name, PRAGMA schema_version and a signature of the tables
+    the comparison reads: each table's largest rowid and its count of
+    captured writes from table_writes. Both are index lookups, so reading
+    the state never scans a table. Writes to other tables, including the
+    tool's own query logs and statistics, leave stored results valid.
+    Writes made without the query monitor are only noticed when they add
+    rows, and buffered captures count once their batch is written.
+    """
+    
+    _DEFINITION_PATTERN = re.compile(
+        r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?\S+\s+ON\s+", re.IGNORECASE
+    )
     
     def __init__(self, db_manager):
         """Initialize with a database manager."""
         self.db_manager = db_manager
+        self.parser = SQLParser()
+        self._conn = None
+        self._lock = threading.Lock()
+        
+    @classmethod
+    def definition(cls, create_statement):
+        """Return an index definition without its name and with collapsed spacing, or None."""
+        match = cls._DEFINITION_PATTERN.match(create_statement or '')
+        if not match:
+            return None
+        head = 'CREATE UNIQUE INDEX ON ' if match.group(1) else 'CREATE INDEX ON '
+        return head + ' '.join(create_statement[match.end():].split()).rstrip(';')
+        
+    def _connection(self):
+        """Return the store's own connection, opening it if needed."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_manager.db_file, timeout=30, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+        return self._conn
         
-    def analyze(self):
-        """Analyze query patterns and recommend indexes."""
+    def tables(self, query, create_statement=None):
+        """Return the tables a comparison reads: the query's and the index's.
+
+        If the query cannot be parsed every application table is returned.
+        """
+        tables = set()
+        parsed = WhatIfAnalyzer.parse_create_index(create_statement or '')
+        if parsed:
+            tables.add(parsed[1].lower())
         try:
-            # Get query logs for analysis
-            query_logs = self.db_manager.execute_and_fetch(
-                "SELECT * FROM query_logs ORDER BY timestamp DESC LIMIT 100"
+            # Aliased tables are listed as (table, alias)
+            tables.update(
+                (entry[0] if isinstance(entry, tuple) else entry).lower()
+                for entry in self.parser.analyze(query)['tables']
             )
-            
-            if not query_logs:
-                return []
-                
-            # Analyze each query and collect potential indexes
-            potential_indexes = []
-            for log in query_logs:
-                query = log['query']
-                execution_plan = log['execution_plan']
-                
-                # Skip non-SELECT queries for simplicity
-                if not query.strip().upper().startswith('SELECT'):
-                    continue
-                    
-                # Find tables, conditions and indexable fields
-                tables, columns = self._parse_query(query)
-                if not tables:
-                    continue
-                    
-                # Look for full table scans
-                if execution_plan and 'SCAN' in execution_plan and 'INDEX' not in execution_plan:
-                    # This query is likely doing a full table scan
-                    for table in tables:
-                        indexed_columns = self._get_indexed_columns(table)
-                        for column in columns:
-                            # Check if this is a column from this table
-                            if '.' in column:
-                                # Format: table.column
-                                parts = column.split('.')
-                                if parts[0] != table and parts[0] != table[0]:  # Handle table aliases
-                                    continue
-                                column_name = parts[1]
-                            else:
-                                column_name = column
-                                
-                            if column_name not in indexed_columns:
-                                potential_indexes.append({
-                                    'table': table,
-                                    'column': column_name,
-                                    'query_id': log['id'],
-                                    'execution_time': log['execution_time']
-                                })
+        except SQLParseError:
+            tables.update(
+                table_name.lower() for table_name in self.db_manager.catalog.tables()
+                if table_name.lower() not in DatabaseManager.METADATA_TABLES
+            )
+        return sorted(tables)
+        
+    def signatures(self, tables):
+        """Return (schema version, {table: signature}) for a set of tables, or None if unavailable."""
+        with self._lock:
+            try:
+                conn = self._connection()
+                # One read transaction so the version and the signatures belong together
+                conn.execute("BEGIN")
+                try:
+                    schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+                    writes = {
+                        row[0].lower(): row[1]
+                        for row in conn.execute("SELECT table_name, write_count FROM table_writes")
+                    }
+                    signatures = {}
+                    for table_name in tables:
+                        quoted = table_name.replace('"', '""')
+                        try:
+                            max_rowid = conn.execute(f'SELECT MAX(rowid) FROM "{quoted}"').fetchone()[0]
+                        except sqlite3.OperationalError:
+                            # WITHOUT ROWID tables only have their write count
+                            max_rowid = None
+                        signatures[table_name.lower()] = f"{table_name.lower()}:{max_rowid}:{writes.get(table_name.lower(), 0)}"
+                finally:
+                    conn.rollback()
+                return schema_version, signatures
+            except sqlite3.Error as e:
+                logger.error(f"Error reading the database state: {e}")
+                return None
                 
-                # Look for opportunities for composite indexes
-                if len(columns) > 1:
-                    # Find tables with multiple conditions
-                    table_columns = {}
-                    for column in columns:
-                        if '.' in column:
-                            table_alias, col_name = column.split('.')
-                            if table_alias in table_columns:
-                                table_columns[table_alias].append(col_name)
-                            else:
-                                table_columns[table_alias] = [col_name]
-                    
-                    # For each table with multiple conditions, suggest a composite index
-                    for alias, cols in table_columns.items():
-                        if len(cols) > 1:
-                            # Find the actual table name from alias
-                            table_name = None
-                            for t in tables:
-                                if t == alias or (isinstance(t, tuple) and t[1] == alias):
-                                    table_name = t if not isinstance(t, tuple) else t[0]
-                                    break
-                            
-                            if table_name:
-                                composite_key = "_".join(sorted(cols))
-                                potential_indexes.append({
-                                    'table': table_name,
-                                    'column': composite_key,
-                                    'is_composite': True,
-                                    'composite_columns': cols,
-                                    'query_id': log['id'],
-                                    'execution_time': log['execution_time']
-                                })
-            
-            # Score and rank potential indexes
-            recommendations = self._score_indexes(potential_indexes)
-            
-            # Return top recommendations
-            return recommendations[:10]  # Return top 10 recommendations
-        except Exception as e:
-            logger.error(f"Error analyzing for index recommendations: {e}")
-            return []
-            
-    def _parse_query(self, query):
-        """Parse a SQL query to extract tables and WHERE conditions.
-        Returns a tuple of (tables, columns) where:
-        - tables is a list of table names or (table_name, alias) tuples
-        - columns is a list of column names (potentially with table prefixes)
+    def state(self, tables, signatures=None):
+        """Return the (schema version, data signature) of a comparison over tables, or None if unavailable.
+
+        signatures, from signatures(), lets a batch read the database once
+        for all its comparisons; it must cover the tables.
+        """
+        signatures = signatures or self.signatures(tables)
+        if signatures is None:
+            return None
+        schema_version, by_table = signatures
+        return schema_version, ';'.join(by_table[table_name.lower()] for table_name in sorted(tables))
+        
+    def lookup(self, state, fingerprint, create_statement, iterations):
+        """Return the stored result for a state, or None if there is none with enough iterations."""
+        if state is None:
+            return None
+        with self._lock:
+            try:
+                row = self._connection().execute(
+                    """
+                    SELECT result, iterations FROM performance_comparisons
+                    WHERE fingerprint = ? AND index_definition = ?
+                    AND schema_version = ? AND data_signature = ?
+                    """,
+                    (fingerprint, self.definition(create_statement), *state)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error looking up a stored comparison: {e}")
+                return None
+        if row is None or (row['iterations'] or 0) < iterations:
+            return None
+        return dict(json.loads(row['result']), cached=True)
+        
+    def save(self, state, fingerprint, query, create_statement, result):
+        """Store a successful comparison result under the state it was measured in."""
+        if state is None or not result.get('success'):
+            return
+        parsed = WhatIfAnalyzer.parse_create_index(create_statement)
+        index_name, table_name, columns = parsed if parsed else (None, None, [])
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    """
+                    INSERT INTO performance_comparisons
+                        (fingerprint, query, table_name, index_name, columns, index_definition,
+                         schema_version, data_signature, mode, iterations, verdict,
+                         original_time, optimized_time, improvement_percent, result, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT (fingerprint, index_definition, schema_version, data_signature) DO UPDATE SET
+                        query = excluded.query,
+                        index_name = excluded.index_name,
+                        mode = excluded.mode,
+                        iterations = excluded.iterations,
+                        verdict = excluded.verdict,
+                        original_time = excluded.original_time,
+                        optimized_time = excluded.optimized_time,
+                        improvement_percent = excluded.improvement_percent,
+                        result = excluded.result,
+                        timestamp = excluded.timestamp
+                    """,
+                    (
+                        fingerprint, query, table_name, index_name, ', '.join(columns), self.definition(create_statement),
+                        *state, result.get('mode'), result['iterations'], result['verdict'],
+                        # Times are stored in seconds, the result reports milliseconds
+                        result['original_time'] / 1000, result['optimized_time'] / 1000, result['improvement'],
+                        json.dumps(result)
+                    )
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error storing a comparison: {e}")
+
+
+class PerformanceComparer:
+    """Compares query performance with and without indexes.
+
+    Each side runs on its own connection to the database, or to a snapshot
+    copy of it. The index is built inside a transaction on one of them and
+    rolled back afterwards, so the other keeps seeing the database without
+    it, and a crash never leaves the index behind. By default this happens
+    on a snapshot; in 'live' mode the transaction holds the database's
+    write lock while the benchmark runs, so that mode is opt-in.
+
+    After warmup runs the two sides are timed in alternating order, so
+    drift such as a warming page cache affects both alike. Outliers beyond
+    the interquartile fences are dropped, and a result only counts as
+    conclusive when the bootstrap confidence intervals of the two medians
+    do not overlap.
+    """
+    
+    MODES = ('live', 'snapshot', 'memory')
+    BATCH_WORKLOAD_SIZE = 20
+    WARMUP_RUNS = 2
+    MIN_ITERATIONS = 3
+    BOOTSTRAP_RESAMPLES = 2000
+    CONFIDENCE = 0.95
+    OUTLIER_FENCE = 1.5
+    
+    def __init__(self, db_manager, config_manager=None):
+        """Initialize with a database manager and optional configuration manager."""
+        self.db_manager = db_manager
+        self.timer = QueryTimer()
+        self.iterations = 3
+        self.mode = 'snapshot'
+        self.snapshot_directory = ''
+        self.workers = 0
+        if config_manager:
+            self.iterations = int(config_manager.get('ANALYSIS', 'comparison_iterations', self.iterations))
+            self.mode = config_manager.get('ANALYSIS', 'comparison_mode', self.mode)
+            self.snapshot_directory = config_manager.get('ANALYSIS', 'snapshot_directory', self.snapshot_directory)
+            self.workers = int(config_manager.get('ANALYSIS', 'comparison_workers', self.workers) or 0)
+        self.parser = SQLParser()
+        self.fingerprinter = QueryFingerprinter()
+        self.store = ComparisonStore(db_manager)
+        self._rng = np.random.default_rng()
+        
+    def _connect(self, path=None):
+        """Open a connection to the database, or a copy of it, that manages its own transactions."""
+        conn = sqlite3.connect(
+            path or self.db_manager.db_file, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        return conn
+        
+    def _backup(self, target, source=None):
+        """Copy a consistent snapshot of the database, or of another copy, into a target.
+
+        Returns the open target connection.
         """
+        source_conn = self._connect(source)
         try:
-            # Normalize query - remove extra whitespace and convert to uppercase for parsing
-            query = re.sub(r'\s+', ' ', query).strip()
-            
-            # Extract tables and their aliases from FROM and JOIN clauses
-            tables = []
-            
-            # Find the FROM clause and everything after it
-            from_match = re.search(r'FROM\s+(.*?)(?:WHERE|GROUP BY|HAVING|ORDER BY|LIMIT|;|$)', query, re.IGNORECASE)
-            if not from_match:
-                return [], []
+            target_conn = self._connect(target)
+            # A single step copies every page under one read transaction
+            source_conn.backup(target_conn)
+            if target != ':memory:':
+                # The copy is ours, so it can use WAL and let both sides of a comparison alternate
+                self._enable_wal(target_conn)
+        finally:
+            source_conn.close()
+        return target_conn
+        
+    def create_snapshot(self, directory=None, source=None):
+        """Copy the database, or another snapshot, into a scratch file and return its path."""
+        fd, path = tempfile.mkstemp(prefix='snapshot_', suffix='.db', dir=directory or self.snapshot_directory or None)
+        os.close(fd)
+        try:
+            self._backup(path, source).close()
+        except BaseException:
+            self.remove_snapshot(path)
+            raise
+        return path
+        
+    @staticmethod
+    def remove_snapshot(path):
+        """Delete a scratch snapshot with its journal files."""
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
                 
-            from_clause = from_match.group(1).strip()
-            
-            # Handle multiple tables in FROM clause (t1, t2, t3)
-            tables_parts = re.split(r',\s*', from_clause)
+    def compare_with_index(self, query, create_index_statement, iterations=None, mode=None, refresh=False):
+        """Compare query performance with and without an index.
+
+        The default 'snapshot' mode runs on a scratch file copy and 'memory'
+        on an in-memory copy, both taken with the backup API and discarded
+        afterwards, so building the index never holds a lock on the
+        database. 'live' runs on the database itself and blocks its writers
+        until the benchmark ends. A result stored for the same query shape,
+        index and database state is returned unless refresh is set.
+        """
+        iterations = max(self.MIN_ITERATIONS, iterations or self.iterations)
+        mode = mode or self.mode
+        if mode not in self.MODES:
+            return {'error': f"Unknown comparison mode: {mode}", 'success': False}
+        # Sanitize the query to ensure it's properly formatted for SQLite
+        query = query.strip()
+        if ComparisonStore.definition(create_index_statement) is None:
+            return {'error': 'Invalid CREATE INDEX statement', 'success': False}
             
-            for part in tables_parts:
-                # Handle JOIN syntax
-                join_parts = re.split(r'\s+(?:JOIN|INNER JOIN|LEFT JOIN|RIGHT JOIN|FULL JOIN|OUTER JOIN)\s+', part, flags=re.IGNORECASE)
+        fingerprint = self.fingerprinter.fingerprint(query)[0]
+        state = self.store.state(self.store.tables(query, create_index_statement))
+        if not refresh:
+            cached = self.store.lookup(state, fingerprint, create_index_statement, iterations)
+            if cached is not None:
+                return cached
                 
-                for join_part in join_parts:
-                    # Remove ON clause if present
-                    join_part = re.sub(r'\s+ON\s+.*', '', join_part).strip()
-                    
-                    # Extract table name and potential alias
-                    if re.search(r'\s+(?:AS\s+)?(\w+)$', join_part, re.IGNORECASE):
-                        # Has an alias
-                        table_alias_match = re.search(r'(\w+)\s+(?:AS\s+)?(\w+)$', join_part, re.IGNORECASE)
-                        if table_alias_match:
-                            table_name = table_alias_match.group(1)
-                            alias = table_alias_match.group(2)
-                            tables.append((table_name, alias))
-                    else:
-                        # No alias
-                        tables.append(join_part.strip())
-            
-            # Extract all potential indexable conditions from various clauses
-            indexable_columns = []
-            
-            # From WHERE clause
-            where_match = re.search(r'WHERE\s+(.*?)(?:GROUP BY|HAVING|ORDER BY|LIMIT|;|$)', query, re.IGNORECASE)
-            if where_match:
-                where_clause = where_match.group(1).strip()
-                # Extract column names from conditions, handling complex expressions
-                where_columns = self._extract_columns_from_conditions(where_clause)
-                indexable_columns.extend(where_columns)
-            
-            # From JOIN conditions
-            for join_match in re.finditer(r'(?:JOIN|INNER JOIN|LEFT JOIN|RIGHT JOIN)\s+\w+\s+(?:AS\s+)?(\w+)\s+ON\s+(.*?)(?:JOIN|WHERE|GROUP BY|HAVING|ORDER BY|LIMIT|;|$)', query, re.IGNORECASE):
-                join_condition = join_match.group(2).strip()
-                join_columns = self._extract_columns_from_conditions(join_condition)
-                indexable_columns.extend(join_columns)
-            
-            # From ORDER BY clause
-            order_by_match = re.search(r'ORDER BY\s+(.*?)(?:LIMIT|;|$)', query, re.IGNORECASE)
-            if order_by_match:
-                order_clause = order_by_match.group(1).strip()
-                # Split by commas to handle multiple ORDER BY columns
-                order_parts = re.split(r',\s*', order_clause)
-                for part in order_parts:
-                    # Remove ASC/DESC specification
-                    column = re.sub(r'\s+(?:ASC|DESC)$', '', part, flags=re.IGNORECASE).strip()
-                    indexable_columns.append(column)
-            
-            # From GROUP BY clause
-            group_by_match = re.search(r'GROUP BY\s+(.*?)(?:HAVING|ORDER BY|LIMIT|;|$)', query, re.IGNORECASE)
-            if group_by_match:
-                group_clause = group_by_match.group(1).strip()
-                group_parts = re.split(r',\s*', group_clause)
-                indexable_columns.extend([part.strip() for part in group_parts])
-            
-            # From HAVING clause
-            having_match = re.search(r'HAVING\s+(.*?)(?:ORDER BY|LIMIT|;|$)', query, re.IGNORECASE)
-            if having_match:
-                having_clause = having_match.group(1).strip()
-                having_columns = self._extract_columns_from_conditions(having_clause)
-                indexable_columns.extend(having_columns)
-            
-            # Look for subqueries - recursively parse them
-            for subquery_match in re.finditer(r'\(\s*SELECT\s+.*?\)', query, re.IGNORECASE | re.DOTALL):
-                subquery = subquery_match.group(0)
-                # Remove the outer parentheses
-                subquery = subquery[1:-1].strip()
-                # Parse the subquery
-                sub_tables, sub_columns = self._parse_query(subquery)
-                tables.extend(sub_tables)
-                indexable_columns.extend(sub_columns)
-            
-            # Remove duplicates while preserving order
-            unique_columns = []
-            for col in indexable_columns:
-                if col not in unique_columns:
-                    unique_columns.append(col)
-            
-            return tables, unique_columns
+        baseline_conn = indexed_conn = None
+        snapshot_path = None
+        try:
+            if mode == 'live':
+                baseline_conn, indexed_conn = self._connect(), self._connect()
+            elif mode == 'snapshot':
+                snapshot_path = self.create_snapshot()
+                baseline_conn, indexed_conn = self._connect(snapshot_path), self._connect(snapshot_path)
+            else:
+                # An in-memory copy has a single connection, so its sides are timed in turn
+                baseline_conn = indexed_conn = self._backup(':memory:')
+            result = self._compare(baseline_conn, indexed_conn, [query], create_index_statement, iterations)[0]
         except Exception as e:
-            logger.error(f"Error parsing query: {e}")
-            return [], []
-    
-    def _extract_columns_from_conditions(self, condition_str):
-        """Extract column names from a condition string."""
-        columns = []
+            logger.error(f"Error comparing performance: {e}")
+            return {'error': str(e), 'success': False}
+        finally:
+            # 4. Discard the index by rolling back and release the connections
+            self._release(indexed_conn, baseline_conn)
+            if snapshot_path:
+                self.remove_snapshot(snapshot_path)
+                
+        # Stored only now that the index transaction no longer holds the write lock
+        if result.get('success'):
+            result['mode'] = mode
+            self.store.save(state, fingerprint, query, create_index_statement, result)
+        return result
+                
+    def _compare(self, baseline_conn, indexed_conn, queries, create_index_statement, iterations):
+        """Time queries without the index on one connection and with it on the other.
+
+        Returns one result per query; if the index cannot be built every
+        query gets the error.
+        """
+        # The benchmark runs the queries repeatedly, so they must not change anything
+        baseline_conn.execute("PRAGMA query_only = ON")
         
-        # Handle AND, OR, and parentheses
-        # First, break the condition into parts
-        condition_parts = []
-        current_part = ""
-        paren_level = 0
-        
-        for char in condition_str:
-            if char == '(':
-                paren_level += 1
-                current_part += char
-            elif char == ')':
-                paren_level -= 1
-                current_part += char
-            elif char == ' ' and paren_level == 0 and current_part.upper().endswith(' AND'):
-                condition_parts.append(current_part[:-4].strip())
-                current_part = ""
-            elif char == ' ' and paren_level == 0 and current_part.upper().endswith(' OR'):
-                condition_parts.append(current_part[:-3].strip())
-                current_part = ""
-            else:
-                current_part += char
-        
-        if current_part:
-            condition_parts.append(current_part.strip())
-        
-        # If we couldn't break it down, treat the whole string as one condition
-        if not condition_parts:
-            condition_parts = [condition_str]
-        
-        # Extract column names from each part
-        for part in condition_parts:
-            # Handle comparison operators: =, <>, !=, >, <, >=, <=
-            for op in ['=', '<>', '!=', '>=', '<=', '>', '<']:
-                if op in part:
-                    sides = part.split(op, 1)
-                    left = sides[0].strip()
-                    
-                    # Check if left side is a column reference
-                    if re.match(r'^[a-zA-Z0-9_.]+$', left) and not left.isdigit():
-                        columns.append(left)
-                    break
-            
-            # Handle IN conditions
-            in_match = re.search(r'(\w+(?:\.\w+)?)\s+IN\s*\(', part, re.IGNORECASE)
-            if in_match:
-                columns.append(in_match.group(1))
-            
-            # Handle BETWEEN conditions
-            between_match = re.search(r'(\w+(?:\.\w+)?)\s+BETWEEN\s+', part, re.IGNORECASE)
-            if between_match:
-                columns.append(between_match.group(1))
-            
-            # Handle LIKE conditions
-            like_match = re.search(r'(\w+(?:\.\w+)?)\s+LIKE\s+', part, re.IGNORECASE)
-            if like_match:
-                columns.append(like_match.group(1))
-            
-            # Handle IS NULL/IS NOT NULL
-            null_match = re.search(r'(\w+(?:\.\w+)?)\s+IS\s+(?:NOT\s+)?NULL', part, re.IGNORECASE)
-            if null_match:
-                columns.append(null_match.group(1))
+        # With WAL the index transaction does not block the other connection,
+        # so the sides can alternate; otherwise they are timed one after another.
+        # The journal mode of the live database is left as the application set it
+        interleaved = baseline_conn is not indexed_conn and self._journal_mode(indexed_conn) == 'wal'
         
-        return columns
-            
-    def _get_indexed_columns(self, table_name):
-        """Get already indexed columns for a table."""
-        try:
-            # If table_name is a tuple (table, alias), use the actual table name
-            if isinstance(table_name, tuple):
-                table_name = table_name[0]
+        # 1. Measure the original queries before taking the write lock
+        originals = []
+        for query in queries:
+            try:
+                originals.append(self._time(baseline_conn.cursor(), query, iterations if not interleaved else 0))
+            except sqlite3.Error as e:
+                logger.error(f"Error executing original query: {e}")
+                originals.append({'error': f"Original query execution failed: {str(e)}", 'success': False})
                 
-            indexed_columns = set()
-            
-            # Get all indexes for the table
-            indexes = self.db_manager.get_table_indexes(table_name)
+        # 2. Create the index in a transaction that is never committed
+        try:
+            indexed_conn.execute("PRAGMA query_only = OFF")
+            indexed_conn.execute("BEGIN")
+            indexed_conn.execute(create_index_statement)
+            indexed_conn.execute("PRAGMA query_only = ON")
+        except sqlite3.Error as e:
+            logger.error(f"Error creating index: {e}")
+            return [{'error': f"Failed to create index: {str(e)}", 'success': False} for _ in queries]
             
-            for index in indexes:
-                index_name = index['name']
-                index_columns = self.db_manager.get_index_columns(index_name)
+        # 3. Measure performance with index
+        results = []
+        for query, original in zip(queries, originals):
+            if 'error' in original:
+                results.append(original)
+                continue
+            try:
+                if interleaved:
+                    samples = self._benchmark(baseline_conn, indexed_conn, query, iterations)
+                else:
+                    samples = {'original': original, 'optimized': self._time(indexed_conn.cursor(), query, iterations)}
+                results.append(self._result(samples, iterations, interleaved))
+            except sqlite3.Error as e:
+                logger.error(f"Error executing query with index: {e}")
+                results.append({'error': f"Query with index failed: {str(e)}", 'success': False})
+        return results
+        
+    @staticmethod
+    def _release(*connections):
+        """Roll back the index transaction and close each distinct connection."""
+        for conn in {id(conn): conn for conn in connections if conn is not None}.values():
+            try:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Error closing comparison connection: {e}")
                 
-                for col in index_columns:
-                    # Get the column position from table schema
-                    table_schema = self.db_manager.get_table_structure(table_name)
-                    if col['seqno'] < len(table_schema):
-                        column_name = table_schema[col['seqno']]['name']
-                        indexed_columns.add(column_name)
-            
-            return indexed_columns
-        except Exception as e:
-            logger.error(f"Error getting indexed columns: {e}")
-            return set()
-            
-    def _score_indexes(self, potential_indexes):
-        """Score potential indexes based on various factors."""
-        if not potential_indexes:
-            return []
-            
-        scores = {}
-        for idx in potential_indexes:
-            # For composite indexes, use a unique key
-            if idx.get('is_composite', False):
-                key = f"{idx['table']}_composite_{idx['column']}"
-            else:
-                key = f"{idx['table']}_{idx['column']}"
-            
-            # Initialize if this is the first time we see this table/column combination
-            if key not in scores:
-                scores[key] = {
-                    'table': idx['table'],
-                    'column': idx['column'],
-                    'score': 0,
-                    'count': 0,
-                    'avg_execution_time': 0,
-                    'total_execution_time': 0,
-                    'is_composite': idx.get('is_composite', False),
-                    'composite_columns': idx.get('composite_columns', [])
+    def _shapes(self, fingerprints=None):
+        """Return the query shapes to benchmark with the tables each one reads.
+
+        Without fingerprints the read shapes with the most total time are used.
+        """
+        if fingerprints:
+            placeholders = ', '.join('?' for _ in fingerprints)
+            rows = self.db_manager.execute_and_fetch(
+                "SELECT fingerprint, sample_query, query_count FROM query_fingerprints "
+                f"WHERE sample_query IS NOT NULL AND fingerprint IN ({placeholders})",
+                tuple(fingerprints)
+            )
+        else:
+            rows = self.db_manager.execute_and_fetch(
+                "SELECT fingerprint, sample_query, query_count FROM query_fingerprints "
+                "WHERE sample_query IS NOT NULL "
+                "AND (ltrim(normalized_query) LIKE 'select%' OR ltrim(normalized_query) LIKE 'with%') "
+                "ORDER BY total_time DESC LIMIT ?",
+                (self.BATCH_WORKLOAD_SIZE,)
+            )
+        shapes = []
+        for row in rows:
+            try:
+                # Aliased tables are listed as (table, alias)
+                tables = {
+                    (entry[0] if isinstance(entry, tuple) else entry).lower()
+                    for entry in self.parser.analyze(row['sample_query'])['tables']
                 }
+            except SQLParseError:
+                tables = set()
+            shapes.append({
+                'fingerprint': row['fingerprint'],
+                'query': row['sample_query'],
+                'count': row['query_count'],
+                'tables': tables
+            })
+        return shapes
+        
+    def compare_batch(self, create_statements, fingerprints=None, iterations=None, workers=None, progress=None):
+        """Compare candidate indexes against query shapes in parallel and return the results matrix.
+
+        Each candidate is one task for a pool of worker processes. A worker
+        builds the index on its own copy of a single snapshot and benchmarks
+        every shape that reads the candidate's table; other cells are left
+        empty, and cells with a stored result are served from the store.
+        progress(done, total) is called as candidates complete.
+        """
+        iterations = max(self.MIN_ITERATIONS, iterations or self.iterations)
+        shapes = self._shapes(fingerprints)
+        matrix = [[None] * len(shapes) for _ in create_statements]
+        cells = {}
+        for i, create_statement in enumerate(create_statements):
+            parsed = WhatIfAnalyzer.parse_create_index(create_statement or '')
+            if parsed is None:
+                matrix[i] = [{'error': 'Invalid CREATE INDEX statement', 'success': False}] * len(shapes)
+                continue
+            for j, shape in enumerate(shapes):
+                if parsed[1].lower() in shape['tables']:
+                    cells[i, j] = shape['tables']
+                    
+        # The database state is read once for every cell of the batch
+        signatures = self.store.signatures(set().union(*cells.values())) if cells else None
+        states = {}
+        tasks = []
+        for i, create_statement in enumerate(create_statements):
+            positions = []
+            for j, shape in enumerate(shapes):
+                if (i, j) not in cells:
+                    continue
+                # Cells measured before in the same database state are not run again
+                states[i, j] = self.store.state(cells[i, j], signatures) if signatures else None
+                matrix[i][j] = self.store.lookup(states[i, j], shape['fingerprint'], create_statement, iterations)
+                if matrix[i][j] is None:
+                    positions.append(j)
+            if positions:
+                tasks.append((i, positions))
                 
-            # Update metrics
-            scores[key]['count'] += 1
-            scores[key]['total_execution_time'] += idx['execution_time']
-            scores[key]['avg_execution_time'] = scores[key]['total_execution_time'] / scores[key]['count']
-            
-            # Scoring: frequency + execution time impact + bonus for composite indexes
-            base_score = (scores[key]['count'] * 0.6) + (scores[key]['avg_execution_time'] * 0.4 * 10)
-            if scores[key]['is_composite']:
-                # Give extra weight to composite indexes with multiple conditions
-                base_score *= (1 + 0.2 * len(scores[key]['composite_columns']))
+        if tasks:
+            workers = min(workers or self.workers or os.cpu_count() or 1, len(tasks))
+            # Worker copies live next to the snapshot and go with it
+            directory = tempfile.mkdtemp(prefix='comparison_', dir=self.snapshot_directory or None)
+            try:
+                snapshot_path = self.create_snapshot(directory)
+                # Spawned workers do not inherit the locks of this process's threads
+                with ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_comparison_worker, initargs=(snapshot_path, directory, iterations)
+                ) as pool:
+                    futures = {
+                        pool.submit(
+                            _run_comparison_task, create_statements[i], [shapes[j]['query'] for j in positions]
+                        ): (i, positions)
+                        for i, positions in tasks
+                    }
+                    for done, future in enumerate(as_completed(futures), 1):
+                        i, positions = futures[future]
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            logger.error(f"Error comparing {create_statements[i]}: {e}")
+                            results = [{'error': str(e), 'success': False}] * len(positions)
+                        for j, result in zip(positions, results):
+                            matrix[i][j] = result
+                            self.store.save(
+                                states[i, j], shapes[j]['fingerprint'], shapes[j]['query'], create_statements[i], result
+                            )
+                        if progress:
+                            progress(done, len(futures))
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
                 
-            scores[key]['score'] = base_score
-        
-        # Convert to list and sort by score
-        recommendations = []
-        for key, data in scores.items():
-            # Generate appropriate index name and statement based on whether it's composite
-            if data['is_composite']:
-                # For composite indexes, use all columns
-                index_name = f"idx_{data['table']}_{'_'.join(data['composite_columns'])}"
-                column_list = ', '.join(data['composite_columns'])
-                create_statement = f"CREATE INDEX {index_name} ON {data['table']} ({column_list})"
-                column_display = ', '.join(data['composite_columns'])
-                index_type = 'COMPOSITE'
-            else:
-                # For regular single-column indexes
-                index_name = f"idx_{data['table']}_{data['column']}"
-                create_statement = f"CREATE INDEX {index_name} ON {data['table']} ({data['column']})"
-                column_display = data['column']
-                index_type = ''
-            
-            # Add to recommendations
-            recommendations.append({
-                'table': data['table'],
-                'column': column_display,
-                'score': round(data['score'], 2),
-                'count': data['count'],
-                'avg_execution_time': round(data['avg_execution_time'], 4),
-                'index_name': index_name,
-                'create_statement': create_statement,
-                'index_type': index_type,
-                'estimated_impact': round(min(data['score'] * 5, 95), 1)  # Capped at 95%
-            })
+        return {
+            'candidates': [self._batch_summary(statement, row, shapes) for statement, row in zip(create_statements, matrix)],
+            'queries': [
+                {'fingerprint': shape['fingerprint'], 'query': shape['query'], 'count': shape['count']}
+                for shape in shapes
+            ],
+            'matrix': matrix,
+            'iterations': iterations
+        }
+        
+    @staticmethod
+    def _batch_summary(create_statement, row, shapes):
+        """Summarize a candidate's row of the results matrix."""
+        verdicts = {'faster': 0, 'slower': 0, 'inconclusive': 0}
+        errors = 0
+        time_saved = 0.0
+        for result, shape in zip(row, shapes):
+            if result is None:
+                continue
+            if not result.get('success'):
+                errors += 1
+                continue
+            verdicts[result['verdict']] += 1
+            # Only differences the benchmark could tell apart count towards the saving
+            if result['conclusive']:
+                time_saved += (result['original_time'] - result['optimized_time']) / 1000 * (shape['count'] or 0)
+        return {
+            'create_statement': create_statement,
+            'evaluated': sum(verdicts.values()),
+            **verdicts,
+            'errors': errors,
+            'estimated_time_saved': round(time_saved, 3)
+        }
+        
+    @staticmethod
+    def _enable_wal(conn):
+        """Switch a snapshot copy to WAL so readers are not blocked by the index transaction."""
+        try:
+            return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0].lower() == 'wal'
+        except sqlite3.Error as e:
+            logger.warning(f"Could not enable WAL mode for the comparison: {e}")
+            return False
+            
+    @staticmethod
+    def _journal_mode(conn):
+        """Return the journal mode of the database a connection is attached to."""
+        return conn.execute("PRAGMA journal_mode").fetchone()[0].lower()
+            
+    @staticmethod
+    def _samples():
+        """Return an empty set of timing samples."""
+        return {'execution_time': [], 'first_row_time': [], 'rows_returned': None}
+        
+    def _record(self, samples, cursor, query):
+        """Time one fully fetched run of a query and add it to the samples."""
+        timing = self.timer.measure(cursor, query, keep_rows=False)
+        samples['execution_time'].append(timing['execution_time'])
+        samples['first_row_time'].append(timing['first_row_time'])
+        samples['rows_returned'] = timing['rows_returned']
+        
+    def _time(self, cursor, query, iterations):
+        """Time a query after the warmup runs and return its samples; no iterations only checks the query."""
+        samples = self._samples()
+        for _ in range(self.WARMUP_RUNS if iterations else 1):
+            self.timer.measure(cursor, query, keep_rows=False)
+        for _ in range(iterations):
+            self._record(samples, cursor, query)
+        return samples
+        
+    def _benchmark(self, baseline_conn, indexed_conn, query, iterations):
+        """Time a query on both connections in alternating order and return the samples of each side."""
+        cursors = {'original': baseline_conn.cursor(), 'optimized': indexed_conn.cursor()}
+        samples = {side: self._samples() for side in cursors}
+        for _ in range(self.WARMUP_RUNS):
+            for cursor in cursors.values():
+                self.timer.measure(cursor, query, keep_rows=False)
+        for i in range(iterations):
+            # ABBA ordering: neither side always runs first
+            order = ('original', 'optimized') if i % 2 == 0 else ('optimized', 'original')
+            for side in order:
+                self._record(samples[side], cursors[side], query)
+        return samples
+        
+    def _summarize(self, times):
+        """Return the median, p95, mean and median confidence interval of timings after dropping outliers."""
+        times = np.asarray(times)
+        q1, q3 = np.percentile(times, [25, 75])
+        fence = self.OUTLIER_FENCE * (q3 - q1)
+        kept = times[(times >= q1 - fence) & (times <= q3 + fence)]
+        # The bootstrap distribution of the median gives its confidence interval
+        medians = np.median(self._rng.choice(kept, size=(self.BOOTSTRAP_RESAMPLES, len(kept))), axis=1)
+        tail = (1 - self.CONFIDENCE) / 2 * 100
+        low, high = np.percentile(medians, [tail, 100 - tail])
+        return {
+            'median': round(float(np.median(kept)) * 1000, 3),
+            'p95': round(float(np.percentile(kept, 95)) * 1000, 3),
+            'mean': round(float(kept.mean()) * 1000, 3),
+            'ci_low': round(float(low) * 1000, 3),
+            'ci_high': round(float(high) * 1000, 3),
+            'samples': len(times),
+            'outliers': len(times) - len(kept)
+        }
+        
+    def _result(self, samples, iterations, interleaved):
+        """Build the comparison result from the samples of both sides."""
+        original = self._summarize(samples['original']['execution_time'])
+        optimized = self._summarize(samples['optimized']['execution_time'])
+        original_time, optimized_time = original['median'], optimized['median']
+        
+        # Calculate improvement
+        if original_time > 0:
+            improvement = ((original_time - optimized_time) / original_time) * 100
+        else:
+            improvement = 0
             
-        # Sort by score (descending)
-        return sorted(recommendations, key=lambda x: x['score'], reverse=True)
+        conclusive = optimized['ci_high'] < original['ci_low'] or optimized['ci_low'] > original['ci_high']
+        if not conclusive:
+            verdict = 'inconclusive'
+        else:
+            verdict = 'faster' if optimized_time < original_time else 'slower'
+        return {
+            'original_time': round(original_time, 2),  # Median in ms
+            'optimized_time': round(optimized_time, 2),  # Median in ms
+            'improvement': round(improvement, 2),
+            'original_first_row_time': round(float(np.median(samples['original']['first_row_time'])) * 1000, 2),
+            'optimized_first_row_time': round(float(np.median(samples['optimized']['first_row_time'])) * 1000, 2),
+            'rows_returned': samples['optimized']['rows_returned'],
+            'original': original,
+            'optimized': optimized,
+            'iterations': iterations,
+            'warmup_runs': self.WARMUP_RUNS,
+            'interleaved': interleaved,
+            'confidence': self.CONFIDENCE,
+            'conclusive': conclusive,
+            'verdict': verdict,
+            'cached': False,
+            'success': True
+        }
 
 
-class PerformanceComparer:
-    """Compares query performance with and without indexes."""
+# State of a batch comparison worker process, set up by its initializer
+_comparison_worker = {}
+
+
+def _init_comparison_worker(snapshot_path, directory, iterations):
+    """Give a batch comparison worker process its own copy of the snapshot."""
+    path = PerformanceComparer(DatabaseManager(snapshot_path)).create_snapshot(directory)
+    _comparison_worker['comparer'] = PerformanceComparer(DatabaseManager(path))
+    _comparison_worker['iterations'] = iterations
+
+
+def _run_comparison_task(create_statement, queries):
+    """Benchmark queries with and without one candidate index on this worker's copy."""
+    comparer = _comparison_worker['comparer']
+    baseline_conn = indexed_conn = None
+    try:
+        baseline_conn, indexed_conn = comparer._connect(), comparer._connect()
+        return comparer._compare(baseline_conn, indexed_conn, queries, create_statement, _comparison_worker['iterations'])
+    finally:
+        comparer._release(indexed_conn, baseline_conn)
+
+
+class WorkloadReplayer:
+    """Replays a sample of the captured workload with and without a set of indexes.
+
+    Statements are drawn from the query shapes in proportion to their
+    executions. Logged instances of each shape are used, so repeated
+    writes carry their varied literals. The sample is replayed in the same
+    order on two copies of one snapshot, one as it is and one with the
+    index set. Each statement is timed on both copies in alternating order
+    inside one transaction per copy, so later statements see the writes of
+    earlier ones. Reads show what the indexes save, writes what
+    maintaining them costs.
+    """
     
-    def __init__(self, db_manager):
-        """Initialize with a database manager."""
+    SAMPLE_SIZE = 500
+    # Logged instances kept per shape, and logged rows read to find them
+    INSTANCES_PER_SHAPE = 20
+    LOG_SCAN_LIMIT = 20000
+    MAX_REPORTED_DIVERGENCES = 10
+    
+    def __init__(self, db_manager, config_manager=None, comparer=None):
+        """Initialize with a database manager, optional configuration manager and comparer."""
         self.db_manager = db_manager
+        self.sample_size = self.SAMPLE_SIZE
+        if config_manager:
+            self.sample_size = int(config_manager.get('ANALYSIS', 'replay_sample_size', self.sample_size))
+        self.comparer = comparer or PerformanceComparer(db_manager, config_manager)
+        self.parser = SQLParser()
+        self._rng = np.random.default_rng()
         
-    def compare_with_index(self, query, create_index_statement):
-        """Compare query performance with and without an index."""
+    def _kind(self, query):
+        """Return 'read' or 'write' for a statement, or None if it is neither."""
         try:
-            # Sanitize the query to ensure it's properly formatted for SQLite
-            query = query.strip()
-            
-            # 1. Measure original performance
-            start_time = time.time()
-            try:
-                self.db_manager.execute(query)
-                end_time = time.time()
-                original_time = end_time - start_time
-            except sqlite3.Error as e:
-                logger.error(f"Error executing original query: {e}")
-                return {'error': f"Original query execution failed: {str(e)}", 'success': False}
-            
-            # Extract index name for later removal
-            index_name_match = re.search(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(\w+)", create_index_statement, re.IGNORECASE)
-            if not index_name_match:
-                return {'error': 'Invalid CREATE INDEX statement'}
-                
-            index_name = index_name_match.group(1)
+            # A WITH clause may lead into a write as well as a read
+            statement = self.parser.analyze(query)['statement']
+        except SQLParseError:
+            return None
+        if statement == 'select':
+            return 'read'
+        if statement in ('insert', 'update', 'delete'):
+            return 'write'
+        return None
+        
+    def _instances(self, fingerprints):
+        """Return {fingerprint: [logged queries]} from the newest log partitions."""
+        instances = {}
+        scanned = 0
+        for key in self.db_manager.log_store.partitions(newest_first=True):
+            conn = self.db_manager.log_store.connection(key)
+            if conn is None:
+                continue
+            for fingerprint, query in conn.execute(
+                "SELECT fingerprint, query FROM query_logs ORDER BY id DESC LIMIT ?", (self.LOG_SCAN_LIMIT - scanned,)
+            ):
+                scanned += 1
+                if fingerprint in fingerprints:
+                    pool = instances.setdefault(fingerprint, [])
+                    if len(pool) < self.INSTANCES_PER_SHAPE:
+                        pool.append(query)
+            if scanned >= self.LOG_SCAN_LIMIT:
+                break
+        return instances
+        
+    def _sample(self, size):
+        """Draw a sample of statements from the captured shapes, weighted by their executions."""
+        shapes = []
+        for row in self.db_manager.execute_and_fetch(
+            "SELECT fingerprint, normalized_query, sample_query, query_count FROM query_fingerprints "
+            "WHERE query_count > 0 AND sample_query IS NOT NULL"
+        ):
+            kind = self._kind(row['sample_query'])
+            if kind is not None:
+                shapes.append(dict(row, kind=kind))
+        if not shapes:
+            return [], 0
             
-            # 2. Create the index
+        counts = np.array([shape['query_count'] for shape in shapes], dtype=float)
+        instances = self._instances({shape['fingerprint'] for shape in shapes})
+        used = {}
+        statements = []
+        for k in self._rng.choice(len(shapes), size=size, p=counts / counts.sum()):
+            shape = shapes[k]
+            pool = instances.get(shape['fingerprint']) or [shape['sample_query']]
+            # Cycle through the logged instances so repeated writes differ
+            position = used.get(shape['fingerprint'], 0)
+            used[shape['fingerprint']] = position + 1
+            query = pool[position % len(pool)]
             try:
-                self.db_manager.execute(create_index_statement)
-            except sqlite3.Error as e:
-                logger.error(f"Error creating index: {e}")
-                return {'error': f"Failed to create index: {str(e)}", 'success': False}
+                table = self.parser.analyze(query)['target_table']
+            except SQLParseError:
+                table = None
+            statements.append({'fingerprint': shape['fingerprint'], 'query': query, 'kind': shape['kind'], 'table': table})
+        return statements, int(counts.sum())
+        
+    def replay(self, create_statements, sample_size=None):
+        """Replay a workload sample without and with an index set and report the net effect."""
+        statements, executions = self._sample(sample_size or self.sample_size)
+        if not statements:
+            return {'error': 'No captured workload to replay', 'success': False}
             
-            try:
-                # 3. Measure performance with index
-                start_time = time.time()
-                self.db_manager.execute(query)
-                end_time = time.time()
-                optimized_time = end_time - start_time
-                
-                # Calculate improvement
-                if original_time > 0:
-                    improvement = ((original_time - optimized_time) / original_time) * 100
-                else:
-                    improvement = 0
+        directory = tempfile.mkdtemp(prefix='replay_', dir=self.comparer.snapshot_directory or None)
+        baseline_conn = indexed_conn = None
+        try:
+            baseline_path = self.comparer.create_snapshot(directory)
+            indexed_path = self.comparer.create_snapshot(directory, source=baseline_path)
+            baseline_conn, indexed_conn = self.comparer._connect(baseline_path), self.comparer._connect(indexed_path)
+            for create_statement in create_statements:
+                try:
+                    indexed_conn.execute(create_statement)
+                except sqlite3.Error as e:
+                    logger.error(f"Error creating index for replay: {e}")
+                    return {'error': f"Failed to create index: {str(e)}", 'success': False}
                     
-                result = {
-                    'original_time': round(original_time * 1000, 2),  # Convert to ms
-                    'optimized_time': round(optimized_time * 1000, 2),  # Convert to ms
-                    'improvement': round(improvement, 2),
-                    'success': True
-                }
-            except sqlite3.Error as e:
-                logger.error(f"Error executing query with index: {e}")
-                result = {'error': f"Query with index failed: {str(e)}", 'success': False}
-            finally:
-                # 4. Drop the index to restore original state
+            # Warm both page caches with the reads before anything is timed
+            for query in {statement['query'] for statement in statements if statement['kind'] == 'read'}:
+                for conn in (baseline_conn, indexed_conn):
+                    try:
+                        self.comparer.timer.measure(conn.cursor(), query, keep_rows=False)
+                    except sqlite3.Error:
+                        pass
+            for conn in (baseline_conn, indexed_conn):
+                conn.execute("BEGIN")
+            timings = self._run(baseline_conn, indexed_conn, statements)
+            return self._report(create_statements, statements, timings, executions)
+        except sqlite3.Error as e:
+            logger.error(f"Error replaying workload: {e}")
+            return {'error': str(e), 'success': False}
+        finally:
+            # Rolling back discards the replayed writes along with the copies
+            self.comparer._release(indexed_conn, baseline_conn)
+            shutil.rmtree(directory, ignore_errors=True)
+            
+    def _run(self, baseline_conn, indexed_conn, statements):
+        """Time every statement on both copies and return [(times, errors)] per statement."""
+        connections = (baseline_conn, indexed_conn)
+        timings = []
+        for i, statement in enumerate(statements):
+            times = [None, None]
+            errors = [None, None]
+            # ABBA ordering: neither copy always runs first
+            for side in ((0, 1) if i % 2 == 0 else (1, 0)):
                 try:
-                    self.db_manager.execute(f"DROP INDEX IF EXISTS {index_name}")
+                    times[side] = self.comparer.timer.measure(
+                        connections[side].cursor(), statement['query'], keep_rows=False
+                    )['execution_time']
                 except sqlite3.Error as e:
-                    logger.warning(f"Error dropping index: {e}")
+                    errors[side] = str(e)
+            timings.append((times, errors))
+        return timings
+        
+    def _report(self, create_statements, statements, timings, executions):
+        """Aggregate the replay timings into read savings, write costs and throughput."""
+        totals = {'read': [0.0, 0.0], 'write': [0.0, 0.0]}
+        counts = {'read': 0, 'write': 0}
+        tables = {}
+        errors = 0
+        divergences = []
+        for statement, (times, side_errors) in zip(statements, timings):
+            if any(side_errors):
+                # A statement failing on one copy only means the indexes changed its outcome
+                if not all(side_errors):
+                    divergences.append({
+                        'query': statement['query'],
+                        'baseline_error': side_errors[0],
+                        'indexed_error': side_errors[1]
+                    })
+                errors += 1
+                continue
+            kind = statement['kind']
+            counts[kind] += 1
+            totals[kind][0] += times[0]
+            totals[kind][1] += times[1]
+            if kind == 'write' and statement['table']:
+                table = tables.setdefault(statement['table'], {'writes': 0, 'write_time_added': 0.0})
+                table['writes'] += 1
+                table['write_time_added'] += times[1] - times[0]
                 
-            return result
-        except Exception as e:
-            logger.error(f"Error comparing performance: {e}")
-            return {'error': str(e), 'success': False}
+        read_saved = totals['read'][0] - totals['read'][1]
+        write_added = totals['write'][1] - totals['write'][0]
+        replayed = counts['read'] + counts['write']
+        baseline_time = totals['read'][0] + totals['write'][0]
+        indexed_time = totals['read'][1] + totals['write'][1]
+        return {
+            'index_set': list(create_statements),
+            'statements': len(statements),
+            'reads': counts['read'],
+            'writes': counts['write'],
+            'errors': errors,
+            'divergences': divergences[:self.MAX_REPORTED_DIVERGENCES],
+            'read_time': {'baseline': round(totals['read'][0], 6), 'indexed': round(totals['read'][1], 6)},
+            'write_time': {'baseline': round(totals['write'][0], 6), 'indexed': round(totals['write'][1], 6)},
+            'read_time_saved': round(read_saved, 6),
+            'write_time_added': round(write_added, 6),
+            'net_time_saved': round(read_saved - write_added, 6),
+            'throughput': {
+                'baseline': round(replayed / baseline_time, 1) if baseline_time else None,
+                'indexed': round(replayed / indexed_time, 1) if indexed_time else None,
+                'change_percent': round((baseline_time / indexed_time - 1) * 100, 2) if indexed_time else None
+            },
+            # The sample stands for every captured execution
+            'projected_net_time_saved': round((read_saved - write_added) * executions / replayed, 3) if replayed else 0.0,
+            'tables': {
+                name: {'writes': table['writes'], 'write_time_added': round(table['write_time_added'], 6)}
+                for name, table in sorted(tables.items())
+            },
+            'success': True
+        }
 
 
 class ConfigManager:
@@ -740,7 +5688,24 @@ class ConfigManager:
             self.config['ANALYSIS'] = {
                 'min_index_score': '2',
                 'consider_query_frequency': 'true',
-                'log_retention_days': '30'
+                'log_retention_days': '30',
+                'comparison_iterations': '3',
+                'comparison_mode': 'snapshot',
+                'snapshot_directory': '',
+                'comparison_workers': '0',
+                'replay_sample_size': '500',
+                'recency_half_life_days': '7',
+                'index_budget_mb': '1024',
+                'table_index_budget_mb': '256',
+                'unused_index_days': '90'
+            }
+            
+            self.config['MONITORING'] = {
+                'capture_mode': 'direct',
+                'batch_size': '500',
+                'flush_interval': '1.0',
+                'sample_rate': '1.0',
+                'slow_query_threshold': '1.0'
             }
             
             self.save()
@@ -774,76 +5739,98 @@ class DataVisualizer:
         self.db_manager = db_manager
         self.config_manager = config_manager
         
+    # period -> (rollup granularity, window, label format)
+    PERIODS = {
+        'realtime': ('minute', timedelta(hours=1), '%H:%M'),
+        'hourly': ('hour', timedelta(days=1), '%Y-%m-%d %H:00'),
+        'daily': ('day', timedelta(days=7), '%Y-%m-%d'),
+        'weekly': ('day', timedelta(days=28), '%Y-W%W'),
+        'monthly': ('day', timedelta(days=180), '%Y-%m')
+    }
+    
+    def _get_rollups(self, period):
+        """Merge the rollup rows of a period's window into one entry per chart interval."""
+        granularity, window, format_str = self.PERIODS[period]
+        start = QueryLogWriter.bucket_start((datetime.utcnow() - window).strftime('%Y-%m-%d %H:%M:%S'), granularity)
+        rows = self.db_manager.execute_and_fetch(
+            """
+            SELECT bucket_start, query_count, total_time, min_time, max_time, sketch
+            FROM query_rollups
+            WHERE granularity = ? AND bucket_start >= ?
+            ORDER BY bucket_start
+            """,
+            (granularity, start)
+        )
+        
+        data = {}
+        for row in rows:
+            interval_key = datetime.strptime(row['bucket_start'], '%Y-%m-%d %H:%M:%S').strftime(format_str)
+            entry = data.get(interval_key)
+            if entry is None:
+                data[interval_key] = {
+                    'count': row['query_count'],
+                    'total_time': row['total_time'],
+                    'min_time': row['min_time'],
+                    'max_time': row['max_time'],
+                    'sketch': LatencySketch.from_json(row['sketch'])
+                }
+            else:
+                entry['count'] += row['query_count']
+                entry['total_time'] += row['total_time']
+                entry['min_time'] = min(entry['min_time'], row['min_time'])
+                entry['max_time'] = max(entry['max_time'], row['max_time'])
+                entry['sketch'].merge(LatencySketch.from_json(row['sketch']))
+        return data
+        
     def get_query_performance_data(self, period='daily'):
-        """Get query performance data for visualizations."""
+        """Get query performance data for visualizations from the time-bucket rollups."""
         try:
-            if period == 'daily':
-                # Data for the last 7 days
-                days = 7
-                interval = 'day'
-                format_str = '%Y-%m-%d'
-            elif period == 'weekly':
-                # Data for the last 4 weeks
-                days = 28
-                interval = 'week'
-                format_str = '%Y-W%W'
-            elif period == 'monthly':
-                # Data for the last 6 months
-                days = 180
-                interval = 'month'
-                format_str = '%Y-%m'
-            else:
+            if period not in self.PERIODS:
                 return {'error': 'Invalid period'}
                 
-            # Calculate date ranges
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
-            
-            # Get query logs within the date range
-            logs = self.db_manager.execute_and_fetch(
-                "SELECT * FROM query_logs WHERE timestamp >= ? ORDER BY timestamp",
-                (start_date.strftime('%Y-%m-%d'),)
-            )
+            data = self._get_rollups(period)
             
-            # Group by interval
-            data = {}
-            for log in logs:
-                timestamp = datetime.strptime(log['timestamp'], '%Y-%m-%d %H:%M:%S')
-                interval_key = timestamp.strftime(format_str)
-                
-                if interval_key not in data:
-                    data[interval_key] = {
-                        'count': 0,
-                        'total_time': 0,
-                        'avg_time': 0
-                    }
-                    
-                data[interval_key]['count'] += 1
-                data[interval_key]['total_time'] += log['execution_time']
-                data[interval_key]['avg_time'] = data[interval_key]['total_time'] / data[interval_key]['count']
-                
             # Format for charts
             labels = list(data.keys())
-            values = [round(data[label]['avg_time'] * 1000, 2) for label in labels]  # Convert to ms
+            values = [round(data[label]['total_time'] / data[label]['count'] * 1000, 2) for label in labels]  # Convert to ms
             
             return {
                 'labels': labels,
-                'values': values
+                'values': values,
+                'counts': [data[label]['count'] for label in labels]
             }
         except Exception as e:
             logger.error(f"Error getting query performance data: {e}")
             return {'error': str(e)}
             
+    def get_latency_percentile_data(self, period='daily'):
+        """Get p50/p95/p99 latency series from the sketches stored with the rollups."""
+        try:
+            if period not in self.PERIODS:
+                return {'error': 'Invalid period'}
+                
+            data = self._get_rollups(period)
+            labels = list(data.keys())
+            result = {'labels': labels}
+            for name in ('p50', 'p95', 'p99'):
+                q = int(name[1:]) / 100.0
+                result[name] = [round(data[label]['sketch'].quantile(q) * 1000, 2) for label in labels]  # Convert to ms
+            return result
+        except Exception as e:
+            logger.error(f"Error getting latency percentile data: {e}")
+            return {'error': str(e)}
+            
     def get_index_impact_data(self):
         """Get data showing the impact of indexes."""
         try:
-            # Get performance comparison data
+            # Get the latest stored performance comparisons
             comparisons = self.db_manager.execute_and_fetch(
                 """
-                SELECT pc.*, ir.table_name, ir.column_name, ir.index_name
-                FROM performance_comparisons pc
-                JOIN index_recommendations ir ON pc.index_id = ir.id
-                ORDER BY pc.timestamp DESC
+                SELECT table_name, columns, index_name, index_definition, query, verdict,
+                       original_time, optimized_time, improvement_percent, timestamp
+                FROM performance_comparisons
+                WHERE index_definition IS NOT NULL
+                ORDER BY timestamp DESC
                 LIMIT 20
                 """
             )
@@ -852,11 +5839,15 @@ class DataVisualizer:
             for comp in comparisons:
                 result.append({
                     'table': comp['table_name'],
-                    'column': comp['column_name'],
+                    'column': comp['columns'],
                     'index_name': comp['index_name'],
+                    'index_definition': comp['index_definition'],
+                    'query': comp['query'],
                     'original_time': round(comp['original_time'] * 1000, 2),  # Convert to ms
                     'optimized_time': round(comp['optimized_time'] * 1000, 2),  # Convert to ms
-                    'improvement_percent': round(comp['improvement_percent'], 2)
+                    'improvement_percent': round(comp['improvement_percent'], 2),
+                    'verdict': comp['verdict'],
+                    'timestamp': comp['timestamp']
                 })
                 
             return result
@@ -889,7 +5880,7 @@ class SampleDataGenerator:
                 self._insert_sample_orders()
                 
             # Generate some sample queries
-            if self.db_manager.get_row_count('query_logs') == 0:
+            if self.db_manager.log_store.count() == 0:
                 self._generate_sample_queries()
                 
             self.db_manager.commit()
@@ -1042,16 +6033,21 @@ class SampleDataGenerator:
         ]
         
         # Generate query logs with mock execution times and plans
+        logs = []
         for query in queries:
             execution_time = random.uniform(0.01, 2.0)
-            execution_plan = f"QUERY PLAN\n{'=' * 40}\nMOCK EXECUTION PLAN FOR: {query}\n"
+            table = re.search(r'FROM\s+(\w+)', query, re.IGNORECASE).group(1)
             
+            # Mock plans use the 'id|parent|notused|detail' format of captured plans
             if "WHERE" in query and random.random() < 0.7:
-                execution_plan += "SCAN TABLE users\nSCAN TABLE products\n"
+                execution_plan = f"2|0|0|SCAN {table}"
             else:
-                execution_plan += "SEARCH TABLE users USING INDEX idx_username\nSEARCH TABLE products USING INDEX idx_category\n"
+                execution_plan = f"3|0|0|SEARCH {table} USING INDEX idx_{table}_lookup (?=?)"
                 
-            self.db_manager.execute(
-                "INSERT INTO query_logs (query, execution_time, execution_plan, timestamp) VALUES (?, ?, ?, ?)",
-                (query, execution_time, execution_plan, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            )
\ No newline at end of file
+            logs.append({
+                'query': query,
+                'execution_time': execution_time,
+                'execution_plan': execution_plan,
+                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
+        self.db_manager.log_store.insert(logs)
\ No newline at end of file
@@ -0,0 +1,41 @@
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+# Keep test runs out of the application's log file
+for handler in [h for h in logging.getLogger().handlers if isinstance(h, logging.FileHandler)]:
+    logging.getLogger().removeHandler(handler)
+    handler.close()
+
+
+@pytest.fixture
+def config_manager(tmp_path):
+    """A configuration with the built-in defaults, stored in the test directory."""
+    return main.ConfigManager(str(tmp_path / 'config.ini'))
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    """A connected database with the tool's tables and a small application table."""
+    manager = main.DatabaseManager(str(tmp_path / 'test.db'))
+    manager.connect()
+    manager.setup_tables()
+    manager.conn.executescript(
+        """
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, username TEXT, email TEXT, status TEXT, created_at TEXT);
+        INSERT INTO users (username, email, status, created_at)
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 200)
+        SELECT 'user' || i, 'user' || i || '@example.com', CASE i % 4 WHEN 0 THEN 'inactive' ELSE 'active' END,
+               '2024-01-' || printf('%02d', i % 28 + 1)
+        FROM n;
+        """
+    )
+    yield manager
+    manager.log_store.close()
+    manager.conn.close()
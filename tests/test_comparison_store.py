@@ -0,0 +1,87 @@
+import pytest
+
+import main
+
+QUERY = "SELECT * FROM users WHERE status = 'inactive'"
+CREATE_INDEX = "CREATE INDEX idx_users_status ON users (status)"
+
+
+@pytest.fixture
+def comparer(db_manager, config_manager):
+    config_manager.set('ANALYSIS', 'comparison_mode', 'memory')
+    db_manager.conn.execute("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, user_id INTEGER, amount REAL)")
+    db_manager.commit()
+    return main.PerformanceComparer(db_manager, config_manager)
+
+
+def test_repeat_is_served_from_the_store(comparer):
+    first = comparer.compare_with_index(QUERY, CREATE_INDEX)
+    second = comparer.compare_with_index(QUERY, CREATE_INDEX.replace('idx_users_status', 'idx_other_name'))
+
+    assert first['success'] and first['cached'] is False
+    assert second['cached'] is True
+    assert second['original_time'] == first['original_time']
+
+
+def test_metadata_and_unrelated_writes_keep_the_stored_result(comparer, db_manager, config_manager):
+    comparer.compare_with_index(QUERY, CREATE_INDEX)
+
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    monitor.capture("SELECT COUNT(*) FROM users")
+    monitor.close()
+    db_manager.conn.execute("INSERT INTO orders (user_id, amount) VALUES (1, 9.5)")
+    db_manager.commit()
+
+    assert comparer.compare_with_index(QUERY, CREATE_INDEX)['cached'] is True
+
+
+@pytest.mark.parametrize('change', [
+    "INSERT INTO users (username, status) VALUES ('new', 'inactive')",
+    "CREATE INDEX idx_users_email ON users (email)",
+])
+def test_changes_to_the_compared_table_or_schema_miss(comparer, db_manager, change):
+    comparer.compare_with_index(QUERY, CREATE_INDEX)
+
+    db_manager.conn.execute(change)
+    db_manager.commit()
+
+    assert comparer.compare_with_index(QUERY, CREATE_INDEX)['cached'] is False
+
+
+@pytest.mark.parametrize('change', [
+    "UPDATE users SET status = 'active' WHERE user_id = 4",
+    "DELETE FROM users WHERE user_id = 5",
+    "WITH doomed AS (SELECT 6 AS user_id) DELETE FROM users WHERE user_id IN (SELECT user_id FROM doomed)",
+])
+def test_captured_writes_to_the_compared_table_miss(comparer, db_manager, config_manager, change):
+    comparer.compare_with_index(QUERY, CREATE_INDEX)
+
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    monitor.capture(change)
+    monitor.close()
+
+    assert comparer.compare_with_index(QUERY, CREATE_INDEX)['cached'] is False
+
+
+def test_batch_reads_the_database_state_once(comparer, db_manager, config_manager, monkeypatch):
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    for i in range(3):
+        monitor.capture(f"SELECT * FROM users WHERE status = 'inactive' AND user_id > {i}")
+        monitor.capture(f"SELECT * FROM users WHERE email = 'user{i}@example.com'")
+    monitor.close()
+    calls = []
+    signatures = comparer.store.signatures
+    monkeypatch.setattr(comparer.store, 'signatures', lambda tables: calls.append(tables) or signatures(tables))
+
+    result = comparer.compare_batch([CREATE_INDEX, "CREATE INDEX idx_users_email ON users (email)"], workers=1)
+
+    assert len(calls) == 1
+    assert all(cell is not None for row in result['matrix'] for cell in row)
+
+
+def test_refresh_and_more_iterations_measure_again(comparer):
+    comparer.compare_with_index(QUERY, CREATE_INDEX)
+
+    assert comparer.compare_with_index(QUERY, CREATE_INDEX, refresh=True)['cached'] is False
+    assert comparer.compare_with_index(QUERY, CREATE_INDEX, iterations=5)['cached'] is False
+    assert comparer.compare_with_index(QUERY, CREATE_INDEX, iterations=4)['cached'] is True
@@ -0,0 +1,73 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def fingerprinter():
+    return main.QueryFingerprinter()
+
+
+@pytest.mark.parametrize('variants', [
+    [
+        "SELECT * FROM users WHERE user_id = 1",
+        "select *  from USERS where user_id=42;",
+        "SELECT * FROM users -- lookup\nWHERE user_id = -7",
+        "SELECT * FROM users /* by id */ WHERE user_id = 0x1F",
+    ],
+    [
+        "SELECT name FROM products WHERE category IN ('a')",
+        "SELECT name FROM products WHERE category IN ('a', 'b', 'c')",
+    ],
+    [
+        "INSERT INTO orders (user_id, total) VALUES (?, ?)",
+        "INSERT INTO orders (user_id, total) VALUES (1, 2.5), (2, 3.5)",
+        "INSERT INTO orders (user_id, total) VALUES (?, ?), (?, ?), (?, ?)",
+    ],
+    [
+        "SELECT * FROM users WHERE username = 'it''s -- not a comment'",
+        "SELECT * FROM users WHERE username = 'bob'",
+    ],
+])
+def test_queries_differing_in_parameters_share_a_fingerprint(fingerprinter, variants):
+    assert len({fingerprinter.fingerprint(query) for query in variants}) == 1
+
+
+def test_normalized_shape_is_stable(fingerprinter):
+    fingerprint, normalized = fingerprinter.fingerprint(
+        "INSERT INTO orders (user_id, total) VALUES (1, 2.5), (2, 3.5)"
+    )
+
+    assert normalized == "insert into orders (user_id, total) values (?, ?)"
+    assert fingerprint == main.hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def test_different_shapes_get_different_fingerprints(fingerprinter):
+    queries = [
+        "SELECT * FROM users WHERE user_id = 1",
+        "SELECT * FROM users WHERE username = 'x'",
+        "SELECT * FROM users WHERE user_id > 1",
+        "INSERT INTO orders (user_id) VALUES (1)",
+        "SELECT \"user_id\" FROM users",
+        "SELECT 'user_id' FROM users",
+    ]
+
+    assert len({fingerprinter.fingerprint(query)[0] for query in queries}) == len(queries)
+
+
+def without_values(analysis):
+    return dict(analysis, predicates=[
+        {key: value for key, value in predicate.items() if key != 'value'} for predicate in analysis['predicates']
+    ])
+
+
+def test_analyze_agrees_across_a_shape(fingerprinter):
+    # The recommender parses one query per fingerprint, so every query of a shape must analyze alike
+    queries = [
+        "SELECT u.username FROM users u WHERE u.status = 'active' AND u.user_id IN (1, 2, 3)",
+        "select u.username from users u where u.status='inactive' and u.user_id in (9)",
+    ]
+    parser = main.SQLParser()
+
+    assert len({fingerprinter.fingerprint(query)[0] for query in queries}) == 1
+    assert without_values(parser.analyze(queries[0])) == without_values(parser.analyze(queries[1]))
@@ -0,0 +1,37 @@
+import main
+
+
+def audit_after_capture(db_manager, config_manager):
+    db_manager.conn.execute("CREATE INDEX idx_users_email ON users (email)")
+    db_manager.conn.execute("CREATE INDEX idx_users_status ON users (status)")
+    db_manager.commit()
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    monitor.capture("SELECT * FROM users WHERE status = 'inactive'")
+    monitor.close()
+    return main.IndexAuditor(db_manager)
+
+
+def test_short_observation_is_provisional_without_drop_statements(db_manager, config_manager):
+    auditor = audit_after_capture(db_manager, config_manager)
+
+    report = auditor.audit(unused_days=30)
+
+    assert report['provisional'] is True
+    assert report['captured_plans'] == 1
+    assert [entry['index_name'] for entry in report['unused']] == ['idx_users_email']
+    assert report['unused'][0]['drop_statement'] is None
+
+
+def test_unused_index_is_droppable_after_a_full_window(db_manager, config_manager):
+    auditor = audit_after_capture(db_manager, config_manager)
+    db_manager.conn.execute(
+        "UPDATE execution_plans SET created_at = datetime('now', '-40 days'), use_count = ?",
+        (main.IndexAuditor.MIN_CAPTURED_PLANS,)
+    )
+    db_manager.commit()
+
+    report = auditor.audit(unused_days=30)
+
+    assert report['provisional'] is False
+    assert [entry['index_name'] for entry in report['unused']] == ['idx_users_email']
+    assert report['unused'][0]['drop_statement'] == 'DROP INDEX "idx_users_email"'
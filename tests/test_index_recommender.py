@@ -0,0 +1,78 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def recommender(db_manager, config_manager):
+    db_manager.conn.executescript(
+        """
+        CREATE TABLE orders (order_id INTEGER PRIMARY KEY, user_id INTEGER, status TEXT, total REAL);
+        INSERT INTO orders (user_id, status, total)
+        SELECT user_id, CASE user_id % 3 WHEN 0 THEN 'shipped' ELSE 'pending' END, user_id * 1.5 FROM users;
+        """
+    )
+    return main.IndexRecommender(db_manager, config_manager)
+
+
+def order_columns(recommender, query, table_name):
+    parsed = recommender._parse_query(query)
+    columns = recommender._indexable_columns(parsed)
+    return recommender._order_columns(parsed, table_name, columns[table_name])
+
+
+def test_points_by_selectivity_then_range_then_sort(recommender):
+    columns, descending = order_columns(
+        recommender,
+        "SELECT * FROM users WHERE status = 'active' AND created_at > '2024-01-10' "
+        "AND username = 'user5' ORDER BY email DESC",
+        'users'
+    )
+
+    assert columns == ['username', 'status', 'created_at', 'email']
+    # A uniformly descending sort is served by scanning the index backwards
+    assert descending == [False, False, False, False]
+
+
+def test_mixed_sort_directions_are_kept(recommender):
+    columns, descending = order_columns(
+        recommender, "SELECT * FROM users WHERE status = 'active' ORDER BY created_at DESC, email", 'users'
+    )
+
+    assert columns == ['status', 'created_at', 'email']
+    assert descending == [False, True, False]
+
+
+def test_rowid_alias_is_left_out(recommender):
+    columns, _ = order_columns(
+        recommender,
+        "SELECT u.username FROM orders o JOIN users u ON u.user_id = o.user_id "
+        "WHERE u.status = 'inactive' ORDER BY u.user_id",
+        'users'
+    )
+
+    assert columns == ['status']
+
+
+def test_rowid_alias_as_only_point_column_gives_no_candidate(recommender):
+    columns, descending = order_columns(
+        recommender,
+        "SELECT u.username FROM orders o JOIN users u ON u.user_id = o.user_id "
+        "WHERE o.status = 'shipped' ORDER BY u.username",
+        'users'
+    )
+
+    assert (columns, descending) == ([], [])
+
+
+def test_non_leading_composite_column_still_gets_a_candidate(recommender, db_manager, config_manager):
+    db_manager.conn.execute("CREATE INDEX idx_users_status_email ON users (status, email)")
+    db_manager.commit()
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    for i in range(30):
+        monitor.capture(f"SELECT * FROM users WHERE email = 'user{i}@example.com'")
+    monitor.close()
+
+    recommendations = recommender.analyze(limit=10)
+
+    assert 'idx_users_email' in [recommendation['index_name'] for recommendation in recommendations]
@@ -0,0 +1,60 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def workload(db_manager, config_manager):
+    db_manager.conn.executescript(
+        """
+        INSERT INTO users (username, email, status, created_at)
+        WITH RECURSIVE n(i) AS (SELECT 201 UNION ALL SELECT i + 1 FROM n WHERE i < 2000)
+        SELECT 'user' || i, 'user' || i || '@example.com', CASE i % 4 WHEN 0 THEN 'inactive' ELSE 'active' END,
+               '2024-01-' || printf('%02d', i % 28 + 1)
+        FROM n;
+        """
+    )
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    for i in range(30):
+        monitor.capture(f"SELECT * FROM users WHERE username = 'user{i}'")
+        monitor.capture(f"SELECT * FROM users WHERE email = 'user{i}@example.com'")
+        monitor.capture(f"SELECT * FROM users WHERE created_at = '2024-01-0{i % 9 + 1}'")
+    monitor.close()
+    return config_manager
+
+
+def recommend(db_manager, config_manager, **budgets):
+    for key, value in budgets.items():
+        config_manager.set('ANALYSIS', key, value)
+    return main.IndexRecommender(db_manager, config_manager).analyze(limit=10)
+
+
+def total_size(recommendations):
+    return sum(recommendation['estimated_size_mb'] for recommendation in recommendations)
+
+
+def test_unconstrained_selection_covers_each_lookup(db_manager, workload):
+    recommendations = recommend(db_manager, workload)
+
+    assert {recommendation['index_name'] for recommendation in recommendations} == {
+        'idx_users_username', 'idx_users_email', 'idx_users_created_at'
+    }
+    assert all(0.04 < recommendation['estimated_size_mb'] < 0.1 for recommendation in recommendations)
+
+
+def test_total_budget_limits_the_set(db_manager, workload):
+    recommendations = recommend(db_manager, workload, index_budget_mb='0.1')
+
+    assert len(recommendations) == 1
+    assert total_size(recommendations) <= 0.1 + 0.005
+
+
+def test_table_budget_limits_each_table(db_manager, workload):
+    recommendations = recommend(db_manager, workload, table_index_budget_mb='0.15')
+
+    assert len(recommendations) == 2
+    assert total_size(recommendations) <= 0.15 + 0.01
+
+
+def test_nothing_fits_a_tiny_budget(db_manager, workload):
+    assert recommend(db_manager, workload, table_index_budget_mb='0.01') == []
@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+import pytest
+
+import main
+
+QUANTILES = (0.0, 0.01, 0.25, 0.5, 0.9, 0.95, 0.99, 0.999, 1.0)
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[math.floor(q * (len(ordered) - 1))]
+
+
+@pytest.mark.parametrize('relative_accuracy', [0.01, 0.05])
+def test_quantiles_stay_within_the_relative_accuracy(relative_accuracy):
+    values = np.random.default_rng(7).lognormal(mean=-6, sigma=2, size=20000).tolist()
+    sketch = main.LatencySketch(relative_accuracy)
+    for value in values:
+        sketch.add(value)
+
+    for q in QUANTILES:
+        exact = exact_quantile(values, q)
+        assert abs(sketch.quantile(q) - exact) <= relative_accuracy * exact * (1 + 1e-9), q
+
+
+def test_merge_matches_a_single_sketch_and_survives_storage():
+    rng = np.random.default_rng(11)
+    first, second = rng.exponential(0.01, 5000).tolist(), rng.exponential(0.2, 500).tolist()
+    whole = main.LatencySketch()
+    left = main.LatencySketch()
+    right = main.LatencySketch()
+    for value in first:
+        whole.add(value)
+        left.add(value)
+    for value in second:
+        whole.add(value)
+        right.add(value)
+
+    merged = main.LatencySketch.from_json(left.merge(right).to_json())
+
+    assert merged.count == whole.count == 5500
+    assert merged.min == whole.min and merged.max == whole.max
+    for q in QUANTILES:
+        assert merged.quantile(q) == pytest.approx(whole.quantile(q))
+        exact = exact_quantile(first + second, q)
+        assert abs(merged.quantile(q) - exact) <= 0.01 * exact * (1 + 1e-9)
+
+
+def test_zero_latencies_and_empty_sketches():
+    sketch = main.LatencySketch()
+    assert sketch.quantile(0.5) is None
+    assert main.LatencySketch.from_json(None).count == 0
+
+    for value in [0.0] * 60 + [0.5] * 40:
+        sketch.add(value)
+
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(0.99) == pytest.approx(0.5, rel=0.01)
+    assert sketch.percentiles((50, 99)) == {'p50': 0.0, 'p99': sketch.quantile(0.99)}
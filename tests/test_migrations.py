@@ -0,0 +1,76 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import main
+
+BASELINE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'index_recommendation.db')
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    """A copy of the database as shipped before schema versioning (user_version 0)."""
+    path = str(tmp_path / 'baseline.db')
+    shutil.copy(BASELINE_DB, path)
+    conn = sqlite3.connect(path)
+    logged = conn.execute("SELECT COUNT(*) FROM query_logs").fetchone()[0]
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    conn.close()
+    manager = main.DatabaseManager(path)
+    manager.connect()
+    yield manager, logged
+    manager.log_store.close()
+    manager.conn.close()
+
+
+def columns(manager, table_name):
+    return {row['name'] for row in manager.execute_and_fetch(f"PRAGMA table_info({table_name})")}
+
+
+def test_migration_chain_upgrades_the_baseline_schema(baseline, config_manager):
+    manager, logged = baseline
+
+    assert manager.setup_tables() is True
+
+    latest = manager._migrations()[-1][0]
+    assert manager.conn.execute("PRAGMA user_version").fetchone()[0] == latest
+    assert main.DatabaseManager.METADATA_TABLES - {'query_logs'} <= set(manager.get_tables())
+    # The logs moved into the daily partitions and the old table is gone
+    assert 'query_logs' not in manager.get_tables()
+    assert manager.log_store.count() == logged
+    assert {'fingerprint', 'index_definition', 'schema_version', 'data_signature', 'result'} <= columns(
+        manager, 'performance_comparisons'
+    )
+    assert {'use_count', 'last_used'} <= columns(manager, 'execution_plans')
+    # The application tables are left alone
+    assert manager.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 5
+
+    monitor = main.QueryMonitor(manager, config_manager)
+    monitor.backfill_fingerprints()
+    monitor.backfill_execution_plans()
+    monitor.close()
+    assert manager.conn.execute("SELECT SUM(query_count) FROM query_fingerprints").fetchone()[0] == logged
+
+
+def test_migrations_run_once(baseline):
+    manager, logged = baseline
+    manager.setup_tables()
+    schema = manager.conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall()
+
+    assert manager.setup_tables() is True
+
+    assert manager.conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall() == schema
+    assert manager.log_store.count() == logged
+
+
+def test_fresh_database_reaches_the_latest_version(tmp_path):
+    manager = main.DatabaseManager(str(tmp_path / 'fresh.db'))
+    manager.connect()
+
+    assert manager.setup_tables() is True
+
+    assert manager.conn.execute("PRAGMA user_version").fetchone()[0] == manager._migrations()[-1][0]
+    assert main.DatabaseManager.METADATA_TABLES - {'query_logs'} <= set(manager.get_tables())
+    manager.conn.close()
@@ -0,0 +1,55 @@
+import pytest
+
+import main
+
+QUERY = "SELECT * FROM users WHERE status = 'inactive'"
+CREATE_INDEX = "CREATE INDEX idx_users_status ON users (status)"
+
+
+@pytest.mark.parametrize('mode', ['snapshot', 'memory', 'live'])
+def test_comparison_leaves_the_database_untouched(db_manager, config_manager, mode):
+    comparer = main.PerformanceComparer(db_manager, config_manager)
+
+    result = comparer.compare_with_index(QUERY, CREATE_INDEX, mode=mode)
+
+    assert result['success'], result
+    assert result['mode'] == mode
+    assert db_manager.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+    assert 'idx_users_status' not in [row[1] for row in db_manager.conn.execute("PRAGMA index_list(users)")]
+
+
+def test_snapshot_is_the_default_mode(db_manager, config_manager):
+    comparer = main.PerformanceComparer(db_manager, config_manager)
+
+    result = comparer.compare_with_index(QUERY, CREATE_INDEX)
+
+    assert comparer.mode == 'snapshot'
+    assert result['mode'] == 'snapshot'
+    assert result['interleaved'] is True
+
+
+def test_buffered_capture_leaves_the_journal_mode_alone(db_manager, config_manager):
+    config_manager.set('MONITORING', 'capture_mode', 'buffered')
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    # Once a flush returns the writer thread has opened its connection
+    assert monitor.flush(10)
+
+    monitor.capture(QUERY)
+    assert monitor.flush(10)
+    monitor.close()
+
+    assert db_manager.log_store.count() == 1
+    assert db_manager.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'delete'
+
+
+@pytest.mark.parametrize('query, kind', [
+    ("SELECT * FROM users WHERE status = 'inactive'", 'read'),
+    ("WITH recent AS (SELECT user_id FROM users WHERE user_id > 190) SELECT * FROM recent", 'read'),
+    ("WITH doomed AS (SELECT 6 AS user_id) DELETE FROM users WHERE user_id IN (SELECT user_id FROM doomed)", 'write'),
+    ("UPDATE users SET status = 'active' WHERE user_id = 4", 'write'),
+    ("CREATE INDEX idx_users_email ON users (email)", None),
+])
+def test_replay_classifies_statements_by_their_parsed_type(db_manager, config_manager, query, kind):
+    replayer = main.WorkloadReplayer(db_manager, config_manager)
+
+    assert replayer._kind(query) == kind
@@ -0,0 +1,71 @@
+import os
+import threading
+
+import main
+
+
+def log_row(timestamp):
+    return {'query': 'SELECT 1', 'execution_time': 0.001, 'timestamp': timestamp, 'fingerprint': 'f'}
+
+
+def in_thread(function):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('value', function()))
+    thread.start()
+    thread.join()
+    return result['value']
+
+
+def test_drop_before_leaves_other_threads_to_close_their_own_connections(tmp_path):
+    store = main.QueryLogStore(str(tmp_path / 'logs'))
+    store.insert([log_row('2024-03-01 10:00:00'), log_row('2024-03-05 10:00:00')])
+    opened = {}
+    reader_started, dropped, reader_done = threading.Event(), threading.Event(), threading.Event()
+
+    def read_across_the_drop():
+        opened['conn'] = store.connection('20240301')
+        reader_started.set()
+        dropped.wait(10)
+        # A connection in use when the partition is dropped keeps working
+        opened['stale_read'] = opened['conn'].execute("SELECT COUNT(*) FROM query_logs").fetchone()[0]
+        # The next access closes it and finds the partition gone
+        opened['after_drop'] = store.connection('20240301')
+        opened['rows'] = len(list(store.fetch("SELECT id FROM query_logs")))
+        store.close()
+        reader_done.set()
+
+    reader = threading.Thread(target=read_across_the_drop)
+    reader.start()
+    reader_started.wait(10)
+
+    assert store.drop_before('2024-03-03') == 1
+    # Hidden at once, deleted once the reader lets go of it
+    assert store.partitions() == ['20240305']
+    assert os.path.exists(store.path('20240301'))
+    dropped.set()
+    reader.join(10)
+
+    assert reader_done.is_set()
+    assert not os.path.exists(store.path('20240301'))
+    assert os.path.exists(store.path('20240305'))
+    assert store.partitions() == ['20240305']
+    assert opened['stale_read'] == 1
+    assert opened['after_drop'] is None
+    assert opened['rows'] == 1
+    assert store.count() == 1
+    store.close()
+
+
+def test_dropped_partition_can_be_recreated(tmp_path):
+    store = main.QueryLogStore(str(tmp_path / 'logs'))
+    store.insert([log_row('2024-03-01 10:00:00')])
+    assert in_thread(store.count) == 1
+
+    # The finished thread's connection does not hold the partition back
+    store.drop_before('2024-03-03')
+    assert not os.path.exists(store.path('20240301'))
+    store.insert([log_row('2024-03-01 11:00:00'), log_row('2024-03-01 12:00:00')])
+
+    assert store.count() == 2
+    assert in_thread(lambda: len(list(store.fetch("SELECT id FROM query_logs")))) == 2
+    store.close()
@@ -0,0 +1,65 @@
+import sqlite3
+
+import main
+
+
+def make_record(query, timestamp, execution_time=0.01, sampled=True):
+    fingerprint, normalized_query = main.QueryFingerprinter().fingerprint(query)
+    return {
+        'query': query,
+        'normalized_query': normalized_query,
+        'fingerprint': fingerprint,
+        'execution_time': execution_time,
+        'first_row_time': execution_time,
+        'step_time': execution_time,
+        'rows_returned': 1,
+        'execution_plan': '2|0|0|SCAN users',
+        'timestamp': timestamp,
+        'sampled': sampled
+    }
+
+
+def test_failed_partition_is_retried_without_logging_twice(db_manager, monkeypatch):
+    writer = main.QueryLogWriter(db_manager.db_file, log_store=db_manager.log_store)
+    monkeypatch.setattr(writer, 'RETRY_DELAY', 0)
+    records = [
+        make_record("SELECT * FROM users WHERE user_id = 1", '2024-03-01 10:00:00'),
+        make_record("SELECT * FROM users WHERE user_id = 2", '2024-03-02 10:00:00'),
+        make_record("SELECT * FROM users WHERE user_id = 3", '2024-03-02 11:00:00', sampled=False),
+    ]
+    insert = db_manager.log_store.insert
+    calls = []
+
+    def flaky_insert(rows, skip_existing=False):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise sqlite3.OperationalError('database is locked')
+        return insert(rows, skip_existing)
+
+    monkeypatch.setattr(db_manager.log_store, 'insert', flaky_insert)
+    conn = sqlite3.connect(db_manager.db_file)
+
+    writer.write(conn, records)
+
+    assert calls == [1, 1, 1]
+    assert db_manager.log_store.count() == 2
+    assert conn.execute("SELECT SUM(query_count) FROM query_fingerprints").fetchone()[0] == 3
+    assert conn.execute("SELECT SUM(use_count) FROM execution_plans").fetchone()[0] == 2
+    conn.close()
+
+
+def test_batch_is_dropped_after_the_last_attempt(db_manager, monkeypatch, caplog):
+    writer = main.QueryLogWriter(db_manager.db_file, log_store=db_manager.log_store)
+    monkeypatch.setattr(writer, 'RETRY_DELAY', 0)
+
+    def failing_insert(rows, skip_existing=False):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(db_manager.log_store, 'insert', failing_insert)
+    conn = sqlite3.connect(db_manager.db_file)
+
+    assert writer.write(conn, [make_record("SELECT 1", '2024-03-01 10:00:00')]) is None
+
+    assert "Dropped 1 query log rows and the statistics of 1 executions after 3 attempts" in caplog.text
+    assert conn.execute("SELECT COUNT(*) FROM query_fingerprints").fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,36 @@
+import main
+
+
+def test_unsampled_executions_skip_plans_and_logs(db_manager, config_manager, monkeypatch):
+    config_manager.set('MONITORING', 'sample_rate', '0.1')
+    config_manager.set('MONITORING', 'slow_query_threshold', '60')
+    monitor = main.QueryMonitor(db_manager, config_manager)
+    explained = []
+    monkeypatch.setattr(monitor, '_get_execution_plan', lambda query, fingerprint: explained.append(query))
+    monkeypatch.setattr(main.random, 'random', lambda: 0.5)
+
+    for user_id in range(1, 21):
+        result = monitor.capture(f"SELECT * FROM users WHERE user_id = {user_id}")
+        assert result['sampled'] is False
+        assert result['execution_plan'] is None
+
+    assert explained == []
+    assert db_manager.conn.execute("SELECT COUNT(*) FROM query_fingerprints").fetchone()[0] == 0
+
+    monitor.close()
+    assert db_manager.log_store.count() == 0
+    assert db_manager.conn.execute("SELECT COUNT(*) FROM execution_plans").fetchone()[0] == 0
+    assert db_manager.conn.execute("SELECT SUM(query_count) FROM query_fingerprints").fetchone()[0] == 20
+
+
+def test_sampled_execution_is_logged_with_its_plan(db_manager, config_manager):
+    config_manager.set('MONITORING', 'sample_rate', '0.1')
+    monitor = main.QueryMonitor(db_manager, config_manager)
+
+    result = monitor.capture("SELECT * FROM users WHERE username = 'user1'", force=True)
+    monitor.close()
+
+    assert result['sampled'] is True
+    assert 'SCAN' in result['execution_plan']
+    assert result['query_id'] is not None
+    assert db_manager.log_store.count() == 1
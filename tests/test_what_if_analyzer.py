@@ -0,0 +1,26 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('statement, parsed', [
+    ("CREATE INDEX idx_users_email ON users (email)", ('idx_users_email', 'users', ['email'])),
+    ("  create unique index if not exists \"idx_u\" on [users] (status, email DESC);\n",
+     ('idx_u', 'users', ['status', 'email'])),
+    ("CREATE INDEX idx_active ON users (email) WHERE status IS NOT NULL;", ('idx_active', 'users', ['email'])),
+])
+def test_single_create_index_statements_parse(statement, parsed):
+    assert main.WhatIfAnalyzer.parse_create_index(statement) == parsed
+
+
+@pytest.mark.parametrize('statement', [
+    "CREATE INDEX idx_a ON users (email); DROP TABLE users",
+    "CREATE INDEX idx_a ON users (email); CREATE INDEX idx_b ON users (status)",
+    "CREATE INDEX idx_a ON users (email) -- comment",
+    "CREATE INDEX idx_a ON users (email /* comment */)",
+    "CREATE INDEX idx_a ON users (email) WHERE status = 'active'",
+    "SELECT 1; CREATE INDEX idx_a ON users (email)",
+    "EXPLAIN CREATE INDEX idx_a ON users (email)",
+])
+def test_anything_but_one_create_index_statement_is_rejected(statement):
+    assert main.WhatIfAnalyzer.parse_create_index(statement) is None
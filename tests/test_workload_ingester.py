@@ -0,0 +1,71 @@
+import io
+import json
+
+import main
+
+
+def read_sql(text):
+    ingester = main.WorkloadIngester.__new__(main.WorkloadIngester)
+    return [entry['query'] for entry in ingester._read_sql(io.StringIO(text))]
+
+
+def test_apostrophes_in_comments_do_not_merge_statements():
+    text = (
+        "-- don't merge the statements below\n"
+        "SELECT * FROM users WHERE user_id = 1;\n"
+        "/* it's a block comment */ SELECT * FROM users WHERE user_id = 2;\n"
+        "SELECT * FROM users WHERE user_id = 3; -- trailing note, isn't it\n"
+        "SELECT * FROM users WHERE user_id = 4;\n"
+    )
+
+    assert read_sql(text) == [
+        "SELECT * FROM users WHERE user_id = 1",
+        "SELECT * FROM users WHERE user_id = 2",
+        "SELECT * FROM users WHERE user_id = 3",
+        "SELECT * FROM users WHERE user_id = 4",
+    ]
+
+
+def test_quotes_and_semicolons_inside_literals_and_comments():
+    text = (
+        "SELECT * FROM users WHERE username = 'o''brien; jr';\n"
+        "SELECT 1 /* ; */, 2 -- ;\n"
+        ";\n"
+        "SELECT 'multi\nline; string' AS s; SELECT \"odd;name\" FROM t;\n"
+    )
+
+    assert read_sql(text) == [
+        "SELECT * FROM users WHERE username = 'o''brien; jr'",
+        "SELECT 1 /* ; */, 2 -- ;",
+        "SELECT 'multi\nline; string' AS s",
+        "SELECT \"odd;name\" FROM t",
+    ]
+
+
+def test_trigger_bodies_and_unterminated_last_statement():
+    text = (
+        "CREATE TRIGGER t AFTER INSERT ON users BEGIN\n"
+        "  UPDATE users SET status = 'new' WHERE user_id = NEW.user_id;\n"
+        "END;\n"
+        "SELECT COUNT(*) FROM users\n"
+    )
+
+    statements = read_sql(text)
+
+    assert len(statements) == 2
+    assert statements[0].startswith("CREATE TRIGGER") and statements[0].endswith("END")
+    assert statements[1] == "SELECT COUNT(*) FROM users"
+
+
+def test_json_arrays_and_json_lines(db_manager, tmp_path):
+    ingester = main.WorkloadIngester(db_manager)
+    array_path = tmp_path / 'workload.json'
+    array_path.write_text(json.dumps([
+        {'query': "SELECT * FROM users WHERE user_id = 1", 'duration_ms': 2},
+        "SELECT * FROM users WHERE user_id = 2",
+    ]))
+    lines_path = tmp_path / 'lines.json'
+    lines_path.write_text('\n{"query": "SELECT 1"}\n{"query": "SELECT 2"}\n')
+
+    assert ingester.ingest(str(array_path))['statements'] == 2
+    assert ingester.ingest(str(lines_path))['statements'] == 2